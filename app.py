@@ -1,5 +1,13 @@
+import logging
+import uuid
 import streamlit as st
-from simulation_engine import SimulationEngine
+from render_service import RenderService, RenderTimeout
+from progressive_renderer import ProgressiveRenderer
+from instrumentation import Tracer
+
+# Log JSON de cada renderização quando THIN_FILM_TRACE=1
+if Tracer.LOG_BY_DEFAULT:
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
 
 # -- ELEMENTOS DA PÁGINA -- 
 st.set_page_config(page_title="Simulador de Interferência em Filmes Finos", layout="wide")
@@ -42,17 +50,102 @@ interference_order = st.sidebar.selectbox(
     help="Geralmente usa-se m = 1 para a cor principal é observada."
 )
 
+# Diagnóstico de desempenho (tempo e tamanho dos arrays por etapa)
+diagnostics = st.sidebar.checkbox("Diagnóstico de desempenho", value=False, help="Mostra o tempo e os bytes de cada etapa da simulação.")
+tracing = diagnostics or Tracer.LOG_BY_DEFAULT
+
+def show_trace(trace):
+    if not diagnostics or trace is None:
+        return
+
+    with st.expander(f"⏱️ Diagnóstico: {trace.total_seconds * 1000:.1f} ms"):
+        st.dataframe([
+            {
+                "Etapa": "  " * span["depth"] + span["name"],
+                "Tempo (ms)": round(span["seconds"] * 1000, 2),
+                "Saída (KB)": round(span["output_bytes"] / 1024, 1),
+                "Cache": span.get("cache", ""),
+            }
+            for span in trace.spans
+        ], width='stretch')
+
+# Serviço de renderização compartilhado por todas as sessões (agrupa pedidos idênticos)
+render_service = RenderService.shared()
+
+def render(method, engine_params, *args, **kwargs):
+    try:
+        return render_service.render(method, engine_params, *args, **kwargs)
+    except RenderTimeout:
+        st.error("O servidor está ocupado e a simulação não terminou a tempo. Tente novamente em instantes.")
+        st.stop()
+
+# Renderização progressiva: acima desta resolução aparece primeiro uma prévia grossa, refinada em seguida
+PROGRESSIVE_MIN_RESOLUTION = 300
+progressive_renderer = ProgressiveRenderer.shared()
+render_session = st.session_state.setdefault("render_session", uuid.uuid4().hex)
+
+def render_progressive(show, method, engine_params, view, **kwargs):
+    '''
+    Chama show(resultado) para cada etapa, da prévia até a resolução pedida
+    view: identifica a aba; um novo pedido da mesma aba (controle alterado) cancela o refinamento anterior
+    Retorna (resultado final, tempos até a primeira e até a última imagem)
+    '''
+
+    if engine_params["resolution"] < PROGRESSIVE_MIN_RESOLUTION:
+        result = render(method, engine_params, **kwargs)
+        show(result)
+        return result, None
+
+    timings = {}
+    result = None
+    try:
+        for step in progressive_renderer.render(method, engine_params, session=f"{render_session}:{view}", **kwargs):
+            result = step["result"]
+            show(result)
+            timings.setdefault("first", step["seconds"])
+            timings["final"] = step["seconds"]
+    except RenderTimeout:
+        st.error("O servidor está ocupado e a simulação não terminou a tempo. Tente novamente em instantes.")
+        st.stop()
+
+    # Nenhuma etapa entregue (outra execução da mesma aba assumiu a sessão): resultado pedido sem prévias
+    if not timings:
+        result = render(method, engine_params, **kwargs)
+        show(result)
+        return result, None
+
+    return result, timings
+
+def show_timings(timings):
+    if not diagnostics or not timings:
+        return
+
+    st.caption(f"Primeira imagem: {timings['first'] * 1000:.0f} ms · Imagem final: {timings['final'] * 1000:.0f} ms")
+
+if diagnostics:
+    service_stats = render_service.stats()
+    st.sidebar.caption(
+        f"Fila: {service_stats['queue_depth']} · Rodando: {service_stats['running']}/{service_stats['workers']} · "
+        f"Agrupados: {service_stats['coalesced']} · p95: {service_stats['request_latency']['p95_ms']:.0f} ms"
+    )
+
+    progressive_stats = progressive_renderer.stats()
+    st.sidebar.caption(
+        f"Progressivo p95 · primeira imagem: {progressive_stats['time_to_first']['p95_ms']:.0f} ms · "
+        f"final: {progressive_stats['time_to_final']['p95_ms']:.0f} ms · cancelados: {progressive_stats['cancelled']}"
+    )
+
 # Abas para separar os níveis
 tab1, tab2, tab3 = st.tabs(["📈 Nível 1: Gráfico 1D", "👓 Nível 2: Simulação da Lente 2D", "Nível 3: Simulação da Lente 3D"])
 
 # Para a aba 1 -- Estudo da relação entre o ângulo de inclinação da lente em relação a fonte de luz e o comprimento de onda
 with tab1:
-    simulation = SimulationEngine(
-        n_film=film_index, d=film_thickness, m=interference_order, 
-    )
+    with Tracer.render("Nível 1", enabled=tracing) as trace_1D:
+        film_params = dict(n_film=film_index, d=film_thickness, m=interference_order)
+        figure, angles, wavelengths = render('simulation_figure_1D', film_params)
 
-    figure, angles, wavelengths = simulation.simulation_figure_1D()
     st.plotly_chart(figure, width='stretch')
+    show_trace(trace_1D)
 
     # -- INTERAÇÕES ADICIONAIS --
 
@@ -85,25 +178,39 @@ with tab2:
         lens_diameter_mm = st.number_input("Diâmetro da Lente (mm)", min_value=30, max_value=80, value=50, step=1, help="Tamanho aproximado do aro do óculos.")
         glass_index = 1.50 # Índice comum para vidro/resina padrão
         resolution = st.slider("Resolução da Simulação", 100, 500, 200, 50, help="Mais pixels = mais bonito, mas mais lento.", key="resolution_2D")
+        spectral_2D = st.checkbox("Cor espectral (CIE 1931 / D65)", key="spectral_2D", help="Integra o espectro de refletância completo do filme em vez de um único comprimento de onda.")
 
-        simulation = SimulationEngine(
-            n_film=film_index, d=film_thickness, m=interference_order, 
-            diopter=diopter, resolution=resolution
-        )
+        st.write("---")
+        metric_slot = st.empty()
+
+    with col_sim:
+        image_slot = st.empty()
 
-        img_RGB, theta_max_degree = simulation.simulation_grid_2D(
-            lens_diameter_mm=lens_diameter_mm, glass_index=glass_index) 
+        # Cada etapa da renderização progressiva substitui a anterior
+        def show_2D(result):
+            img_RGB, theta_max_degree = result
+            image_slot.image(img_RGB, caption=f"Simulação Física: Lente de {diopter}D ({lens_diameter_mm}mm)", width='stretch')
 
-        st.write("---")
-        st.metric("Ângulo Máximo na Borda", f"{theta_max_degree:.1f}°")
-        st.caption(f"Isso significa que na pontinha da armação, a luz bate inclinada a {theta_max_degree:.1f} graus.")
+            with metric_slot.container():
+                st.metric("Ângulo Máximo na Borda", f"{theta_max_degree:.1f}°")
+                st.caption(f"Isso significa que na pontinha da armação, a luz bate inclinada a {theta_max_degree:.1f} graus.")
+
+        with Tracer.render("Nível 2", enabled=tracing) as trace_2D:
+            engine_params = dict(
+                n_film=film_index, d=film_thickness, m=interference_order, 
+                diopter=diopter, resolution=resolution
+            )
+
+            method = 'simulation_spectral_2D' if spectral_2D else 'simulation_grid_2D'
+            (img_RGB, theta_max_degree), timings_2D = render_progressive(show_2D, method, engine_params, "2D",
+                lens_diameter_mm=lens_diameter_mm, glass_index=glass_index)
 
-    with col_sim:               
-        st.image(img_RGB, caption=f"Simulação Física: Lente de {diopter}D ({lens_diameter_mm}mm)", width='stretch')
-       
         if theta_max_degree < 15:
             st.warning("Nota: Para graus baixos (< 4D), a curvatura é pequena. A cor mudará pouco do centro para a borda (efeito sutil), o que é fiel à realidade.")
 
+        show_timings(timings_2D)
+        show_trace(trace_2D)
+
 # Para a aba 3 -- Estudo da interferência de películas finas para uma fonte de diferentes distâncias em geometria 3D, variando inclinação da lente
 with tab3:
     col_params, col_sim= st.columns([1, 3])
@@ -146,13 +253,33 @@ with tab3:
         st.caption("Nota: A cor é calculada dinamicamente baseada na normal da superfície em relação à câmera (Luz).")
 
         resolution = st.slider("Resolução da Simulação", 100, 500, 200, 50, help="Mais pixels = mais bonito, mas mais lento.", key="resolution_3D")
+        spectral_3D = st.checkbox("Cor espectral (CIE 1931 / D65)", key="spectral_3D", help="Integra o espectro de refletância completo do filme em vez de um único comprimento de onda.")
         
     with col_sim:
-        simulation = SimulationEngine(
-            n_film=film_index, d=film_thickness, m=interference_order,
-            diopter=diopter, resolution=resolution,
-            rot_x=rot_x, rot_y=rot_y,
-        )
+        figure_slot = st.empty()
+
+        with Tracer.render("Nível 3", enabled=tracing) as trace_3D:
+            engine_params = dict(
+                n_film=film_index, d=film_thickness, m=interference_order,
+                diopter=diopter, resolution=resolution,
+                rot_x=rot_x, rot_y=rot_y,
+            )
+
+            show_3D = lambda figure: figure_slot.plotly_chart(figure, width='stretch')
+
+            if spectral_3D:
+                figure, timings_3D = render_progressive(show_3D, 'simulation_spectral_3D', engine_params, "3D",
+                    glass_index=1.5, light_distance_mm=light_distance)
+
+            else:
+                figure, timings_3D = render_progressive(show_3D, 'simulation_grid_3D', engine_params, "3D",
+                    glass_index=1.5, light_distance_mm=light_distance, payload="compact")
+
+        show_timings(timings_3D)
+
+        if figure.layout.meta:
+            payload_stats = figure.layout.meta['payload']
+            build = f"cache ({payload_stats['cache']})" if 'cache' in payload_stats else f"{payload_stats['build_seconds'] * 1000:.0f} ms"
+            st.caption(f"Payload 3D: {payload_stats['bytes'] / 1024:.0f} KB · {payload_stats['vertices']} vértices · {build}")
 
-        figure = simulation.simulation_grid_3D(glass_index=1.5, light_distance_mm=light_distance)
-        st.plotly_chart(figure, width='stretch')
\ No newline at end of file
+        show_trace(trace_3D)
\ No newline at end of file
@@ -0,0 +1,288 @@
+import argparse
+import csv
+import hashlib
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from simulation_engine import SimulationEngine
+from geometry import Geometry
+from visuals import Visuals
+from image_io import ImageIO
+
+# Valores padrão de cada parâmetro (mesmos do app)
+DEFAULT_JOB = {
+    'mode': '2D',
+    'n_film': 1.413,
+    'd': 200.0,
+    'm': 1,
+    'diopter': 5.0,
+    'resolution': 200,
+    'rot_x': 0.0,
+    'rot_y': 0.0,
+    'light_distance_mm': None,
+    'lens_diameter_mm': 50.0,
+    'glass_index': 1.5,
+}
+
+INTEGER_FIELDS = ('m', 'resolution')
+MANIFEST_NAME = 'manifest.jsonl'
+
+
+class BatchRender:
+    def __init__(self, output_dir, formats=('png', 'npz'), workers=None):
+        '''
+        Renderização headless de varreduras de parâmetros com um pool de processos
+        Cada job concluído vira uma linha no manifest.jsonl; ao reiniciar, jobs já concluídos são pulados
+        '''
+
+        self.output_dir = output_dir
+        self.formats = tuple(formats)
+        self.workers = workers or os.cpu_count()
+
+
+    # Normalização de um job lido de CSV/JSONL/produto cartesiano
+    @staticmethod
+    def normalize_job(raw_job):
+        job = dict(DEFAULT_JOB)
+
+        for name, value in raw_job.items():
+            if name not in DEFAULT_JOB:
+                raise ValueError(f"Parâmetro desconhecido no job: {name}")
+
+            if value in ('', 'None', 'none', None):
+                value = None
+            elif name == 'mode':
+                value = str(value).upper()
+            elif name in INTEGER_FIELDS:
+                value = int(float(value))
+            else:
+                value = float(value)
+
+            job[name] = value
+
+        if job['mode'] not in ('2D', '3D'):
+            raise ValueError(f"Modo inválido: {job['mode']}")
+
+        return job
+
+
+    # Identificador estável do job (hash dos parâmetros)
+    @staticmethod
+    def job_id(job):
+        payload = json.dumps(job, sort_keys=True)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+
+    @classmethod
+    def read_sweep(cls, path):
+        '''
+        Lê jobs de um arquivo .csv (cabeçalho = nomes dos parâmetros) ou .jsonl (um objeto por linha)
+        '''
+
+        with open(path, newline='') as file:
+            if path.endswith('.csv'):
+                rows = list(csv.DictReader(file))
+            else:
+                rows = [json.loads(line) for line in file if line.strip()]
+
+        return [cls.normalize_job(row) for row in rows]
+
+
+    @classmethod
+    def cartesian_product(cls, spec):
+        '''
+        Gera os jobs a partir de um dicionário parâmetro -> lista de valores
+        '''
+
+        names = list(spec)
+        values = [spec[name] if isinstance(spec[name], list) else [spec[name]] for name in names]
+        return [cls.normalize_job(dict(zip(names, combination))) for combination in itertools.product(*values)]
+
+
+    # Jobs já concluídos segundo o manifest
+    def completed_jobs(self):
+        manifest_path = os.path.join(self.output_dir, MANIFEST_NAME)
+        if not os.path.exists(manifest_path):
+            return set()
+
+        completed = set()
+        with open(manifest_path) as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue # última linha truncada por uma interrupção
+
+                # Jobs que falharam são tentados de novo na próxima execução
+                if entry.get('status', 'ok') != 'ok':
+                    continue
+
+                outputs = entry.get('outputs', [])
+                if all(os.path.exists(os.path.join(self.output_dir, name)) for name in outputs):
+                    completed.add(entry['job_id'])
+
+        return completed
+
+
+    def run(self, jobs, progress=None):
+        '''
+        Distribui os jobs pendentes pelo pool de processos e registra cada resultado no manifest
+        Um job que falha é registrado com status 'failed' (e refeito na próxima execução) sem parar os demais
+        Retorna o número de jobs processados nesta execução; os que falharam ficam em self.failed
+        '''
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        completed = self.completed_jobs()
+
+        pending = {}
+        for job in jobs:
+            identifier = self.job_id(job)
+            if identifier not in completed:
+                pending[identifier] = job
+
+        resolutions = sorted({job['resolution'] for job in pending.values()})
+        manifest_path = os.path.join(self.output_dir, MANIFEST_NAME)
+
+        done = 0
+        self.failed = 0
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=(resolutions,)) as executor, \
+                open(manifest_path, 'a') as manifest:
+
+            futures = {
+                executor.submit(_render_job, identifier, job, self.output_dir, self.formats): identifier
+                for identifier, job in pending.items()
+            }
+
+            for future in as_completed(futures):
+                try:
+                    entry = future.result()
+                except Exception as error: # processo do pool morreu (ex.: falta de memória)
+                    identifier = futures[future]
+                    entry = {'job_id': identifier, 'job': pending[identifier], 'status': 'failed',
+                             'error': f"{type(error).__name__}: {error}", 'outputs': [], 'seconds': 0.0, 'pid': None}
+
+                self.failed += entry['status'] != 'ok'
+                manifest.write(json.dumps(entry) + '\n')
+                manifest.flush()
+
+                done += 1
+                if progress is not None:
+                    progress(done, len(pending), entry)
+
+        return done
+
+
+# -- Funções executadas nos processos do pool (precisam estar no nível do módulo) --
+
+def _init_worker(resolutions):
+    '''
+    Prepara uma única vez por processo os dados somente leitura compartilhados pelos jobs
+    (LUT espectral e mapas de índice radial), em vez de enviá-los junto de cada tarefa
+    '''
+
+    Visuals.spectral_lut()
+    for resolution in resolutions:
+        Geometry(0.0, 0.0, 0.0, resolution).radial_index_map()
+
+
+def _render_job(identifier, job, output_dir, formats):
+    '''
+    Renderiza um job; qualquer erro vira uma entrada com status 'failed' no manifest
+    em vez de derrubar a execução inteira
+    '''
+
+    start = time.perf_counter()
+    try:
+        outputs = _write_job(identifier, job, output_dir, formats)
+    except Exception as error:
+        return {
+            'job_id': identifier,
+            'job': job,
+            'status': 'failed',
+            'error': f"{type(error).__name__}: {error}",
+            'outputs': [],
+            'seconds': time.perf_counter() - start,
+            'pid': os.getpid(),
+        }
+
+    return {
+        'job_id': identifier,
+        'job': job,
+        'status': 'ok',
+        'outputs': outputs,
+        'seconds': time.perf_counter() - start,
+        'pid': os.getpid(),
+    }
+
+
+def _write_job(identifier, job, output_dir, formats):
+    engine = SimulationEngine(
+        n_film=job['n_film'], d=job['d'], m=job['m'],
+        diopter=job['diopter'], resolution=job['resolution'],
+        rot_x=job['rot_x'], rot_y=job['rot_y'],
+        use_cache=False, # jobs únicos nunca acertam o cache: cada processo só encheria o seu
+    )
+
+    if job['mode'] == '2D':
+        img_RGB, theta_max_degree = engine.simulation_grid_2D(job['lens_diameter_mm'], job['glass_index'])
+
+        # Comprimento de onda pelo mesmo perfil radial da imagem, espalhado pelo mapa de índices
+        radii, index_map = engine.geometry_model.radial_index_map()
+        theta_profile = (radii * theta_max_degree).astype(engine.geometry_model.dtype, copy=False)
+        arrays = {
+            'image_RGB': img_RGB,
+            'wavelength': engine.physics_model.calculate_wavelength(theta_profile)[index_map],
+            'theta_max_degree': np.float64(theta_max_degree),
+        }
+
+    else:
+        img_RGB, wavelength_grid = engine.simulation_map_3D(job['glass_index'], job['light_distance_mm'])
+        arrays = {'image_RGB': img_RGB, 'wavelength': wavelength_grid}
+
+    outputs = []
+    if 'png' in formats:
+        ImageIO.write_png(os.path.join(output_dir, f"{identifier}.png"), img_RGB)
+        outputs.append(f"{identifier}.png")
+
+    if 'npz' in formats:
+        np.savez_compressed(os.path.join(output_dir, f"{identifier}.npz"), **arrays)
+        outputs.append(f"{identifier}.npz")
+
+    return outputs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Renderização em lote (headless) de configurações de lentes")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--sweep', help="Arquivo .csv ou .jsonl com um job por linha")
+    source.add_argument('--product', help="Arquivo .json com parâmetro -> lista de valores (produto cartesiano)")
+    parser.add_argument('--output', required=True, help="Diretório de saída (PNG/NPZ + manifest.jsonl)")
+    parser.add_argument('--workers', type=int, default=None, help="Número de processos (padrão: núcleos da CPU)")
+    parser.add_argument('--formats', nargs='+', choices=['png', 'npz'], default=['png', 'npz'])
+    args = parser.parse_args(argv)
+
+    if args.sweep:
+        jobs = BatchRender.read_sweep(args.sweep)
+    else:
+        with open(args.product) as file:
+            jobs = BatchRender.cartesian_product(json.load(file))
+
+    renderer = BatchRender(args.output, args.formats, args.workers)
+
+    def progress(done, total, entry):
+        status = '' if entry['status'] == 'ok' else f" FALHOU ({entry['error']})"
+        print(f"[{done}/{total}] {entry['job_id']} {entry['job']['mode']} {entry['seconds']:.2f}s{status}", flush=True)
+
+    start = time.perf_counter()
+    done = renderer.run(jobs, progress)
+    elapsed = time.perf_counter() - start
+
+    print(f"{done - renderer.failed} jobs renderizados, {renderer.failed} com falha "
+          f"({len(jobs) - done} já concluídos) em {elapsed:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
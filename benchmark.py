@@ -0,0 +1,304 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+import numpy as np
+from simulation_engine import SimulationEngine
+from cache import ResultCache
+
+# Etapas medidas em cada nível, na ordem do pipeline
+# Cada etapa roda com as anteriores já em cache, então o tempo medido é só o dela
+STAGES = {
+    '1D': [
+        ('figure_1D', lambda engine, case: engine.simulation_figure_1D()),
+    ],
+    '2D': [
+        ('theta_grid_2D', lambda engine, case: engine.theta_grid_2D(case['lens_diameter_mm'], case['glass_index'])),
+        ('grid_2D', lambda engine, case: engine.simulation_grid_2D(case['lens_diameter_mm'], case['glass_index'])),
+    ],
+    '3D': [
+        ('grid_3D', lambda engine, case: engine.grid_3D()),
+        ('surface_3D', lambda engine, case: engine.surface_grid_3D(case['glass_index'])),
+        ('normals_3D', lambda engine, case: engine.surface_normals_3D(case['glass_index'])),
+        ('rotation_3D', lambda engine, case: engine.rotated_surface_3D(case['glass_index'])),
+        ('light_3D', lambda engine, case: engine.light_vectors_3D(case['glass_index'], case['light_distance_mm'])),
+        ('theta_3D', lambda engine, case: engine.theta_grid_3D(case['glass_index'], case['light_distance_mm'])),
+        ('wavelength_3D', lambda engine, case: engine.wavelength_grid_3D(case['glass_index'], case['light_distance_mm'])),
+        ('figure_3D', lambda engine, case: engine.simulation_grid_3D(case['glass_index'], case['light_distance_mm'])),
+    ],
+}
+
+# Módulos de interface que o núcleo numérico não pode carregar na importação
+GUI_MODULES = ('plotly', 'streamlit')
+
+
+class Benchmark:
+    def __init__(self, resolutions, diopters, lights, rotations=(0.0,), repeat=3, backend=None):
+        '''
+        Mede as três simulações sobre a grade resoluções x dioptrias x fontes de luz x rotações
+        lights: lista com None (Sol) e/ou distâncias da lâmpada em mm
+        backend: caminho fundido da lente 3D (ver FusedKernels); None mede o caminho de referência
+        '''
+
+        self.resolutions = list(resolutions)
+        self.diopters = list(diopters)
+        self.lights = list(lights)
+        self.rotations = list(rotations)
+        self.repeat = repeat
+        self.backend = backend
+
+
+    def cases(self):
+        # O nível 1D não depende de geometria: um único caso
+        yield self._case('1D', resolution=0, diopter=0.0, light_distance_mm=None, rotation=0.0)
+
+        for resolution in self.resolutions:
+            for diopter in self.diopters:
+                yield self._case('2D', resolution, diopter, None, 0.0)
+
+                for light_distance_mm in self.lights:
+                    for rotation in self.rotations:
+                        yield self._case('3D', resolution, diopter, light_distance_mm, rotation)
+
+
+    @staticmethod
+    def _case(level, resolution, diopter, light_distance_mm, rotation):
+        light = 'sun' if light_distance_mm is None else f"lamp{light_distance_mm:g}"
+        return {
+            'id': f"{level}/res{resolution}/D{diopter:g}/{light}/rot{rotation:g}",
+            'level': level,
+            'resolution': resolution,
+            'diopter': diopter,
+            'light_distance_mm': light_distance_mm,
+            'rotation': rotation,
+            'lens_diameter_mm': 50.0,
+            'glass_index': 1.5,
+        }
+
+
+    def _engine(self, case):
+        engine = SimulationEngine(
+            n_film=1.413, d=200, m=1,
+            diopter=case['diopter'], resolution=case['resolution'],
+            rot_x=case['rotation'], rot_y=case['rotation'], backend=self.backend,
+        )
+
+        # Cache próprio e vazio: nenhuma execução aproveita resultados de outra
+        # (nem do cache em disco do processo, ativado por THIN_FILM_CACHE_DIR)
+        engine.cache = ResultCache(max_entries=1024, max_bytes=sys.maxsize)
+        engine.disk_cache = None
+        return engine
+
+
+    def run_case(self, case):
+        '''
+        Tempo de parede (mínimo e mediana das repetições) de cada etapa,
+        depois uma execução extra com tracemalloc para pico de memória e bytes alocados
+        '''
+
+        stages = STAGES[case['level']]
+        timings = {name: [] for name, _ in stages}
+
+        for _ in range(self.repeat):
+            engine = self._engine(case)
+            for name, stage in stages:
+                start = time.perf_counter()
+                stage(engine, case)
+                timings[name].append(time.perf_counter() - start)
+
+        memory = {}
+        engine = self._engine(case)
+        tracemalloc.start()
+        for name, stage in stages:
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            stage(engine, case)
+            after, peak = tracemalloc.get_traced_memory()
+            memory[name] = {'peak_bytes': peak - before, 'allocated_bytes': after - before}
+        tracemalloc.stop()
+
+        result_stages = {
+            name: {
+                'seconds_min': min(timings[name]),
+                'seconds_median': float(np.median(timings[name])),
+                **memory[name],
+            }
+            for name, _ in stages
+        }
+
+        return {
+            **case,
+            'stages': result_stages,
+            'total_seconds': sum(stage['seconds_min'] for stage in result_stages.values()),
+            'peak_bytes': max(stage['peak_bytes'] for stage in result_stages.values()),
+        }
+
+
+    def run(self, progress=None):
+        results = []
+        for case in self.cases():
+            result = self.run_case(case)
+            results.append(result)
+            if progress is not None:
+                progress(result)
+
+        return {
+            'meta': {
+                'timestamp': datetime.now(timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'platform': platform.platform(),
+                'processor': platform.processor(),
+                'repeat': self.repeat,
+                'backend': self.backend,
+            },
+            'results': results,
+        }
+
+
+    @staticmethod
+    def import_time(module='simulation_engine', repeat=5):
+        '''
+        Tempo de importação do núcleo num processo novo (python -X importtime), melhor de repeat execuções
+        core_ms desconta o NumPy (custo fixo de qualquer processo numérico)
+        gui_modules: módulos de interface carregados junto (deve ser vazio)
+        '''
+
+        code = f"import sys, {module}; print(','.join(name for name in {GUI_MODULES!r} if name in sys.modules))"
+        directory = os.path.dirname(os.path.abspath(__file__))
+
+        totals, cores = [], []
+        for _ in range(repeat):
+            completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                                       capture_output=True, text=True, check=True, cwd=directory)
+
+            # Linhas "import time: self [us] | cumulative | nome"
+            cumulative = {}
+            for line in completed.stderr.splitlines():
+                fields = line.split('|')
+                if len(fields) == 3 and fields[1].strip().isdigit():
+                    cumulative[fields[2].strip()] = int(fields[1])
+
+            totals.append(cumulative[module] / 1000)
+            cores.append((cumulative[module] - cumulative.get('numpy', 0)) / 1000)
+
+        loaded = completed.stdout.strip()
+        return {
+            'module': module,
+            'total_ms': min(totals),
+            'core_ms': min(cores),
+            'gui_modules': loaded.split(',') if loaded else [],
+        }
+
+
+    @staticmethod
+    def compare(current, baseline, time_threshold=0.20, memory_threshold=0.20, min_seconds=0.002):
+        '''
+        Compara cada etapa com a mesma etapa no baseline
+        Regressão: tempo ou pico de memória acima do baseline por mais que o limiar relativo
+        (tempos abaixo de min_seconds são ignorados por estarem no ruído da medição)
+        '''
+
+        baseline_cases = {result['id']: result for result in baseline['results']}
+        regressions = []
+
+        for result in current['results']:
+            reference = baseline_cases.get(result['id'])
+            if reference is None:
+                continue
+
+            for name, stage in result['stages'].items():
+                reference_stage = reference['stages'].get(name)
+                if reference_stage is None:
+                    continue
+
+                old_seconds, new_seconds = reference_stage['seconds_min'], stage['seconds_min']
+                if new_seconds >= min_seconds and new_seconds > old_seconds * (1 + time_threshold):
+                    regressions.append({
+                        'case': result['id'], 'stage': name, 'metric': 'seconds',
+                        'baseline': old_seconds, 'current': new_seconds,
+                    })
+
+                old_peak, new_peak = reference_stage['peak_bytes'], stage['peak_bytes']
+                if new_peak > old_peak * (1 + memory_threshold) and new_peak - old_peak > 1024**2:
+                    regressions.append({
+                        'case': result['id'], 'stage': name, 'metric': 'peak_bytes',
+                        'baseline': old_peak, 'current': new_peak,
+                    })
+
+        return regressions
+
+
+def _light(value):
+    return None if value.lower() in ('sun', 'sol') else float(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark das simulações 1D, 2D e 3D")
+    parser.add_argument('--resolutions', type=int, nargs='+', default=[100, 200, 500, 1000, 2000])
+    parser.add_argument('--diopters', type=float, nargs='+', default=[0.0, 5.0, 10.0])
+    parser.add_argument('--lights', type=_light, nargs='+', default=[None, 200.0],
+                        help="'sun' para a fonte distante ou a distância da lâmpada em mm")
+    parser.add_argument('--rotations', type=float, nargs='+', default=[0.0, 15.0])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default='benchmark.json', help="Arquivo JSON com os resultados")
+    parser.add_argument('--compare', help="JSON de baseline para detectar regressões")
+    parser.add_argument('--threshold', type=float, default=0.20, help="Limiar relativo de regressão (0.20 = 20%%)")
+    parser.add_argument('--import-budget-ms', type=float, default=30.0,
+                        help="Tempo máximo de importação do núcleo sem o NumPy (ms)")
+    parser.add_argument('--imports-only', action='store_true', help="Mede só o tempo de importação")
+    parser.add_argument('--backend', choices=('auto', 'numba', 'numexpr', 'numpy'),
+                        help="Caminho fundido theta + lambda da lente 3D (padrão: etapas NumPy de referência)")
+    args = parser.parse_args(argv)
+
+    # Importação do núcleo: sem Plotly/Streamlit e dentro do orçamento
+    imports = Benchmark.import_time()
+    print(f"Importação de {imports['module']}: {imports['core_ms']:.1f} ms (+ NumPy = {imports['total_ms']:.1f} ms), "
+          f"orçamento {args.import_budget_ms:g} ms")
+
+    import_failures = []
+    if imports['gui_modules']:
+        import_failures.append(f"núcleo carregou módulos de interface: {', '.join(imports['gui_modules'])}")
+    if imports['core_ms'] > args.import_budget_ms:
+        import_failures.append(f"importação acima do orçamento ({imports['core_ms']:.1f} ms)")
+    for failure in import_failures:
+        print(f"REGRESSÃO {failure}")
+
+    if args.imports_only:
+        sys.exit(1 if import_failures else 0)
+
+    benchmark = Benchmark(args.resolutions, args.diopters, args.lights, args.rotations, args.repeat, args.backend)
+
+    def progress(result):
+        print(f"{result['id']:<40} {result['total_seconds'] * 1000:9.1f} ms  {result['peak_bytes'] / 1024**2:8.1f} MB", flush=True)
+
+    report = benchmark.run(progress)
+    report['imports'] = imports
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"Resultados gravados em {args.output}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+
+        regressions = Benchmark.compare(report, baseline, args.threshold, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSÃO {regression['case']} [{regression['stage']}] {regression['metric']}: "
+                  f"{regression['baseline']:.4g} -> {regression['current']:.4g}")
+
+        if regressions:
+            sys.exit(1)
+        print("Nenhuma regressão em relação ao baseline")
+
+    if import_failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+
+class ResultCache:
+    def __init__(self, max_entries=128, max_bytes=256 * 1024**2):
+        '''
+        Cache LRU limitado por número de entradas e por total de bytes
+        Compartilhado entre as instâncias de SimulationEngine (e entre as threads do Streamlit)
+        '''
+
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self._entries = OrderedDict() # chave -> (valor, bytes)
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    # Normalização dos parâmetros da chave
+    @staticmethod
+    def normalize_key(values):
+        '''
+        Converte os parâmetros em uma tupla estável: números viram float arredondado
+        (5 e 5.0 geram a mesma chave), None e strings são mantidos
+        '''
+
+        key = []
+        for value in values:
+            if isinstance(value, (bool, str)) or value is None:
+                key.append(value)
+            elif isinstance(value, (int, float, np.integer, np.floating)):
+                key.append(round(float(value), 9))
+            else:
+                key.append(value)
+        return tuple(key)
+
+
+    # Estimativa do tamanho em memória de um resultado
+    @classmethod
+    def estimate_nbytes(cls, value):
+        '''
+        Soma os bytes dos arrays NumPy contidos no resultado
+        (tuplas, listas, dicionários e figuras do Plotly são percorridos)
+        '''
+
+        if isinstance(value, np.ndarray):
+            return value.nbytes
+        if isinstance(value, (tuple, list)):
+            return sum(cls.estimate_nbytes(item) for item in value)
+        if isinstance(value, dict):
+            return sum(cls.estimate_nbytes(item) for item in value.values())
+        if hasattr(value, 'data') and hasattr(value, 'to_plotly_json'): # go.Figure
+            return sum(cls.estimate_nbytes(trace.to_plotly_json()) for trace in value.data)
+        return 64
+
+
+    # Arrays guardados no cache ficam somente leitura para que nenhum chamador altere o resultado compartilhado
+    @classmethod
+    def _freeze(cls, value):
+        if isinstance(value, np.ndarray):
+            value.setflags(write=False)
+        elif isinstance(value, (tuple, list)):
+            for item in value:
+                cls._freeze(item)
+        return value
+
+
+    # Figuras do Plotly são mutáveis e não congelam: cada chamador recebe uma cópia da guardada
+    @staticmethod
+    def _share(value):
+        if hasattr(value, 'data') and hasattr(value, 'to_plotly_json'): # go.Figure
+            return type(value)(value)
+        return value
+
+
+    def get_or_compute(self, key, compute):
+        '''
+        Retorna o valor em cache para a chave ou calcula, guarda e retorna
+        '''
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if entry is not None:
+            return self._share(entry[0])
+
+        # Cálculo fora do lock: outras threads continuam lendo o cache
+        value = self._freeze(compute())
+        self.put(key, value)
+        return self._share(value)
+
+
+    def put(self, key, value):
+        nbytes = self.estimate_nbytes(value)
+
+        with self._lock:
+            # Resultado maior que o orçamento inteiro não é guardado
+            if nbytes > self.max_bytes:
+                return
+
+            if key in self._entries:
+                self.total_bytes -= self._entries.pop(key)[1]
+
+            self._entries[key] = (value, nbytes)
+            self.total_bytes += nbytes
+
+            # Remoção dos menos usados recentemente
+            while len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self.total_bytes -= evicted_bytes
+                self.evictions += 1
+
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+
+    def stats(self):
+        '''
+        Contadores para dimensionar o cache
+        '''
+
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.total_bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,277 @@
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from visuals import Visuals
+from instrumentation import traced
+
+class CameraRenderer:
+    INCIDENCES = ('light', 'view')
+
+    # Pixels por bloco de linhas: temporários de um bloco ficam no cache do processador
+    PIXELS_PER_BLOCK = 65536
+
+    # Luz ambiente da imagem sombreada (fração da cor do filme visível fora do reflexo)
+    AMBIENT = 0.25
+
+    # Amostras usadas para estimar a esfera que envolve a lente (descarte rápido dos raios que não a atingem)
+    BOUND_SAMPLES = 65
+    BOUND_MARGIN = 1.02
+
+    def __init__(self, width=1920, height=1080, fov_degree=40.0, shininess=64.0, incidence='light', threads=None):
+        '''
+        Câmera pinhole que lança um raio por pixel do sensor e o intersecta com a superfície da lente
+        (Surface.intersect: analítico para esfera/cônica, Newton para os demais modelos)
+        fov_degree: campo de visão vertical | shininess: expoente do lóbulo especular (Phong) do brilho
+        incidence: 'light' (ângulo normal x luz, como nos mapas 3D) ou 'view' (ângulo normal x raio da câmera)
+        threads: blocos de linhas (de todas as poses) divididos entre os núcleos
+        '''
+
+        if incidence not in self.INCIDENCES:
+            raise ValueError(f"Incidência inválida: {incidence}")
+
+        self.width = int(width)
+        self.height = int(height)
+        self.fov_degree = float(fov_degree)
+        self.shininess = float(shininess)
+        self.incidence = incidence
+        self.threads = threads or os.cpu_count() or 1
+
+        self._bounds = {}
+
+
+    # -- Poses da câmera --
+
+    @staticmethod
+    def pose(position, target=(0.0, 0.0, 0.0), up=(0.0, 1.0, 0.0)):
+        '''
+        Câmera em position (mm) olhando para target; up define o "para cima" da imagem
+        '''
+
+        return {'position': tuple(float(value) for value in position),
+                'target': tuple(float(value) for value in target),
+                'up': tuple(float(value) for value in up)}
+
+
+    @classmethod
+    def orbit(cls, distance_mm, azimuth_degree, elevation_degree, target=(0.0, 0.0, 0.0)):
+        '''
+        Poses numa órbita em torno de target (ex.: robô circulando a lente)
+        Cada argumento é escalar ou sequência; elevação 90° = câmera no eixo óptico, acima da lente
+        '''
+
+        distance, azimuth, elevation = np.broadcast_arrays(
+            np.atleast_1d(distance_mm), np.radians(np.atleast_1d(azimuth_degree)), np.radians(np.atleast_1d(elevation_degree)))
+
+        poses = []
+        for r, a, e in zip(distance.ravel(), azimuth.ravel(), elevation.ravel()):
+            offset = r * np.array([np.cos(e) * np.cos(a), np.cos(e) * np.sin(a), np.sin(e)])
+            up = (-np.cos(a), -np.sin(a), 0.0) if np.isclose(abs(np.sin(e)), 1.0) else (0.0, 0.0, 1.0)
+            poses.append(cls.pose(np.asarray(target) + offset, target, up))
+
+        return poses
+
+
+    def basis(self, pose):
+        '''
+        Origem e eixos da câmera no mundo: direita e cima já escalados por pixel,
+        frente apontando para o centro do sensor (distância focal unitária)
+        '''
+
+        position = np.asarray(pose['position'], dtype=np.float64)
+        forward = np.asarray(pose['target'], dtype=np.float64) - position
+        forward /= np.linalg.norm(forward)
+
+        right = np.cross(forward, pose['up'])
+        if np.linalg.norm(right) < 1e-9: # up paralelo à direção de visão
+            right = np.cross(forward, (1.0, 0.0, 0.0) if abs(forward[0]) < 0.9 else (0.0, 1.0, 0.0))
+        right /= np.linalg.norm(right)
+        up = np.cross(right, forward)
+
+        # Tamanho de um pixel no plano a distância 1 da câmera
+        pixel = 2 * np.tan(np.radians(self.fov_degree) / 2) / self.height
+        return position, right * pixel, up * pixel, forward
+
+
+    def _bound_radius(self, surface, limit):
+        '''
+        Raio da esfera centrada na origem que contém a lente (sem rotação), estimado pelo sag
+        num grid dentro do círculo e na borda; em cache por superfície
+        '''
+
+        key = (surface.key(), limit)
+        if key not in self._bounds:
+            x = np.linspace(-limit, limit, self.BOUND_SAMPLES)
+            X, Y = np.meshgrid(x, x)
+            inside = X**2 + Y**2 <= limit**2
+            angle = np.linspace(0, 2 * np.pi, 4 * self.BOUND_SAMPLES)
+            X = np.concatenate((X[inside], limit * np.cos(angle)))
+            Y = np.concatenate((Y[inside], limit * np.sin(angle)))
+
+            with np.errstate(invalid='ignore'):
+                depth = np.nanmax(np.abs(surface.sag(X, Y)), initial=0.0)
+            self._bounds[key] = self.BOUND_MARGIN * np.sqrt(limit**2 + depth**2)
+
+        return self._bounds[key]
+
+
+    @traced('CameraRenderer')
+    def render(self, surface, geometry_model, physics_model, visuals_model, limit, poses, light_distance_mm=None):
+        '''
+        Imagem do sensor de cada pose, com os raios vetorizados sobre o sensor inteiro
+        A lente é a superfície sem rotação girada por Ry @ Rx do geometry_model (mesma convenção dos mapas 3D);
+        os raios vão para o referencial da lente, a interseção é feita lá e pontos e normais voltam para o mundo,
+        onde entram a luz, o ângulo de incidência, a física e a cor exatamente como em vectorize_block_3D
+        Retorna dicionário de arrays (poses, altura, largura[, 3]):
+        img_RGB (cor do filme), shaded_RGB (cor x brilho especular), intensity (lóbulo especular em [0, 1]),
+        theta, wavelength e depth (distância ao longo do raio, mm); NaN/fundo onde o raio não acerta a lente
+        '''
+
+        dtype = geometry_model.dtype
+        shape = (len(poses), self.height, self.width)
+        outputs = {
+            'img_RGB': np.empty(shape + (3,), dtype=np.uint8),
+            'shaded_RGB': np.empty(shape + (3,), dtype=np.uint8),
+            'intensity': np.zeros(shape, dtype=dtype),
+            'theta': np.full(shape, np.nan, dtype=dtype),
+            'wavelength': np.full(shape, np.nan, dtype=dtype),
+            'depth': np.full(shape, np.nan, dtype=dtype),
+        }
+        outputs['img_RGB'][...] = Visuals.BACKGROUND_RGB
+        outputs['shaded_RGB'][...] = Visuals.BACKGROUND_RGB
+
+        context = {
+            'surface': surface, 'geometry_model': geometry_model, 'physics_model': physics_model,
+            'visuals_model': visuals_model, 'limit': limit, 'light_distance_mm': light_distance_mm,
+            'bound': self._bound_radius(surface, limit),
+            'rotation': (geometry_model.Ry @ geometry_model.Rx).astype(np.float64),
+        }
+
+        # Blocos de linhas de todas as poses na mesma fila
+        rows = max(1, self.PIXELS_PER_BLOCK // self.width)
+        blocks = [(index, self.basis(pose), slice(start, min(start + rows, self.height)))
+                  for index, pose in enumerate(poses) for start in range(0, self.height, rows)]
+
+        def run(block):
+            index, basis, block_rows = block
+            self._render_block(context, basis, block_rows, {name: output[index, block_rows] for name, output in outputs.items()})
+
+        if self.threads > 1 and len(blocks) > 1:
+            with ThreadPoolExecutor(max_workers=self.threads) as executor:
+                list(executor.map(run, blocks))
+        else:
+            for block in blocks:
+                run(block)
+
+        return outputs
+
+
+    def _render_block(self, context, basis, rows, outputs):
+        '''
+        Um bloco de linhas do sensor de uma pose; escreve direto nas fatias de saída
+        '''
+
+        geometry_model = context['geometry_model']
+        dtype = geometry_model.dtype
+        origin, right, up, forward = basis
+
+        # 1. Direções dos raios do bloco (centro de cada pixel)
+        u = np.arange(self.width) + 0.5 - self.width / 2
+        v = self.height / 2 - (np.arange(rows.start, rows.stop) + 0.5)
+        directions = forward + u[None, :, None] * right + v[:, None, None] * up
+        directions /= np.linalg.norm(directions, axis=-1, keepdims=True)
+        directions = directions.reshape(-1, 3)
+
+        # 2. Descarte dos raios que passam longe da esfera que envolve a lente
+        along = directions @ origin
+        distance2 = origin @ origin - along**2
+        bound2 = context['bound']**2
+        candidates = np.flatnonzero((distance2 <= bound2) & (along < np.sqrt(np.clip(bound2 - distance2, 0, None))))
+        if len(candidates) == 0:
+            return
+        directions = directions[candidates]
+
+        # 3. Interseção no referencial da lente (mundo = rotation @ lente)
+        rotation = context['rotation']
+        t = context['surface'].intersect((origin @ rotation)[None, :], directions @ rotation, context['limit'])
+        hit = ~np.isnan(t)
+        if not hit.any():
+            return
+        pixels, t, directions = candidates[hit], t[hit], directions[hit]
+
+        local = (origin @ rotation) + t[:, None] * (directions @ rotation)
+        X, Y, Z = (local[None, :, axis].astype(dtype) for axis in range(3)) # (1, N): formato de grid
+
+        # 4. Mesma cadeia dos mapas 3D: normais, rotação, vetores de luz e ângulo de incidência
+        surface = context['surface']
+        normals = geometry_model.rotate_vectors(geometry_model.surface_normals_3D(X, Y, Z, surface))
+        X_rot, Y_rot, Z_rot = geometry_model.rotate_points(X, Y, Z)
+        light_vectors = geometry_model.light_vectors_3D(np.dstack((X_rot, Y_rot, Z_rot)), context['light_distance_mm'])
+        view_vectors = -directions[None].astype(dtype)
+
+        theta = geometry_model.calculate_theta_3D(normals, light_vectors if self.incidence == 'light' else view_vectors)
+        wavelength = context['physics_model'].calculate_wavelength(theta)
+        colors = context['visuals_model'].wavelength_grid_to_rgb(wavelength)[0]
+
+        # 5. Brilho especular: reflexo da luz em torno da normal (virada para a câmera) comparado ao raio de volta
+        if light_vectors is None:
+            light_vectors = np.broadcast_to(np.array([0, 0, 1], dtype=dtype), normals.shape)
+        normals = normals * np.sign(np.sum(normals * view_vectors, axis=-1, keepdims=True))
+        cos_light = np.sum(normals * light_vectors, axis=-1, keepdims=True)
+        reflected = 2 * cos_light * normals - light_vectors
+        intensity = np.clip(np.sum(reflected * view_vectors, axis=-1), 0, 1) ** self.shininess
+        intensity = np.where(cos_light[..., 0] > 0, intensity, 0)[0]
+
+        shading = self.AMBIENT + (1 - self.AMBIENT) * intensity
+        flat = {name: output.reshape((-1,) + output.shape[2:]) for name, output in outputs.items()}
+        flat['img_RGB'][pixels] = colors
+        flat['shaded_RGB'][pixels] = np.clip(np.rint(colors * shading[:, None]), 0, 255).astype(np.uint8)
+        flat['intensity'][pixels] = intensity
+        flat['theta'][pixels] = theta[0]
+        flat['wavelength'][pixels] = wavelength[0]
+        flat['depth'][pixels] = t
+
+
+def main(argv=None):
+    from simulation_engine import SimulationEngine
+    from image_io import ImageIO
+
+    parser = argparse.ArgumentParser(description="Imagem da lente vista por uma câmera pinhole (ray casting)")
+    parser.add_argument('--n-film', type=float, default=1.413)
+    parser.add_argument('--d', type=float, default=200.0)
+    parser.add_argument('--m', type=int, default=1)
+    parser.add_argument('--diopter', type=float, default=5.0)
+    parser.add_argument('--glass-index', type=float, default=1.5)
+    parser.add_argument('--rot-x', type=float, default=0.0)
+    parser.add_argument('--rot-y', type=float, default=0.0)
+    parser.add_argument('--light-distance-mm', type=float, default=None)
+    parser.add_argument('--precision', choices=['float32', 'float64'], default='float32')
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--fov', type=float, default=40.0, help="Campo de visão vertical (°)")
+    parser.add_argument('--distance-mm', type=float, default=150.0)
+    parser.add_argument('--azimuth', type=float, nargs='+', default=[0.0], help="Azimute de cada pose (°)")
+    parser.add_argument('--elevation', type=float, nargs='+', default=[60.0], help="Elevação de cada pose (°)")
+    parser.add_argument('--incidence', choices=CameraRenderer.INCIDENCES, default='light')
+    parser.add_argument('--output', default=None, help="Diretório para os PNGs (um por pose)")
+    args = parser.parse_args(argv)
+
+    engine = SimulationEngine(n_film=args.n_film, d=args.d, m=args.m, diopter=args.diopter,
+                              rot_x=args.rot_x, rot_y=args.rot_y, precision=args.precision)
+    camera = CameraRenderer(args.width, args.height, args.fov, incidence=args.incidence)
+    poses = CameraRenderer.orbit(args.distance_mm, args.azimuth, args.elevation)
+
+    start = time.perf_counter()
+    frames = engine.camera_view_3D(args.glass_index, poses, camera, args.light_distance_mm)
+    seconds = time.perf_counter() - start
+    print(f"{len(poses)} pose(s) {args.width}x{args.height} em {seconds:.3f}s ({seconds / len(poses):.3f}s por pose)")
+
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+        for index, image in enumerate(frames['shaded_RGB']):
+            ImageIO.write_png(os.path.join(args.output, f"camera_{index:04d}.png"), image)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+import numpy as np
+from instrumentation import traced
+
+class Colorimetry:
+    # Iluminante padrão CIE D65 (380-780 nm, passo de 10 nm)
+    D65_WAVELENGTHS = np.arange(380, 781, 10)
+    D65_SPD = np.array([
+        49.9755, 54.6482, 82.7549, 91.4860, 93.4318, 86.6823, 104.865, 117.008, 117.812, 114.861,
+        115.923, 108.811, 109.354, 107.802, 104.790, 107.689, 104.405, 104.046, 100.000, 96.3342,
+        95.7880, 88.6856, 90.0062, 89.5991, 87.6987, 83.2886, 83.6992, 80.0268, 80.2146, 82.2778,
+        78.2842, 69.7213, 71.6091, 74.3490, 61.6040, 69.8856, 75.0870, 63.5927, 46.4182, 66.8054,
+        63.3828
+    ])
+
+    # Matriz XYZ -> sRGB linear (primárias Rec. 709, branco D65)
+    XYZ_TO_SRGB = np.array([
+        [ 3.2404542, -1.5371385, -0.4985314],
+        [-0.9692660,  1.8760108,  0.0415560],
+        [ 0.0556434, -0.2040259,  1.0572252]
+    ])
+
+    BACKGROUND_RGB = (20, 20, 20)
+
+    # Matrizes de pesos (iluminante x CMF x XYZ->sRGB, mais a coluna de luminância Y) já calculadas
+    _weights_cache = {}
+
+    def __init__(self, illuminant='D65'):
+        if illuminant not in ('D65', 'E'):
+            raise ValueError(f"Iluminante não suportado: {illuminant}")
+        self.illuminant = illuminant
+
+
+    # Funções de correspondência de cores CIE 1931 (2°)
+    @staticmethod
+    def color_matching_functions(wavelengths):
+        '''
+        Aproximação analítica multi-lobo das CMFs CIE 1931 (Wyman, Sloan e Shirley, 2013)
+        Retorna array (L, 3) com x̄, ȳ, z̄
+        '''
+
+        wavelengths = np.asarray(wavelengths, dtype=np.float64)
+
+        def lobe(mu, sigma_low, sigma_high):
+            sigma = np.where(wavelengths < mu, sigma_low, sigma_high)
+            return np.exp(-0.5 * ((wavelengths - mu) / sigma)**2)
+
+        x_bar = 1.056 * lobe(599.8, 37.9, 31.0) + 0.362 * lobe(442.0, 16.0, 26.7) - 0.065 * lobe(501.1, 20.4, 26.2)
+        y_bar = 0.821 * lobe(568.8, 46.9, 40.5) + 0.286 * lobe(530.9, 16.3, 31.1)
+        z_bar = 1.217 * lobe(437.0, 11.8, 36.0) + 0.681 * lobe(459.0, 26.0, 13.8)
+
+        return np.stack((x_bar, y_bar, z_bar), axis=-1)
+
+
+    # Distribuição espectral do iluminante
+    def illuminant_spd(self, wavelengths):
+        '''
+        Potência relativa do iluminante interpolada nos comprimentos de onda pedidos
+        '''
+
+        wavelengths = np.asarray(wavelengths, dtype=np.float64)
+
+        if self.illuminant == 'E':
+            return np.ones_like(wavelengths) # energia igual
+
+        return np.interp(wavelengths, self.D65_WAVELENGTHS, self.D65_SPD, left=0.0, right=0.0)
+
+
+    # Matriz de integração espectral
+    def weight_matrix(self, wavelengths):
+        '''
+        Pré-calcula W (L, 4) tal que [R, G, B, Y]_linear = espectro_refletância @ W
+        Integração por trapézios de R(λ) * S(λ) * CMF(λ), normalizada para que o refletor perfeito tenha Y = 1
+        A matriz é guardada em cache por (iluminante, eixo de comprimentos de onda)
+        '''
+
+        wavelengths = np.asarray(wavelengths, dtype=np.float64)
+        key = (self.illuminant, wavelengths.tobytes())
+
+        if key not in Colorimetry._weights_cache:
+            # Pesos da regra do trapézio (aceita amostragem não uniforme)
+            delta = np.zeros_like(wavelengths)
+            if wavelengths.shape[0] > 1:
+                steps = np.diff(wavelengths)
+                delta[:-1] += steps / 2
+                delta[1:] += steps / 2
+            else:
+                delta[:] = 1.0
+
+            weights_XYZ = (delta * self.illuminant_spd(wavelengths))[:, None] * self.color_matching_functions(wavelengths)
+            weights_XYZ /= weights_XYZ[:, 1].sum()
+
+            weights = np.hstack((weights_XYZ @ self.XYZ_TO_SRGB.T, weights_XYZ[:, 1:2]))
+            weights.setflags(write=False)
+            Colorimetry._weights_cache[key] = weights
+
+        return Colorimetry._weights_cache[key]
+
+
+    # Codificação gamma do sRGB
+    @staticmethod
+    def srgb_encode(linear_RGB):
+        '''
+        Curva de transferência do sRGB aplicada a valores lineares em [0, 1]
+        '''
+
+        linear_RGB = np.clip(linear_RGB, 0.0, 1.0)
+        return np.where(
+            linear_RGB <= 0.0031308,
+            12.92 * linear_RGB,
+            1.055 * np.power(linear_RGB, 1 / 2.4) - 0.055
+        )
+
+
+    @traced('Colorimetry')
+    def spectra_to_rgb(self, spectra, wavelengths, exposure=None, mask=None):
+        '''
+        Converte espectros de refletância (..., L) em imagem sRGB de 8 bits (..., 3)
+        Toda a integração é uma única multiplicação matricial pelo bloco de espectros
+        exposure: ganho aplicado antes da codificação; None normaliza pela maior luminância da imagem
+        Pixels com NaN ou fora da máscara recebem a cor de fundo
+        '''
+
+        spectra = np.asarray(spectra)
+        weights = self.weight_matrix(wavelengths)
+
+        flat = spectra.reshape(-1, spectra.shape[-1])
+        invalid = np.isnan(flat).any(axis=1)
+        linear_RGBY = np.nan_to_num(flat) @ weights
+        linear_RGB, luminance = linear_RGBY[:, :3], linear_RGBY[:, 3]
+
+        if exposure is None:
+            peak = luminance[~invalid].max() if np.any(~invalid) else 0.0
+            exposure = 1.0 / peak if peak > 0 else 1.0
+
+        img_RGB = np.rint(self.srgb_encode(linear_RGB * exposure) * 255).astype(np.uint8)
+        img_RGB[invalid] = self.BACKGROUND_RGB
+
+        img_RGB = img_RGB.reshape(spectra.shape[:-1] + (3,))
+        if mask is not None:
+            img_RGB[~mask] = self.BACKGROUND_RGB
+
+        return img_RGB
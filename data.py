@@ -1,12 +1,239 @@
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import zipfile
 import numpy as np
 from physics import Physics
 
 class Data:
+    # Colunas da tabela da varredura, na ordem de exportação
+    SWEEP_COLUMNS = ('angle_degree', 'd', 'n_film', 'm', 'wavelength')
+    SWEEP_FORMATS = ('csv', 'parquet', 'npz')
+
+    # Linhas por bloco: 5 colunas float64 + índices -> ~20 MB por bloco
+    DEFAULT_CHUNK_ROWS = 262144
+
     def __init__(self, physics:Physics):
         self.physics = physics
 
-    def data_generate(self):
-        angles = np.linspace(0, 90, 100)
-        wavelengths = [self.physics.calculate_wavelength(angle) for angle in angles]
+    def data_generate(self, n_angles=100):
+        '''
+        Curva comprimento de onda x ângulo (0° a 90°) do filme do modelo físico, calculada de uma vez
+        '''
+
+        angles = np.linspace(0, 90, n_angles)
+        wavelengths = self.wavelength(angles, self.physics.d, self.physics.n_film, self.physics.m)
+
+        return angles, wavelengths
+
+
+    @staticmethod
+    def wavelength(angle_degree, d, n_film, m):
+        '''
+        Mesma equação de Physics.calculate_wavelength, com broadcasting entre todos os argumentos
+        Equação: lambda = (2 * n * d * cos(theta_r)) / m, com sin(theta_r) = sin(theta_i) / n
+        Reflexão total interna vira NaN só nos elementos afetados
+        '''
+
+        sin_theta_r = (1.0 / n_film) * np.sin(np.radians(angle_degree))
+        with np.errstate(invalid='ignore'):
+            cos_theta_r = np.sqrt(1 - sin_theta_r**2)
+
+        return (2 * n_film * d * cos_theta_r) / m
+
+
+    # -- Varredura ângulo x espessura x índice x ordem --
+
+    def sweep_axes(self, angles=None, thickness=None, n_film=None, m=None):
+        '''
+        Eixos da varredura como arrays 1D; None usa 100 ângulos de 0° a 90° e os valores do modelo físico
+        Escalar vira um eixo de um único valor
+        '''
+
+        defaults = (np.linspace(0, 90, 100), self.physics.d, self.physics.n_film, self.physics.m)
+        values = (angles, thickness, n_film, m)
+
+        return {
+            name: np.atleast_1d(np.asarray(default if value is None else value, dtype=np.float64))
+            for name, value, default in zip(self.SWEEP_COLUMNS[:4], values, defaults)
+        }
+
+
+    @staticmethod
+    def sweep_rows(axes):
+        return int(np.prod([len(axis) for axis in axes.values()], dtype=np.int64))
+
+
+    def sweep(self, angles=None, thickness=None, n_film=None, m=None, chunk_rows=DEFAULT_CHUNK_ROWS):
+        '''
+        Gerador de blocos {coluna: array} do produto cartesiano ordem x índice x espessura x ângulo
+        (o ângulo varia mais rápido). Cada bloco é calculado por broadcasting a partir dos índices
+        das suas linhas, então a tabela inteira nunca existe na memória
+        '''
+
+        axes = self.sweep_axes(angles, thickness, n_film, m)
+        shape = tuple(len(axes[name]) for name in ('m', 'n_film', 'd', 'angle_degree'))
+        total = self.sweep_rows(axes)
+
+        # Seno de cada ângulo calculado uma vez (mesma expressão de Data.wavelength)
+        sin_angles = np.sin(np.radians(axes['angle_degree']))
+
+        for start in range(0, total, chunk_rows):
+            rows = np.arange(start, min(start + chunk_rows, total), dtype=np.int64)
+            m_index, n_index, d_index, angle_index = np.unravel_index(rows, shape)
+
+            n_values = axes['n_film'][n_index]
+            d_values = axes['d'][d_index]
+            m_values = axes['m'][m_index]
+
+            sin_theta_r = (1.0 / n_values) * sin_angles[angle_index]
+            with np.errstate(invalid='ignore'):
+                cos_theta_r = np.sqrt(1 - sin_theta_r**2)
+
+            yield {
+                'angle_degree': axes['angle_degree'][angle_index],
+                'd': d_values,
+                'n_film': n_values,
+                'm': m_values,
+                'wavelength': (2 * n_values * d_values * cos_theta_r) / m_values,
+            }
+
+
+    # -- Exportação em fluxo --
+
+    @classmethod
+    def write_sweep(cls, path, chunks, file_format=None):
+        '''
+        Grava os blocos da varredura à medida que chegam (CSV, Parquet ou .npz), sem juntar a tabela
+        file_format: 'csv' | 'parquet' | 'npz'; padrão pela extensão do arquivo
+        Escrita num arquivo temporário + os.replace: um arquivo pela metade nunca aparece no destino
+        Retorna o número de linhas gravadas
+        '''
+
+        file_format = file_format or os.path.splitext(path)[1].lstrip('.').lower()
+        if file_format not in cls.SWEEP_FORMATS:
+            raise ValueError(f"Formato de exportação inválido: {file_format}")
+
+        temporary = f"{path}.{os.getpid()}.tmp"
+        writer = {'csv': cls._write_csv, 'parquet': cls._write_parquet, 'npz': cls._write_npz}[file_format]
+
+        try:
+            rows = writer(temporary, chunks)
+            os.replace(temporary, path)
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+
+        return rows
+
+
+    # Formato de cada coluna no CSV (mesma ordem de SWEEP_COLUMNS)
+    CSV_ROW = '%.6g,%.6g,%.6g,%d,%.6f\n'
+
+    @classmethod
+    def _write_csv(cls, path, chunks):
+        rows = 0
+        with open(path, 'w') as file:
+            file.write(','.join(cls.SWEEP_COLUMNS) + '\n')
+            for chunk in chunks:
+                table = np.column_stack([chunk[name] for name in cls.SWEEP_COLUMNS])
+
+                # Um único % formata o bloco inteiro (bem mais rápido que np.savetxt linha a linha)
+                file.write((cls.CSV_ROW * len(table)) % tuple(table.ravel().tolist()))
+                rows += len(table)
+        return rows
+
+
+    @classmethod
+    def _write_parquet(cls, path, chunks):
+        # pyarrow é opcional: só quem exporta Parquet precisa dele
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as error:
+            raise ImportError("Exportação em Parquet requer o pyarrow (pip install pyarrow)") from error
+
+        rows = 0
+        writer = None
+        try:
+            for chunk in chunks:
+                table = pyarrow.table({name: chunk[name] for name in cls.SWEEP_COLUMNS})
+                if writer is None:
+                    writer = pyarrow.parquet.ParquetWriter(path, table.schema)
+                writer.write_table(table) # cada bloco vira um row group
+                rows += table.num_rows
+        finally:
+            if writer is not None:
+                writer.close()
+
+        if writer is None: # varredura vazia: arquivo só com o esquema
+            pyarrow.parquet.write_table(pyarrow.table({name: np.zeros(0) for name in cls.SWEEP_COLUMNS}), path)
+        return rows
+
+
+    @classmethod
+    def _write_npz(cls, path, chunks):
+        '''
+        Cada coluna vai para um arquivo bruto temporário; no fim, cada um vira um .npy dentro do .npz
+        (o cabeçalho .npy precisa do número total de linhas, conhecido só depois do último bloco)
+        '''
+
+        rows = 0
+        dtypes = {}
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(path))) as directory:
+            files = {name: open(os.path.join(directory, name), 'wb') for name in cls.SWEEP_COLUMNS}
+            try:
+                for chunk in chunks:
+                    for name in cls.SWEEP_COLUMNS:
+                        column = np.ascontiguousarray(chunk[name])
+                        dtypes[name] = column.dtype
+                        files[name].write(column.tobytes())
+                    rows += len(chunk[cls.SWEEP_COLUMNS[0]])
+            finally:
+                for file in files.values():
+                    file.close()
+
+            with zipfile.ZipFile(path, 'w', allowZip64=True) as archive:
+                for name in cls.SWEEP_COLUMNS:
+                    dtype = dtypes.get(name, np.dtype(np.float64))
+                    header = {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': (rows,)}
+                    with archive.open(f"{name}.npy", 'w', force_zip64=True) as entry, \
+                            open(os.path.join(directory, name), 'rb') as column:
+                        np.lib.format.write_array_header_2_0(entry, header)
+                        shutil.copyfileobj(column, entry, length=16 * 1024**2)
+
+        return rows
+
+
+def _axis(values):
+    # Um valor: eixo fixo | três valores: início, fim e número de amostras
+    if len(values) == 1:
+        return np.array(values)
+    if len(values) == 3:
+        return np.linspace(values[0], values[1], int(values[2]))
+    raise argparse.ArgumentTypeError("Use um valor ou início fim quantidade")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Varredura ângulo x espessura x índice x ordem exportada em fluxo")
+    parser.add_argument('--angles', type=float, nargs='+', default=[0, 90, 100], help="Ângulos (°): valor ou início fim quantidade")
+    parser.add_argument('--thickness', type=float, nargs='+', default=[200], help="Espessura d (nm): valor ou início fim quantidade")
+    parser.add_argument('--n-film', type=float, nargs='+', default=[1.413], help="Índice do filme: valor ou início fim quantidade")
+    parser.add_argument('--m', type=int, nargs='+', default=[1], help="Ordens de interferência")
+    parser.add_argument('--chunk-rows', type=int, default=Data.DEFAULT_CHUNK_ROWS)
+    parser.add_argument('--output', required=True, help="Arquivo .csv, .parquet ou .npz")
+    args = parser.parse_args(argv)
+
+    database = Data(Physics(args.n_film[0], args.thickness[0], args.m[0]))
+    axes = dict(angles=_axis(args.angles), thickness=_axis(args.thickness), n_film=_axis(args.n_film), m=np.array(args.m))
+
+    start = time.perf_counter()
+    rows = Data.write_sweep(args.output, database.sweep(**axes, chunk_rows=args.chunk_rows))
+    seconds = time.perf_counter() - start
+    print(f"{rows} linhas gravadas em {args.output} ({seconds:.2f}s, {rows / max(seconds, 1e-9):,.0f} linhas/s)")
+
 
-        return angles, wavelengths
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,349 @@
+import argparse
+import base64
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+import zipfile
+import numpy as np
+
+class DiskCache:
+    # Valor devolvido por get quando a chave não está no disco
+    MISSING = object()
+
+    # A varredura completa do diretório (remoção LRU) só roda quando a estimativa local do tamanho
+    # passa de max_bytes ou a cada RESCAN_WRITES escritas (para contar o que outros processos gravaram)
+    RESCAN_WRITES = 64
+
+    # A remoção desce até essa fração de max_bytes, para que a próxima varredura demore a ser necessária
+    EVICT_TO_FRACTION = 0.9
+
+    # Temporários mais velhos que isso são restos de escritas interrompidas e são apagados na remoção
+    STALE_TEMPORARY_SECONDS = 3600
+
+    def __init__(self, directory, max_bytes=2 * 1024**3, model_version='1'):
+        '''
+        Cache persistente endereçado por conteúdo, compartilhado entre processos (vários servidores do Streamlit)
+        Cada resultado é um .npz comprimido cujo nome é o hash dos parâmetros + versão do modelo
+        Escritas atômicas (arquivo temporário + os.replace) e remoção LRU pela data de último acesso
+        '''
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.model_version = str(model_version)
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+        # Estimativa do tamanho total: medida na última varredura + o que este processo gravou desde então
+        self._estimated_bytes = None
+        self._writes_since_scan = 0
+
+        os.makedirs(directory, exist_ok=True)
+
+
+    # Endereço do resultado: hash estável da chave normalizada e da versão do modelo
+    def digest(self, key):
+        payload = json.dumps([self.model_version, list(key)], default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+    def path(self, key):
+        digest = self.digest(key)
+        return os.path.join(self.directory, digest[:2], f"{digest}.npz")
+
+
+    # -- Serialização: arrays, escalares, tuplas/listas/dicionários e figuras do Plotly --
+
+    @classmethod
+    def _encode(cls, value, arrays):
+        if isinstance(value, np.ndarray):
+            name = f"a{len(arrays)}"
+            arrays[name] = value
+            return {'type': 'array', 'name': name}
+
+        if value is None or isinstance(value, (bool, int, float, str)):
+            return {'type': 'scalar', 'value': value}
+
+        if isinstance(value, (np.integer, np.floating, np.bool_)):
+            return {'type': 'scalar', 'value': value.item()}
+
+        if isinstance(value, (tuple, list)):
+            # Listas longas de strings (ex.: cores por vértice) viram um único array de texto
+            if len(value) > 64 and all(isinstance(item, str) for item in value):
+                name = f"a{len(arrays)}"
+                arrays[name] = np.array(value)
+                return {'type': 'strings', 'name': name}
+            return {'type': type(value).__name__, 'items': [cls._encode(item, arrays) for item in value]}
+
+        # Array tipado do Plotly ({'dtype', 'bdata', 'shape'}) volta a ser ndarray binário
+        if isinstance(value, dict) and 'bdata' in value and 'dtype' in value:
+            array = np.frombuffer(base64.b64decode(value['bdata']), dtype=value['dtype'])
+            if 'shape' in value:
+                array = array.reshape([int(size) for size in str(value['shape']).split(',')])
+            return cls._encode(array, arrays)
+
+        if isinstance(value, dict):
+            return {'type': 'dict', 'items': {str(name): cls._encode(item, arrays) for name, item in value.items()}}
+
+        if hasattr(value, 'data') and hasattr(value, 'to_plotly_json'): # go.Figure: arrays dos traces ficam binários
+            return {'type': 'figure', 'value': cls._encode(value.to_plotly_json(), arrays)}
+
+        raise TypeError(f"Tipo sem serialização no cache em disco: {type(value).__name__}")
+
+
+    @classmethod
+    def _decode(cls, node, stored):
+        kind = node['type']
+
+        if kind == 'array':
+            return stored[node['name']]
+        if kind == 'scalar':
+            return node['value']
+        if kind == 'tuple':
+            return tuple(cls._decode(item, stored) for item in node['items'])
+        if kind == 'list':
+            return [cls._decode(item, stored) for item in node['items']]
+        if kind == 'dict':
+            return {name: cls._decode(item, stored) for name, item in node['items'].items()}
+        if kind == 'strings':
+            return stored[node['name']].tolist()
+        if kind == 'figure':
+            import plotly.graph_objects as go # só quem lê uma figura paga a importação do Plotly
+            return go.Figure(cls._decode(node['value'], stored))
+
+        raise ValueError(f"Entrada inválida no cache em disco: {kind}")
+
+
+    def get(self, key):
+        '''
+        Resultado guardado para a chave ou DiskCache.MISSING
+        Arquivos removidos por outro processo ou corrompidos contam como falta
+        '''
+
+        path = self.path(key)
+        try:
+            with np.load(path, allow_pickle=False) as stored:
+                structure = json.loads(stored['structure'].tobytes().decode('utf-8'))
+                value = self._decode(structure, stored)
+
+            os.utime(path) # marca o acesso para a remoção LRU
+
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return self.MISSING
+
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            self._remove(path)
+            with self._lock:
+                self.misses += 1
+            return self.MISSING
+
+        with self._lock:
+            self.hits += 1
+        return value
+
+
+    def put(self, key, value):
+        '''
+        Grava o resultado de forma atômica; tipos sem serialização são ignorados
+        '''
+
+        arrays = {}
+        try:
+            structure = self._encode(value, arrays)
+        except TypeError:
+            return False
+
+        arrays['structure'] = np.frombuffer(json.dumps(structure).encode('utf-8'), dtype=np.uint8)
+
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, **arrays)
+
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Arquivo temporário no mesmo diretório: os.replace é atômico e leitores nunca veem um .npz pela metade
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            previous = os.stat(path).st_size if os.path.exists(path) else 0
+            with open(temporary, 'wb') as file:
+                file.write(buffer.getbuffer())
+            os.replace(temporary, path)
+        finally:
+            self._remove(temporary) # só existe se a escrita ou o os.replace falhou
+
+        with self._lock:
+            self.writes += 1
+            self._writes_since_scan += 1
+            if self._estimated_bytes is not None:
+                self._estimated_bytes += buffer.getbuffer().nbytes - previous
+            rescan = (self._estimated_bytes is None or self._estimated_bytes > self.max_bytes
+                      or self._writes_since_scan >= self.RESCAN_WRITES)
+
+        if rescan:
+            self.evict()
+        return True
+
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key)
+        if value is self.MISSING:
+            value = compute()
+            self.put(key, value)
+        return value
+
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass # já removido por outro processo
+
+
+    def _scan(self):
+        # Uma única passada pelo diretório: resultados (.npz) e temporários (.tmp)
+        found = {'.npz': [], '.tmp': []}
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                suffix = os.path.splitext(name)[1]
+                if suffix not in found:
+                    continue
+                try:
+                    info = os.stat(os.path.join(root, name))
+                except FileNotFoundError:
+                    continue
+                found[suffix].append((info.st_mtime, info.st_size, os.path.join(root, name)))
+        return found
+
+
+    def entries(self):
+        '''
+        Arquivos do cache: lista de (último acesso, bytes, caminho)
+        '''
+
+        return self._scan()['.npz']
+
+
+    def evict(self):
+        '''
+        Acima de max_bytes, remove os resultados acessados há mais tempo até EVICT_TO_FRACTION de max_bytes;
+        remove também os temporários abandonados por escritas interrompidas
+        Cada processo pode rodar a remoção; apagar um arquivo já apagado é inofensivo
+        '''
+
+        found = self._scan()
+        stale = time.time() - self.STALE_TEMPORARY_SECONDS
+        for modified, _, path in found['.tmp']:
+            if modified < stale:
+                self._remove(path)
+
+        entries = found['.npz']
+        total = sum(size for _, size, _ in entries)
+
+        removed = 0
+        if total > self.max_bytes:
+            target = self.EVICT_TO_FRACTION * self.max_bytes
+            for _, size, path in sorted(entries):
+                if total <= target:
+                    break
+                self._remove(path)
+                total -= size
+                removed += 1
+
+        with self._lock:
+            self.evictions += removed
+            self._estimated_bytes = total
+            self._writes_since_scan = 0
+        return removed
+
+
+    def clear(self):
+        for _, _, path in self.entries():
+            self._remove(path)
+
+
+    def stats(self):
+        entries = self.entries()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(entries),
+                'bytes': sum(size for _, size, _ in entries),
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'writes': self.writes,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+# Configurações mais acessadas no app (valores padrão dos controles)
+DEFAULT_PRESETS = [
+    {'mode': '1D', 'n_film': 1.413, 'd': 200, 'm': 1},
+    {'mode': '2D', 'n_film': 1.413, 'd': 200, 'm': 1, 'diopter': 5.0, 'resolution': 200, 'lens_diameter_mm': 50},
+    {'mode': '3D', 'n_film': 1.413, 'd': 200, 'm': 1, 'diopter': 5.0, 'resolution': 200, 'light_distance_mm': None},
+    {'mode': '3D', 'n_film': 1.413, 'd': 200, 'm': 1, 'diopter': 5.0, 'resolution': 200, 'light_distance_mm': 200},
+]
+
+
+def warmup(presets, progress=None):
+    '''
+    Pré-calcula as configurações pelas mesmas chamadas do app, gravando-as no cache em disco configurado
+    '''
+
+    from simulation_engine import SimulationEngine
+
+    for preset in presets:
+        start = time.perf_counter()
+        engine = SimulationEngine(
+            n_film=preset['n_film'], d=preset['d'], m=preset['m'],
+            diopter=preset.get('diopter', 0.0), resolution=preset.get('resolution', 0.0),
+            rot_x=preset.get('rot_x', 0), rot_y=preset.get('rot_y', 0),
+        )
+
+        if preset['mode'] == '1D':
+            engine.simulation_figure_1D()
+        elif preset['mode'] == '2D':
+            engine.simulation_grid_2D(preset.get('lens_diameter_mm', 50), preset.get('glass_index', 1.5))
+        else:
+            engine.simulation_grid_3D(preset.get('glass_index', 1.5), preset.get('light_distance_mm'),
+                                      payload=preset.get('payload', 'compact'))
+
+        if progress is not None:
+            progress(preset, time.perf_counter() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pré-aquecimento do cache em disco das simulações")
+    parser.add_argument('--directory', default=os.environ.get('THIN_FILM_CACHE_DIR'), required='THIN_FILM_CACHE_DIR' not in os.environ,
+                        help="Diretório do cache (padrão: THIN_FILM_CACHE_DIR)")
+    parser.add_argument('--presets', help="Arquivo .json com a lista de configurações (padrão: controles do app)")
+    parser.add_argument('--max-bytes', type=int, default=2 * 1024**3)
+    args = parser.parse_args(argv)
+
+    from simulation_engine import SimulationEngine
+    SimulationEngine.configure_disk_cache(args.directory, args.max_bytes)
+
+    presets = DEFAULT_PRESETS
+    if args.presets:
+        with open(args.presets) as file:
+            presets = json.load(file)
+
+    def progress(preset, seconds):
+        print(f"{preset['mode']} {json.dumps(preset)} {seconds:.2f}s", flush=True)
+
+    warmup(presets, progress)
+    print(json.dumps(SimulationEngine.disk_cache.stats()))
+
+
+if __name__ == '__main__':
+    main()
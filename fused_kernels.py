@@ -0,0 +1,239 @@
+import importlib
+import importlib.util
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from instrumentation import traced
+
+logger = logging.getLogger('thin_film.kernels')
+
+
+def _numba_kernel():
+    '''
+    Kernel compilado (Numba): um único laço paralelo (prange nas linhas) calcula rotação, luz,
+    ângulo de incidência e comprimento de onda de cada pixel sem nenhum array temporário
+    '''
+
+    import numba
+
+    @numba.njit(parallel=True, cache=True)
+    def kernel(X, Y, Z, normals, rotation, has_light, light_distance_mm, n_film, wavelength_scale,
+               X_out, Y_out, Z_out, theta_out, wavelength_out):
+        rows, cols = X.shape
+        for i in numba.prange(rows):
+            for j in range(cols):
+                x, y, z = X[i, j], Y[i, j], Z[i, j]
+                x_rot = rotation[0, 0] * x + rotation[0, 1] * y + rotation[0, 2] * z
+                y_rot = rotation[1, 0] * x + rotation[1, 1] * y + rotation[1, 2] * z
+                z_rot = rotation[2, 0] * x + rotation[2, 1] * y + rotation[2, 2] * z
+
+                nx, ny, nz = normals[i, j, 0], normals[i, j, 1], normals[i, j, 2]
+                nz_rot = rotation[2, 0] * nx + rotation[2, 1] * ny + rotation[2, 2] * nz
+
+                if has_light:
+                    nx_rot = rotation[0, 0] * nx + rotation[0, 1] * ny + rotation[0, 2] * nz
+                    ny_rot = rotation[1, 0] * nx + rotation[1, 1] * ny + rotation[1, 2] * nz
+                    lx, ly, lz = -x_rot, -y_rot, light_distance_mm - z_rot
+                    magnitude = np.sqrt(lx * lx + ly * ly + lz * lz)
+                    if magnitude == 0:
+                        magnitude = 1.0
+                    dot = (nx_rot * lx + ny_rot * ly + nz_rot * lz) / magnitude
+                else:
+                    dot = nz_rot
+
+                if np.isnan(dot):
+                    dot = 1.0
+                cos_incident = min(abs(dot), 1.0)
+
+                sin_refracted = np.sqrt(1.0 - cos_incident * cos_incident) / n_film
+                X_out[i, j] = x_rot
+                Y_out[i, j] = y_rot
+                Z_out[i, j] = z_rot
+                theta_out[i, j] = np.arccos(cos_incident) * (180.0 / np.pi)
+                wavelength_out[i, j] = wavelength_scale * np.sqrt(1.0 - sin_refracted * sin_refracted)
+
+    return kernel
+
+
+class FusedKernels:
+    # Ordem de preferência de 'auto'; 'numpy' está sempre disponível
+    BACKENDS = ('numba', 'numexpr', 'numpy')
+
+    # Pixels por bloco: temporários de um bloco ficam no cache do processador
+    PIXELS_PER_BLOCK = 16384
+
+    _compiled = {}
+    _compile_lock = threading.Lock()
+
+    def __init__(self, backend='auto', threads=None):
+        '''
+        Caminho fundido da lente 3D: rotação -> vetor de luz -> ângulo de incidência -> comprimento de onda
+        numa única passada por pixel (ou por bloco de linhas), dividida entre os núcleos
+        backend: 'auto' (melhor instalado), 'numba', 'numexpr' ou 'numpy' (blocos em threads, sempre disponível)
+        Um backend pedido mas não instalado cai no 'numpy' com um aviso no log
+        '''
+
+        self.requested = backend
+        self.backend = self.resolve(backend)
+        self.threads = threads or os.cpu_count() or 1
+
+
+    @staticmethod
+    def available():
+        '''
+        Backends que podem rodar neste ambiente (sem importar as bibliotecas)
+        '''
+
+        return [backend for backend in FusedKernels.BACKENDS
+                if backend == 'numpy' or importlib.util.find_spec(backend) is not None]
+
+
+    @classmethod
+    def resolve(cls, backend):
+        if backend not in cls.BACKENDS + ('auto',):
+            raise ValueError(f"Backend inválido: {backend}")
+
+        available = cls.available()
+        if backend == 'auto':
+            return available[0]
+
+        if backend not in available:
+            logger.warning("Backend '%s' não está instalado; usando o caminho NumPy", backend)
+            return 'numpy'
+        return backend
+
+
+    @traced('FusedKernels')
+    def theta_wavelength_3D(self, X, Y, Z, normals, rotation, light_distance_mm, n_film, d, m):
+        '''
+        Mesmo resultado de grid_rotation_3D + rotate_vectors + light_vectors_3D + calculate_theta_3D +
+        Physics.calculate_wavelength (dentro da tolerância de arredondamento), sem os temporários intermediários
+        X, Y, Z, normals: superfície sem rotação | rotation: Ry @ Rx | light_distance_mm: None para o Sol
+        Equações: cos(theta_i) = |n . l| ; sin(theta_r) = sin(theta_i) / n ; lambda = 2 n d cos(theta_r) / m
+        Retorna (X_rot, Y_rot, Z_rot, theta, wavelength)
+        '''
+
+        dtype = X.dtype
+        outputs = tuple(np.empty(X.shape, dtype=dtype) for _ in range(5))
+        rotation = np.asarray(rotation, dtype=dtype)
+        wavelength_scale = 2 * n_film * d / m
+
+        if self.backend == 'numba':
+            kernel = self._numba()
+            kernel(X, Y, Z, normals, rotation, light_distance_mm is not None,
+                   dtype.type(0.0 if light_distance_mm is None else light_distance_mm),
+                   dtype.type(n_film), dtype.type(wavelength_scale), *outputs)
+            return outputs
+
+        block = self._block_numexpr if self.backend == 'numexpr' else self._block_numpy
+        rows = max(1, self.PIXELS_PER_BLOCK // max(1, X.shape[1]))
+        blocks = [slice(start, start + rows) for start in range(0, X.shape[0], rows)]
+
+        def run(rows):
+            block(X[rows], Y[rows], Z[rows], normals[rows], rotation, light_distance_mm, n_film,
+                  wavelength_scale, tuple(output[rows] for output in outputs))
+
+        # numexpr já divide cada expressão entre os núcleos; os blocos NumPy são distribuídos pelo pool
+        if self.backend == 'numpy' and self.threads > 1 and len(blocks) > 1:
+            with ThreadPoolExecutor(max_workers=self.threads) as executor:
+                list(executor.map(run, blocks))
+        else:
+            for rows in blocks:
+                run(rows)
+
+        return outputs
+
+
+    @classmethod
+    def _numba(cls):
+        # Compilação uma única vez por processo (e em disco, com cache=True)
+        with cls._compile_lock:
+            if 'numba' not in cls._compiled:
+                cls._compiled['numba'] = _numba_kernel()
+            return cls._compiled['numba']
+
+
+    @staticmethod
+    def _block_numpy(X, Y, Z, normals, rotation, light_distance_mm, n_film, wavelength_scale, outputs):
+        '''
+        Um bloco de linhas: as operações escrevem direto nas saídas ou reaproveitam os temporários do bloco
+        '''
+
+        X_out, Y_out, Z_out, theta_out, wavelength_out = outputs
+
+        # 1. Rotação dos pontos direto nas saídas
+        for out, row in ((X_out, rotation[0]), (Y_out, rotation[1]), (Z_out, rotation[2])):
+            np.multiply(X, row[0], out=out)
+            out += row[1] * Y
+            out += row[2] * Z
+
+        # 2. Produto escalar normal rotacionada . luz (Sol: só a componente z da normal)
+        normals_rot = normals @ rotation.T
+        if light_distance_mm is None:
+            dot = normals_rot[..., 2].copy()
+        else:
+            lz = light_distance_mm - Z_out
+            magnitude = np.sqrt(X_out * X_out + Y_out * Y_out + lz * lz)
+            magnitude[magnitude == 0] = 1
+            dot = normals_rot[..., 2] * lz
+            dot -= normals_rot[..., 0] * X_out
+            dot -= normals_rot[..., 1] * Y_out
+            dot /= magnitude
+
+        # 3. cos(theta_i) com o mesmo tratamento de calculate_theta_3D, reaproveitado na física
+        np.nan_to_num(dot, copy=False, nan=1.0)
+        np.abs(dot, out=dot)
+        np.minimum(dot, 1.0, out=dot)
+
+        np.arccos(dot, out=theta_out)
+        np.degrees(theta_out, out=theta_out)
+
+        # 4. sin(theta_r) = sqrt(1 - cos²(theta_i)) / n -> lambda = escala * sqrt(1 - sin²(theta_r))
+        np.multiply(dot, dot, out=dot)
+        np.subtract(1.0, dot, out=dot)
+        dot *= 1.0 / n_film**2
+        np.subtract(1.0, dot, out=dot)
+        np.sqrt(dot, out=wavelength_out)
+        wavelength_out *= wavelength_scale
+
+
+    @staticmethod
+    def _block_numexpr(X, Y, Z, normals, rotation, light_distance_mm, n_film, wavelength_scale, outputs):
+        '''
+        Um bloco de linhas com numexpr: cada expressão é avaliada em pedaços pequenos e em várias threads
+        '''
+
+        import numexpr
+
+        X_out, Y_out, Z_out, theta_out, wavelength_out = outputs
+        nx, ny, nz = normals[..., 0], normals[..., 1], normals[..., 2]
+
+        for out, row in ((X_out, rotation[0]), (Y_out, rotation[1]), (Z_out, rotation[2])):
+            numexpr.evaluate('r0 * X + r1 * Y + r2 * Z', out=out, casting='same_kind',
+                             local_dict={'r0': row[0], 'r1': row[1], 'r2': row[2], 'X': X, 'Y': Y, 'Z': Z})
+
+        variables = {
+            'nx': nx, 'ny': ny, 'nz': nz, 'x': X_out, 'y': Y_out, 'z': Z_out,
+            'a0': rotation[0, 0], 'a1': rotation[0, 1], 'a2': rotation[0, 2],
+            'b0': rotation[1, 0], 'b1': rotation[1, 1], 'b2': rotation[1, 2],
+            'c0': rotation[2, 0], 'c1': rotation[2, 1], 'c2': rotation[2, 2],
+            'L': 0.0 if light_distance_mm is None else light_distance_mm,
+        }
+
+        if light_distance_mm is None:
+            dot = 'c0 * nx + c1 * ny + c2 * nz'
+        else:
+            magnitude = 'sqrt(x ** 2 + y ** 2 + (L - z) ** 2)'
+            dot = (f"(-(a0 * nx + a1 * ny + a2 * nz) * x - (b0 * nx + b1 * ny + b2 * nz) * y"
+                   f" + (c0 * nx + c1 * ny + c2 * nz) * (L - z)) / where({magnitude} == 0, 1, {magnitude})")
+
+        # NaN (fora da lente) vira 1, como em calculate_theta_3D
+        cosine = numexpr.evaluate(f"where(({dot}) != ({dot}), 1, abs({dot}))", local_dict=variables)
+        cosine = numexpr.evaluate('where(c > 1, 1, c)', local_dict={'c': cosine})
+
+        numexpr.evaluate('arccos(c) * k', out=theta_out, casting='same_kind',
+                         local_dict={'c': cosine, 'k': 180.0 / np.pi})
+        numexpr.evaluate('s * sqrt(1 - (1 - c ** 2) * q)', out=wavelength_out, casting='same_kind',
+                         local_dict={'c': cosine, 's': wavelength_scale, 'q': 1.0 / n_film**2})
@@ -1,22 +1,32 @@
 import numpy as np
+from instrumentation import traced
 
 class Geometry:
-    def __init__(self, rot_x, rot_y, diopter, resolution):
+    # Mapas de índice radial compartilhados, um por (resolução, sobreamostragem)
+    _radial_index_cache = {}
+
+    # Estimativa de temporários por pixel no modo em blocos (pontos, normais, luz, produto escalar...)
+    VALUES_PER_PIXEL_CHUNKED = 24
+
+    def __init__(self, rot_x, rot_y, diopter, resolution, dtype=np.float64):
         self.diopter = diopter
         self.resolution = resolution
+        self.rot_x = rot_x
+        self.rot_y = rot_y
+        self.dtype = np.dtype(dtype) # política de precisão (float32 ou float64)
 
        # Matrizes de rotação Rx e Ry
         self.Rx = np.array([
                 [1, 0, 0],
                 [0, np.cos(np.radians(rot_x)), -np.sin(np.radians(rot_x))],
                 [0, np.sin(np.radians(rot_x)), np.cos(np.radians(rot_x))]
-        ])
+        ], dtype=self.dtype)
 
         self.Ry = np.array([
                 [np.cos(np.radians(rot_y)), 0, np.sin(np.radians(rot_y))],
                 [0, 1, 0],
                 [-np.sin(np.radians(rot_y)), 0, np.cos(np.radians(rot_y))]
-        ])
+        ], dtype=self.dtype)
 
 
     
@@ -37,6 +47,7 @@ class Geometry:
         return radius_curvature_mm
 
 
+    @traced('Geometry')
     def grid_rotation_3D(self, points_flat):
         '''
         Realiza a rotação matricial do vetor em 3 dimensões
@@ -54,6 +65,7 @@ class Geometry:
     
 
     # Cálculo do ângulo máximo na borda para duas dimensões
+    @traced('Geometry')
     def calculate_theta_max_2D(self, lens_diameter_mm, glass_index):
         '''
         Cálculo do ângulo máximo na borda (por aproximação) em 2D
@@ -75,7 +87,53 @@ class Geometry:
         return theta_max_degree
     
     
+    # Verificação de simetria de rotação em torno do eixo óptico
+    def is_rotationally_symmetric(self, light_distance_mm=None):
+        '''
+        A lente sem rotação iluminada por fonte distante (Sol) é simétrica em torno de z:
+        o ângulo de incidência passa a depender apenas do raio
+        '''
+
+        return self.rot_x == 0 and self.rot_y == 0 and light_distance_mm is None
+
+
+    # Mapa de índices do raio de cada pixel para um perfil radial 1D
+    @traced('Geometry')
+    def radial_index_map(self, oversample=4):
+        '''
+        Amostra o raio normalizado com resolução sub-pixel e associa cada pixel do grid [-1, 1]²
+        à amostra mais próxima. O raio 1.0 cai exatamente sobre uma amostra, de modo que pixels
+        dentro (R <= 1) e fora (R > 1) do círculo nunca compartilham a mesma amostra.
+        O mapa é calculado uma única vez por resolução.
+        Retorna (radii, index_map) -> perfil[index_map] pinta o disco inteiro
+        '''
+
+        key = (self.resolution, oversample)
+
+        if key not in Geometry._radial_index_cache:
+            samples_inside = oversample * self.resolution # amostras em [0, 1]
+            step = 1.0 / samples_inside
+            n_samples = int(np.ceil(np.sqrt(2) / step)) + 2 # cobre os cantos do quadrado
+            radii = np.arange(n_samples) * step
+
+            x = np.linspace(-1, 1, self.resolution)
+            X, Y = np.meshgrid(x, x)
+            R = np.sqrt(X**2 + Y**2)
+
+            index_map = np.rint(R / step).astype(np.int32)
+            inside = R <= 1.0
+            index_map[inside] = np.minimum(index_map[inside], samples_inside)
+            index_map[~inside] = np.maximum(index_map[~inside], samples_inside + 1)
+
+            radii.setflags(write=False)
+            index_map.setflags(write=False)
+            Geometry._radial_index_cache[key] = (radii, index_map)
+
+        return Geometry._radial_index_cache[key]
+
+
     # Cálculo do ângulo de incidência
+    @traced('Geometry')
     def calculate_theta_3D(self, normals, light_vectors=None):
         '''
         Calcula o ângulo entre a normal e o vetor da luz.
@@ -84,7 +142,7 @@ class Geometry:
         '''
 
         if light_vectors is None: # se não tiver parâmetro de vetor de luz definido. usar luz vindo de uma fonte distante
-            light_vectors = np.array([0, 0, 1])
+            light_vectors = np.array([0, 0, 1], dtype=normals.dtype)
 
         # Produto Escalar
         dot_product = np.sum(normals * light_vectors, axis=2)
@@ -109,13 +167,14 @@ class Geometry:
 
     
     # Função de normalização para a normal da superfície
+    @traced('Geometry')
     def superficial_normalize_3D(self, center_rot, P_grid):
         '''
         Realiza a normalização para cada direção de vetor
         Normalização = vetor / magnitude
         '''
         if self.diopter < 0.1:
-            normal_flat = self.Ry @ (self.Rx @ np.array([0, 0, 1])) # plano z rotacionado
+            normal_flat = self.Ry @ (self.Rx @ np.array([0, 0, 1], dtype=self.dtype)) # plano z rotacionado
             normals = np.tile(normal_flat, (self.resolution, self.resolution, 1)) # em todo grid
 
         else:
@@ -125,7 +184,206 @@ class Geometry:
         return normals
 
 
+    # Normais da superfície antes da rotação
+    @traced('Geometry')
+    def surface_normals_3D(self, X, Y, Z, surface):
+        '''
+        Normais da lente na posição original (sem rotação), dadas pelo modelo de superfície
+        Como a rotação é rígida, rotacionar estas normais equivale a recalculá-las na superfície rotacionada
+        '''
+
+        return surface.normals(X, Y, Z).astype(self.dtype, copy=False)
+
+
+    # Rotação de pontos guardados em três grids separados
+    @traced('Geometry')
+    def rotate_points(self, X, Y, Z):
+        '''
+        Mesma rotação de grid_rotation_3D, mas elemento a elemento sobre grids de qualquer formato
+        (evita empilhar os pontos em (3, N))
+        '''
+
+        rotation = self.Ry @ self.Rx
+        X_rot = rotation[0, 0] * X + rotation[0, 1] * Y + rotation[0, 2] * Z
+        Y_rot = rotation[1, 0] * X + rotation[1, 1] * Y + rotation[1, 2] * Z
+        Z_rot = rotation[2, 0] * X + rotation[2, 1] * Y + rotation[2, 2] * Z
+        return X_rot, Y_rot, Z_rot
+
+
+    # Rotação de um campo de vetores (res, res, 3)
+    @traced('Geometry')
+    def rotate_vectors(self, vectors):
+        '''
+        Aplica Ry @ Rx a cada vetor do grid
+        '''
+
+        rotation = self.Ry @ self.Rx
+        return vectors @ rotation.T
+
+
+    # Vetores unitários de cada ponto até a fonte de luz
+    @traced('Geometry')
+    def light_vectors_3D(self, P_grid, light_distance_mm=None):
+        '''
+        Fonte pontual em [0, 0, light_distance_mm]: vetor dado por posição da luz - posição do pixel
+        Para a fonte distante (Sol) retorna None (direção [0, 0, 1] em calculate_theta_3D)
+        '''
+
+        if light_distance_mm is None:
+            return None
+
+        light_position = np.array([0, 0, light_distance_mm], dtype=P_grid.dtype)
+        light_vectors = light_position - P_grid
+
+        # Normalizar os vetores
+        return self.generic_normalize(light_vectors)
+
+
+    # Superfície da lente (sag) sobre um grid
+    @traced('Geometry')
+    def surface_sag_3D(self, X, Y, surface, limit):
+        '''
+        Z(x, y) do modelo de superfície (esfera, asfera, tórica, mapa medido)
+        Pontos fora do círculo de raio limit ficam invisíveis (NaN)
+        '''
+
+        Z = surface.sag(X, Y).astype(self.dtype, copy=False)
+
+        # Aplicar invisibilidade fora do círculo
+        Z[(X**2 + Y**2) > (limit**2)] = np.nan
+        return Z
+
+
+    # Número de linhas do grid processadas por bloco
+    def rows_per_chunk(self, memory_budget_bytes):
+        '''
+        Linhas que cabem no orçamento de memória dos temporários de um bloco
+        '''
+
+        row_bytes = self.VALUES_PER_PIXEL_CHUNKED * self.dtype.itemsize * self.resolution
+        return int(np.clip(memory_budget_bytes // row_bytes, 1, self.resolution))
+
+
+    # Vetorização em blocos de linhas com orçamento de memória
+    @traced('Geometry')
+    def vectorize_chunked_3D(self, limit, surface, light_distance_mm=None,
+                             memory_budget_bytes=64 * 1024**2, out=None):
+        '''
+        Constrói superfície, rotação, normais, luz e ângulo de incidência bloco a bloco de linhas,
+        escrevendo direto nos arrays de saída pré-alocados (X_rot, Y_rot, Z_rot, theta)
+        O pico de memória fica nos temporários de um bloco, independente da resolução
+        '''
+
+        res = self.resolution
+        if out is None:
+            out = tuple(np.empty((res, res), dtype=self.dtype) for _ in range(4))
+        X_out, Y_out, Z_out, theta_out = out
+
+        x = np.linspace(-limit, limit, res, dtype=self.dtype)
+        rows = self.rows_per_chunk(memory_budget_bytes)
+
+        for start in range(0, res, rows):
+            block = slice(start, min(start + rows, res))
+
+            # Grid só das linhas do bloco
+            X, Y = np.meshgrid(x, x[block])
+            X_rot, Y_rot, Z_rot, theta = self.vectorize_block_3D(X, Y, surface, limit, light_distance_mm)
+
+            X_out[block] = X_rot
+            Y_out[block] = Y_rot
+            Z_out[block] = Z_rot
+            theta_out[block] = theta
+
+        return out
+
+
+    # Vetorização completa de um bloco do grid (linhas ou ladrilho)
+    def vectorize_block_3D(self, X, Y, surface, limit, light_distance_mm=None):
+        '''
+        Superfície, rotação, normais, luz e ângulo de incidência para um pedaço (X, Y) do grid
+        Retorna (X_rot, Y_rot, Z_rot, theta)
+        '''
+
+        Z = self.surface_sag_3D(X, Y, surface, limit)
+
+        # Rotação dos pontos e das normais calculadas na posição original
+        X_rot, Y_rot, Z_rot = self.rotate_points(X, Y, Z)
+        normals = self.rotate_vectors(self.surface_normals_3D(X, Y, Z, surface))
+
+        light_vectors = None
+        if light_distance_mm is not None:
+            light_vectors = self.light_vectors_3D(np.dstack((X_rot, Y_rot, Z_rot)), light_distance_mm)
+
+        theta = self.calculate_theta_3D(normals, light_vectors)
+        return X_rot, Y_rot, Z_rot, theta
+
+
+    # Matrizes de rotação Ry @ Rx de vários quadros de uma vez
+    def rotation_matrices(self, rot_x, rot_y):
+        '''
+        Mesma composição de Rx e Ry do construtor, para sequências de ângulos (graus)
+        Retorna array (F, 3, 3)
+        '''
+
+        rx = np.radians(np.asarray(rot_x, dtype=np.float64))
+        ry = np.radians(np.asarray(rot_y, dtype=np.float64))
+        zeros, ones = np.zeros_like(rx), np.ones_like(rx)
+
+        Rx = np.stack([
+            np.stack([ones, zeros, zeros], axis=-1),
+            np.stack([zeros, np.cos(rx), -np.sin(rx)], axis=-1),
+            np.stack([zeros, np.sin(rx), np.cos(rx)], axis=-1),
+        ], axis=-2)
+
+        Ry = np.stack([
+            np.stack([np.cos(ry), zeros, np.sin(ry)], axis=-1),
+            np.stack([zeros, ones, zeros], axis=-1),
+            np.stack([-np.sin(ry), zeros, np.cos(ry)], axis=-1),
+        ], axis=-2)
+
+        return (Ry @ Rx).astype(self.dtype)
+
+
+    # Vetorização de vários quadros (rotação/luz) sobre a mesma superfície
+    @traced('Geometry')
+    def vectorize_frames_3D(self, X, Y, Z, normals, rotations, light_distances_mm):
+        '''
+        Rotaciona a superfície e as normais (calculadas uma única vez, sem rotação) por F matrizes
+        e calcula o ângulo de incidência de cada quadro em uma única passada vetorizada
+        rotations: (F, 3, 3) | light_distances_mm: (F,), NaN para o Sol
+        Retorna (X_rot, Y_rot, Z_rot, theta), cada um com formato (F, res, res)
+        '''
+
+        shape = (len(rotations),) + X.shape
+        rotations_T = rotations.transpose(0, 2, 1)
+
+        # 1. Pontos e normais rotacionados: (N, 3) @ (F, 3, 3) -> (F, N, 3)
+        points = np.stack((X, Y, Z), axis=-1).reshape(-1, 3) @ rotations_T
+        normals_rot = normals.reshape(-1, 3) @ rotations_T
+
+        # 2. Produto escalar normal . luz (Sol: componente z da normal)
+        light = np.asarray(light_distances_mm, dtype=self.dtype)[:, None]
+        dot_product = normals_rot[..., 2].copy()
+
+        lamp = ~np.isnan(light[:, 0])
+        if lamp.any():
+            light_vectors = -points[lamp]
+            light_vectors[..., 2] += light[lamp]
+            magnitudes = np.linalg.norm(light_vectors, axis=-1)
+            magnitudes[magnitudes == 0] = 1
+            dot_product[lamp] = np.sum(normals_rot[lamp] * light_vectors, axis=-1) / magnitudes
+
+        # 3. Mesmo tratamento de calculate_theta_3D
+        dot_product = np.nan_to_num(dot_product, nan=1.0)
+        dot_product = np.clip(dot_product, -1.0, 1.0)
+        theta = np.degrees(np.arccos(np.abs(dot_product)))
+
+        return (points[..., 0].reshape(shape), points[..., 1].reshape(shape),
+                points[..., 2].reshape(shape), theta.reshape(shape))
+
+
     # Função de vetorização para pontos normais da superfície
+    @traced('Geometry')
     def vectorize_3D(self, X_rot, Y_rot, Z_rot, radius_curvature_mm, light_distance_mm=None):
         '''
         Realiza o processo de vetorização dos pontos
@@ -135,26 +393,15 @@ class Geometry:
         P_grid = np.dstack((X_rot, Y_rot, Z_rot))
 
         # Centro da esfera rotacionado
-        center_point = np.array([0, 0, -radius_curvature_mm])
+        center_point = np.array([0, 0, -radius_curvature_mm], dtype=self.dtype)
         center_rot = self.Ry @ (self.Rx @ center_point)
 
         # Cálculo das normais de cada direção
         normals = self.superficial_normalize_3D(center_rot, P_grid)
 
-        # Cálculo do vetor de luz
-        if light_distance_mm is not None:
-            # Fonte Pontual
-            # Vetor dado por posição da luz - posição do pixel
-            light_position = np.array([0, 0, light_distance_mm])
-            light_vectors = light_position - P_grid
-
-            # Normalizar os vetores
-            light_vectors_normals = self.generic_normalize(light_vectors)
-
-        else:
-            light_vectors_normals = None
-
+        # Cálculo do vetor de luz (None para fonte distante)
+        light_vectors_normals = self.light_vectors_3D(P_grid, light_distance_mm)
 
         # Cálculo do ângulo de incidência
         theta_degrees = self.calculate_theta_3D(normals, light_vectors_normals)
-        return normals, theta_degrees
\ No newline at end of file
+        return normals, theta_degrees
@@ -0,0 +1,408 @@
+import argparse
+import asyncio
+import io
+import json
+import logging
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from batch_render import BatchRender, DEFAULT_JOB
+from image_io import ImageIO
+from render_service import RenderService, RenderTimeout
+from simulation_engine import SimulationEngine
+from tiled_renderer import TiledRenderer
+from visuals import Visuals
+
+logger = logging.getLogger('thin_film.http')
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class HttpApi:
+    MAX_RESOLUTION = 4096 # acima disso, usar /v1/tiled (resposta transmitida em faixas)
+    MAX_TILED_RESOLUTION = 65536
+    MAX_BODY_BYTES = 1024**2
+    MAX_BATCH = 64
+
+    def __init__(self, service=None, waiters=64):
+        '''
+        API HTTP (asyncio, só biblioteca padrão) sobre o SimulationEngine
+        As renderizações rodam no pool do RenderService; o laço de eventos só lê pedidos e escreve respostas
+        waiters: threads que aguardam o serviço e codificam as respostas (PNG/npy) fora do laço
+        '''
+
+        self.service = service or RenderService.shared()
+        self._executor = ThreadPoolExecutor(max_workers=waiters, thread_name_prefix='http')
+        self.routes = {
+            ('GET', '/health'): self.health,
+            ('GET', '/stats'): self.stats,
+            ('GET', '/v1/curve'): self.curve_1D,
+            ('GET', '/v1/image2d'): self.image_2D,
+            ('GET', '/v1/map3d'): self.map_3D,
+            ('GET', '/v1/mesh3d'): self.mesh_3D,
+            ('POST', '/v1/batch'): self.batch,
+            ('GET', '/v1/tiled'): self.tiled,
+        }
+
+
+    # Executa uma função bloqueante fora do laço de eventos
+    async def _blocking(self, function, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: function(*args, **kwargs))
+
+
+    async def _render(self, method, job, *args, **kwargs):
+        return await self._blocking(self.service.render, method, self._engine_params(job), *args, **kwargs)
+
+
+    # -- Parâmetros e formatos --
+
+    @staticmethod
+    def parse_job(values, max_resolution):
+        '''
+        Mesmos parâmetros (e padrões) dos jobs de batch_render; as demais chaves são opções da resposta
+        '''
+
+        try:
+            job = BatchRender.normalize_job({name: value for name, value in values.items() if name in DEFAULT_JOB})
+        except ValueError as error:
+            raise HttpError(400, str(error))
+
+        if not 1 <= job['resolution'] <= max_resolution:
+            raise HttpError(400, f"resolution deve estar entre 1 e {max_resolution}")
+        return job
+
+
+    @staticmethod
+    def _engine_params(job):
+        return {name: job[name] for name in ('n_film', 'd', 'm', 'diopter', 'resolution', 'rot_x', 'rot_y')}
+
+
+    @staticmethod
+    def npy_bytes(array):
+        buffer = io.BytesIO()
+        np.save(buffer, np.ascontiguousarray(array))
+        return buffer.getvalue()
+
+
+    @staticmethod
+    def npz_bytes(arrays):
+        buffer = io.BytesIO()
+        np.savez(buffer, **arrays)
+        return buffer.getvalue()
+
+
+    @staticmethod
+    def array_headers(array):
+        return {'X-Shape': ','.join(str(size) for size in array.shape), 'X-Dtype': array.dtype.str}
+
+
+    def encode_array(self, array, response_format, image=False):
+        '''
+        png (imagens RGB) | npy | raw (bytes do array em C, formato e dtype nos cabeçalhos X-Shape/X-Dtype)
+        Arrays de ponto flutuante saem em float32
+        '''
+
+        if array.dtype.kind == 'f':
+            array = array.astype(np.float32)
+
+        if response_format == 'png':
+            if not image:
+                raise HttpError(400, "format=png só vale para imagens RGB")
+            return ImageIO.encode_png(array, compression=3), 'image/png', {}
+        if response_format == 'npy':
+            return self.npy_bytes(array), 'application/x-npy', {}
+        if response_format == 'raw':
+            return np.ascontiguousarray(array).tobytes(), 'application/octet-stream', self.array_headers(array)
+
+        raise HttpError(400, f"Formato inválido: {response_format}")
+
+
+    # -- Endpoints --
+
+    async def health(self, query, body):
+        return json.dumps({'status': 'ok'}).encode(), 'application/json', {}
+
+
+    async def stats(self, query, body):
+        stats = {'service': self.service.stats(), 'cache': SimulationEngine.cache_stats()}
+        return json.dumps(stats).encode(), 'application/json', {}
+
+
+    async def curve_1D(self, query, body):
+        '''
+        Curva comprimento de onda x ângulo: array (2, N) float32 [ângulos; comprimentos de onda]
+        '''
+
+        job = self.parse_job(query, self.MAX_RESOLUTION)
+        _, angles, wavelengths = await self._render('simulation_figure_1D', job)
+
+        curve = np.vstack((angles, np.asarray(wavelengths, dtype=np.float64)))
+        return await self._blocking(self.encode_array, curve, query.get('format', 'npy'))
+
+
+    async def image_2D(self, query, body):
+        job = self.parse_job(query, self.MAX_RESOLUTION)
+        method = 'simulation_spectral_2D' if query.get('spectral') in ('1', 'true') else 'simulation_grid_2D'
+        img_RGB, theta_max_degree = await self._render(method, job, job['lens_diameter_mm'], job['glass_index'])
+
+        content = await self._blocking(self.encode_array, img_RGB, query.get('format', 'png'), image=True)
+        content[2]['X-Theta-Max-Degree'] = f"{theta_max_degree:.6f}"
+        return content
+
+
+    async def map_3D(self, query, body):
+        '''
+        Mapa 3D no grid (x, y): imagem RGB (output=rgb) ou comprimentos de onda float32 (output=wavelength)
+        '''
+
+        job = self.parse_job(query, self.MAX_RESOLUTION)
+        img_RGB, wavelength_grid = await self._render('simulation_map_3D', job, job['glass_index'], job['light_distance_mm'])
+
+        if query.get('output', 'rgb') == 'wavelength':
+            return await self._blocking(self.encode_array, wavelength_grid, query.get('format', 'npy'))
+        return await self._blocking(self.encode_array, img_RGB, query.get('format', 'png'), image=True)
+
+
+    @staticmethod
+    def build_mesh(surface, color):
+        '''
+        Malha triangular da lente sem os pontos fora dela (mesma triangulação das figuras 3D)
+        '''
+
+        X_rot, Y_rot, Z_rot, _ = surface
+        img_RGB, wavelength_grid = color
+
+        valid = ~(np.isnan(X_rot) | np.isnan(Y_rot) | np.isnan(Z_rot))
+        vertices, i, j, k = Visuals.compact_mesh(valid)
+
+        return {
+            'vertices': np.stack([axis.ravel()[vertices] for axis in (X_rot, Y_rot, Z_rot)], axis=1).astype(np.float32),
+            'faces': np.stack((i, j, k), axis=1).astype(np.int32),
+            'wavelength': wavelength_grid.ravel()[vertices].astype(np.float32),
+            'rgb': img_RGB.reshape(-1, 3)[vertices],
+        }
+
+
+    async def mesh_3D(self, query, body):
+        '''
+        Malha 3D: format=npz (vertices, faces, wavelength, rgb) ou raw (buffers concatenados;
+        layout em X-Arrays: nome=dtype:formato:offset;...)
+        '''
+
+        job = self.parse_job(query, self.MAX_RESOLUTION)
+        surface, color = await asyncio.gather(
+            self._render('theta_grid_3D', job, job['glass_index'], job['light_distance_mm']),
+            self._render('simulation_map_3D', job, job['glass_index'], job['light_distance_mm']),
+        )
+        mesh = await self._blocking(self.service.run, self.build_mesh, surface, color)
+
+        response_format = query.get('format', 'npz')
+        if response_format == 'npz':
+            return await self._blocking(self.npz_bytes, mesh), 'application/x-npz', {}
+
+        if response_format == 'raw':
+            layout, offset = [], 0
+            for name, array in mesh.items():
+                layout.append(f"{name}={array.dtype.str}:{'x'.join(map(str, array.shape))}:{offset}")
+                offset += array.nbytes
+            content = b''.join(np.ascontiguousarray(array).tobytes() for array in mesh.values())
+            return content, 'application/octet-stream', {'X-Arrays': ';'.join(layout)}
+
+        raise HttpError(400, f"Formato inválido: {response_format}")
+
+
+    async def batch(self, query, body):
+        '''
+        Corpo JSON: {"jobs": [{"mode": "2D"|"3D", ...parâmetros}]}
+        Os jobs rodam em paralelo no pool; resposta .npz com image_<i> (e wavelength_<i> no 3D)
+        '''
+
+        try:
+            jobs = json.loads(body or b'{}')['jobs']
+        except (ValueError, KeyError, TypeError):
+            raise HttpError(400, "Corpo esperado: {\"jobs\": [...]}")
+        if not isinstance(jobs, list) or not all(isinstance(job, dict) for job in jobs):
+            raise HttpError(400, "jobs deve ser uma lista de objetos")
+        if not 0 < len(jobs) <= self.MAX_BATCH:
+            raise HttpError(400, f"O lote deve ter entre 1 e {self.MAX_BATCH} jobs")
+
+        jobs = [self.parse_job(job, self.MAX_RESOLUTION) for job in jobs]
+
+        async def run(job):
+            if job['mode'] == '2D':
+                img_RGB, _ = await self._render('simulation_grid_2D', job, job['lens_diameter_mm'], job['glass_index'])
+                return {'image': img_RGB}
+            img_RGB, wavelength_grid = await self._render('simulation_map_3D', job, job['glass_index'], job['light_distance_mm'])
+            return {'image': img_RGB, 'wavelength': wavelength_grid.astype(np.float32)}
+
+        results = await asyncio.gather(*(run(job) for job in jobs))
+        arrays = {f"{name}_{index}": array for index, result in enumerate(results) for name, array in result.items()}
+        return await self._blocking(self.npz_bytes, arrays), 'application/x-npz', {}
+
+
+    async def tiled(self, query, body):
+        '''
+        Imagem grande (2D ou 3D) transmitida como .npy em faixas de linhas (Transfer-Encoding: chunked)
+        Cada faixa é renderizada no pool e enviada assim que fica pronta; a memória fica limitada a uma faixa
+        '''
+
+        job = self.parse_job(query, self.MAX_TILED_RESOLUTION)
+        try:
+            tile_size = int(query.get('tile', 512))
+        except ValueError:
+            raise HttpError(400, "tile deve ser um número inteiro")
+        if not 16 <= tile_size <= 4096:
+            raise HttpError(400, "tile deve estar entre 16 e 4096")
+
+        engine = SimulationEngine(**self._engine_params(job), use_cache=False, precision='float32')
+        renderer = TiledRenderer(engine, tile_size=tile_size, pyramid_levels=0)
+        bands = renderer.iter_bands(job['mode'], job['lens_diameter_mm'], job['glass_index'], job['light_distance_mm'])
+
+        # Cabeçalho .npy do array completo, seguido das faixas em ordem
+        resolution = job['resolution']
+        header = io.BytesIO()
+        np.lib.format.write_array_header_1_0(header, {
+            'descr': '|u1', 'fortran_order': False, 'shape': (resolution, resolution, 3)})
+
+        async def chunks():
+            yield header.getvalue()
+            while True:
+                band = await self._blocking(self.service.run, next, bands, None)
+                if band is None:
+                    return
+                yield band[1].tobytes()
+
+        return chunks(), 'application/x-npy', {}
+
+
+    # -- HTTP/1.1 mínimo (keep-alive, Content-Length e respostas chunked) --
+
+    @staticmethod
+    async def _read_request(reader):
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+
+        method, target, _ = request_line.decode('latin-1').split(' ', 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get('content-length', 0))
+        if length > HttpApi.MAX_BODY_BYTES:
+            raise HttpError(413, "Corpo do pedido muito grande")
+        body = await reader.readexactly(length) if length else b''
+
+        return method, target, headers, body
+
+
+    @staticmethod
+    def _head(status, content_type, headers):
+        lines = [f"HTTP/1.1 {status} {REASONS.get(status, '')}", f"Content-Type: {content_type}"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+
+    async def _respond(self, writer, status, content, content_type, headers):
+        if isinstance(content, (bytes, bytearray)):
+            writer.write(self._head(status, content_type, {**headers, 'Content-Length': len(content)}))
+            writer.write(content)
+            await writer.drain()
+            return
+
+        writer.write(self._head(status, content_type, {**headers, 'Transfer-Encoding': 'chunked'}))
+        try:
+            async for chunk in content:
+                writer.write(f"{len(chunk):x}\r\n".encode() + chunk + b'\r\n')
+                await writer.drain() # contrapressão: só renderiza a próxima faixa quando o cliente consome esta
+        except ConnectionError:
+            raise
+        except Exception as error:
+            # O status 200 já foi enviado: sem o chunk final, o cliente vê a resposta truncada, não uma imagem incompleta válida
+            logger.exception("Falha ao transmitir a resposta em partes")
+            raise ConnectionAbortedError("Resposta transmitida interrompida") from error
+        writer.write(b'0\r\n\r\n')
+        await writer.drain()
+
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except HttpError as error:
+                    await self._respond(writer, error.status, json.dumps({'error': str(error)}).encode(), 'application/json', {})
+                    break
+                if request is None:
+                    break
+
+                method, target, headers, body = request
+                url = urllib.parse.urlsplit(target)
+                query = dict(urllib.parse.parse_qsl(url.query))
+
+                start = time.perf_counter()
+                try:
+                    handler = self.routes.get((method, url.path))
+                    if handler is None:
+                        allowed = [route_method for route_method, path in self.routes if path == url.path]
+                        raise HttpError(405 if allowed else 404, f"{method} {url.path}")
+
+                    content, content_type, extra = await handler(query, body)
+                    status = 200
+
+                except HttpError as error:
+                    status, content_type, extra = error.status, 'application/json', {}
+                    content = json.dumps({'error': str(error)}).encode()
+                except RenderTimeout as error:
+                    status, content_type, extra = 503, 'application/json', {'Retry-After': '1'}
+                    content = json.dumps({'error': str(error)}).encode()
+                except Exception as error:
+                    status, content_type, extra = 500, 'application/json', {}
+                    content = json.dumps({'error': f"{type(error).__name__}: {error}"}).encode()
+
+                extra['X-Server-Ms'] = f"{(time.perf_counter() - start) * 1000:.1f}"
+                await self._respond(writer, status, content, content_type, extra)
+
+                if headers.get('connection', '').lower() == 'close':
+                    break
+
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass # cliente desconectou ou enviou um pedido malformado
+        finally:
+            writer.close()
+
+
+    async def serve(self, host='127.0.0.1', port=8080):
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="API HTTP do simulador de filmes finos")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=None, help="Renderizações simultâneas (padrão: núcleos da CPU)")
+    parser.add_argument('--timeout', type=float, default=30.0, help="Prazo de cada renderização (s)")
+    args = parser.parse_args(argv)
+
+    api = HttpApi(RenderService(args.workers, args.timeout))
+    print(f"Servindo em http://{args.host}:{args.port}", flush=True)
+    asyncio.run(api.serve(args.host, args.port))
+
+
+if __name__ == '__main__':
+    main()
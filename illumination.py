@@ -0,0 +1,259 @@
+import numpy as np
+from instrumentation import traced
+
+class Illumination:
+    SAMPLINGS = ('halton', 'stratified', 'random')
+    AREA_SHAPES = ('rect', 'disk', 'ring')
+
+    # Estimativa de temporários por par (pixel, fonte): vetor, distância, cossenos, theta, lambda, RGB...
+    VALUES_PER_PAIR = 16
+    DEFAULT_MEMORY_BUDGET = 128 * 1024**2
+
+    def __init__(self, sources):
+        '''
+        Conjunto de fontes de luz: pontuais, direcionais e de área (amostradas em vários pontos)
+        Cada fonte é um dicionário criado por Illumination.point / directional / area
+        As fontes de área são expandidas uma única vez em fontes pontuais com emissão lambertiana
+        '''
+
+        self.sources = list(sources)
+        if not self.sources:
+            raise ValueError("A iluminação precisa de pelo menos uma fonte")
+
+        positions, intensities, emitter_normals = [], [], []
+        directions, directional_intensities = [], []
+
+        for source in self.sources:
+            if source['type'] == 'point':
+                positions.append(np.asarray(source['position'], dtype=np.float64)[None, :])
+                intensities.append(np.array([source['intensity']], dtype=np.float64))
+                emitter_normals.append(np.zeros((1, 3)))
+
+            elif source['type'] == 'directional':
+                direction = np.asarray(source['direction'], dtype=np.float64)
+                directions.append(direction / np.linalg.norm(direction))
+                directional_intensities.append(source['intensity'])
+
+            elif source['type'] == 'area':
+                samples, normal = self.sample_area(source)
+                positions.append(samples)
+                intensities.append(np.full(len(samples), source['intensity'] / len(samples)))
+                emitter_normals.append(np.broadcast_to(normal, samples.shape))
+
+            else:
+                raise ValueError(f"Tipo de fonte inválido: {source['type']}")
+
+        self.positions = np.concatenate(positions) if positions else np.zeros((0, 3))
+        self.point_intensity = np.concatenate(intensities) if intensities else np.zeros(0)
+        self.emitter_normals = np.concatenate(emitter_normals) if emitter_normals else np.zeros((0, 3))
+        self.directions = np.array(directions).reshape(-1, 3)
+        self.directional_intensity = np.array(directional_intensities, dtype=np.float64)
+
+
+    # -- Construtores das fontes --
+
+    @staticmethod
+    def point(position, intensity=1.0):
+        '''
+        Lâmpada pontual isotrópica em position (mm); intensidade cai com 1/r²
+        '''
+
+        return {'type': 'point', 'position': tuple(float(value) for value in position), 'intensity': float(intensity)}
+
+
+    @staticmethod
+    def directional(direction=(0.0, 0.0, 1.0), intensity=1.0):
+        '''
+        Fonte distante (Sol): direction aponta da lente para a fonte
+        '''
+
+        return {'type': 'directional', 'direction': tuple(float(value) for value in direction), 'intensity': float(intensity)}
+
+
+    @staticmethod
+    def area(center, size, shape='rect', normal=(0.0, 0.0, -1.0), samples=64, sampling='halton',
+             intensity=1.0, inner_size=0.0, seed=0):
+        '''
+        Fonte de área (softbox, painel, ring light) amostrada em `samples` pontos
+        shape: 'rect' (size = (largura, altura)) | 'disk' (size = raio) | 'ring' (size = raio externo, inner_size = interno)
+        normal: direção para onde a face emissora aponta (padrão: para baixo, em direção à lente)
+        intensity: intensidade total, dividida entre as amostras
+        '''
+
+        if shape not in Illumination.AREA_SHAPES:
+            raise ValueError(f"Forma de fonte de área inválida: {shape}")
+        if sampling not in Illumination.SAMPLINGS:
+            raise ValueError(f"Amostragem inválida: {sampling}")
+
+        size = tuple(float(value) for value in np.atleast_1d(size))
+        return {
+            'type': 'area', 'center': tuple(float(value) for value in center), 'size': size, 'shape': shape,
+            'normal': tuple(float(value) for value in normal), 'samples': int(samples), 'sampling': sampling,
+            'intensity': float(intensity), 'inner_size': float(inner_size), 'seed': int(seed),
+        }
+
+
+    @staticmethod
+    def ring_light(height_mm, radius_mm, samples=32, intensity=1.0):
+        '''
+        Anel de LEDs centrado no eixo óptico, a height_mm acima da lente
+        '''
+
+        return Illumination.area((0.0, 0.0, height_mm), radius_mm, shape='ring', inner_size=radius_mm,
+                                 samples=samples, sampling='stratified', intensity=intensity)
+
+
+    def key(self):
+        '''
+        Tupla estável das fontes (chave de cache)
+        '''
+
+        return tuple(tuple(sorted(source.items())) for source in self.sources)
+
+
+    # -- Amostragem --
+
+    @staticmethod
+    def _radical_inverse(indices, base):
+        result = np.zeros(len(indices))
+        fraction = 1.0 / base
+        indices = indices.copy()
+        while np.any(indices > 0):
+            result += (indices % base) * fraction
+            indices //= base
+            fraction /= base
+        return result
+
+
+    @classmethod
+    def sample_unit_square(cls, n, sampling='halton', seed=0):
+        '''
+        n pontos em [0, 1)²
+        halton: sequência de baixa discrepância (bases 2 e 3) | stratified: uma amostra com jitter por célula
+        de uma grade ~sqrt(n) x sqrt(n) | random: uniforme
+        '''
+
+        rng = np.random.default_rng(seed)
+
+        if sampling == 'halton':
+            indices = np.arange(1, n + 1)
+            return np.stack((cls._radical_inverse(indices, 2), cls._radical_inverse(indices, 3)), axis=1)
+
+        if sampling == 'stratified':
+            columns = int(np.ceil(np.sqrt(n)))
+            rows = int(np.ceil(n / columns))
+            cells = np.arange(n)
+            u = (cells % columns + rng.random(n)) / columns
+            v = (cells // columns + rng.random(n)) / rows
+            return np.stack((u, v), axis=1)
+
+        return rng.random((n, 2))
+
+
+    @staticmethod
+    def _orthonormal_axes(normal):
+        normal = normal / np.linalg.norm(normal)
+        helper = np.array([1.0, 0.0, 0.0]) if abs(normal[0]) < 0.9 else np.array([0.0, 1.0, 0.0])
+        first = np.cross(normal, helper)
+        first /= np.linalg.norm(first)
+        return first, np.cross(normal, first), normal
+
+
+    @classmethod
+    def sample_area(cls, source):
+        '''
+        Pontos da fonte de área no espaço (mm) e normal da face emissora
+        '''
+
+        unit = cls.sample_unit_square(source['samples'], source['sampling'], source['seed'])
+        u, v = unit[:, 0], unit[:, 1]
+        first, second, normal = cls._orthonormal_axes(np.asarray(source['normal'], dtype=np.float64))
+
+        if source['shape'] == 'rect':
+            width, height = (source['size'] * 2)[:2] if len(source['size']) == 1 else source['size'][:2]
+            a, b = (u - 0.5) * width, (v - 0.5) * height
+
+        else:
+            # Disco/anel com área uniforme: r² uniforme entre o raio interno e o externo
+            outer = source['size'][0]
+            inner = source['inner_size'] if source['shape'] == 'ring' else 0.0
+            radius = np.sqrt(inner**2 + u * (outer**2 - inner**2))
+            angle = 2 * np.pi * v
+            a, b = radius * np.cos(angle), radius * np.sin(angle)
+
+        points = np.asarray(source['center'], dtype=np.float64) + a[:, None] * first + b[:, None] * second
+        return points, normal
+
+
+    @property
+    def n_sources(self):
+        return len(self.positions) + len(self.directions)
+
+
+    # -- Combinação por pixel --
+
+    def _sources_per_chunk(self, n_pixels, itemsize, memory_budget_bytes):
+        return max(1, int(memory_budget_bytes // (n_pixels * self.VALUES_PER_PAIR * itemsize)))
+
+
+    @traced('Illumination')
+    def blend(self, points, normals, physics_model, visuals_model, memory_budget_bytes=DEFAULT_MEMORY_BUDGET):
+        '''
+        Cor de cada pixel como média das cores de todas as fontes, ponderada pela irradiância de cada uma
+        points, normals: (N, 3) já rotacionados
+        O cálculo é um broadcast (pixels x fontes), feito em blocos de fontes dentro do orçamento de memória
+        Retorna (RGB float (N, 3), comprimento de onda médio (N,), irradiância total (N,))
+        '''
+
+        dtype = points.dtype
+        n_pixels = len(points)
+
+        rgb_sum = np.zeros((n_pixels, 3), dtype=np.float64)
+        wavelength_sum = np.zeros(n_pixels, dtype=np.float64)
+        weight_sum = np.zeros(n_pixels, dtype=np.float64)
+
+        def accumulate(cos_incidence, weight):
+            # Mesmo tratamento de Geometry.calculate_theta_3D (face frontal ou traseira)
+            cos_incidence = np.clip(np.abs(np.nan_to_num(cos_incidence, nan=1.0)), 0.0, 1.0)
+            theta = np.degrees(np.arccos(cos_incidence))
+
+            wavelength = physics_model.calculate_wavelength(theta)
+            colors = visuals_model.wavelength_grid_to_rgb(wavelength)
+
+            weight = weight * cos_incidence
+            rgb_sum[:] += np.einsum('ns,nsc->nc', weight, colors, dtype=np.float64)
+
+            wavelength_sum[:] += np.sum(weight * wavelength, axis=1)
+            weight_sum[:] += weight.sum(axis=1)
+
+        chunk = self._sources_per_chunk(n_pixels, dtype.itemsize, memory_budget_bytes)
+
+        # Fontes pontuais (inclui as amostras das fontes de área): queda 1/r² e emissão lambertiana
+        for start in range(0, len(self.positions), chunk):
+            block = slice(start, start + chunk)
+            vectors = self.positions[block].astype(dtype)[None, :, :] - points[:, None, :]
+            distance = np.linalg.norm(vectors, axis=-1)
+            distance[distance == 0] = 1
+            vectors /= distance[..., None]
+
+            cos_incidence = np.einsum('nc,nsc->ns', normals, vectors)
+
+            emitter = self.emitter_normals[block].astype(dtype)
+            emission = -np.einsum('nsc,sc->ns', vectors, emitter)
+            emission = np.where(np.any(emitter != 0, axis=1), np.clip(emission, 0.0, None), 1.0)
+
+            accumulate(cos_incidence, self.point_intensity[block] * emission / distance**2)
+
+        # Fontes direcionais: mesma direção para todos os pixels, sem queda com a distância
+        for start in range(0, len(self.directions), chunk):
+            block = slice(start, start + chunk)
+            cos_incidence = normals @ self.directions[block].astype(dtype).T
+            weight = np.broadcast_to(self.directional_intensity[block], cos_incidence.shape)
+            accumulate(cos_incidence, weight)
+
+        # Pixel sem luz de nenhuma fonte fica preto
+        lit = weight_sum > 0
+        rgb = np.divide(rgb_sum, weight_sum[:, None], out=np.zeros_like(rgb_sum), where=lit[:, None])
+        wavelength = np.divide(wavelength_sum, weight_sum, out=np.full(n_pixels, np.nan), where=lit)
+
+        return rgb, wavelength, weight_sum
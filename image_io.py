@@ -0,0 +1,60 @@
+import os
+import struct
+import zlib
+import numpy as np
+
+class ImageIO:
+    '''
+    Gravação de imagens RGB de 8 bits sem dependências além do NumPy (PNG via zlib)
+    '''
+
+    @staticmethod
+    def _png_chunk(chunk_type, data):
+        chunk = chunk_type + data
+        return struct.pack('>I', len(data)) + chunk + struct.pack('>I', zlib.crc32(chunk) & 0xFFFFFFFF)
+
+
+    @classmethod
+    def encode_png(cls, img_RGB, compression=6):
+        '''
+        Codifica um array (altura, largura, 3) uint8 como PNG
+        Cada linha recebe o filtro 0 (None), montado de uma vez com NumPy
+        '''
+
+        img_RGB = np.ascontiguousarray(img_RGB, dtype=np.uint8)
+        height, width = img_RGB.shape[:2]
+
+        raw = np.zeros((height, width * 3 + 1), dtype=np.uint8)
+        raw[:, 1:] = img_RGB.reshape(height, width * 3)
+
+        header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0) # 8 bits, RGB
+        return b''.join((
+            b'\x89PNG\r\n\x1a\n',
+            cls._png_chunk(b'IHDR', header),
+            cls._png_chunk(b'IDAT', zlib.compress(raw.tobytes(), compression)),
+            cls._png_chunk(b'IEND', b''),
+        ))
+
+
+    @classmethod
+    def write_png(cls, path, img_RGB, compression=6):
+        with open(path, 'wb') as file:
+            file.write(cls.encode_png(img_RGB, compression))
+
+
+    @classmethod
+    def write_sequence(cls, directory, images, prefix='frame', compression=6):
+        '''
+        Grava cada imagem de um iterável como directory/prefix_00000.png, prefix_00001.png...
+        Consome o iterável um quadro por vez, sem acumular a sequência na memória
+        '''
+
+        os.makedirs(directory, exist_ok=True)
+
+        paths = []
+        for index, img_RGB in enumerate(images):
+            path = os.path.join(directory, f"{prefix}_{index:05d}.png")
+            cls.write_png(path, img_RGB, compression)
+            paths.append(path)
+
+        return paths
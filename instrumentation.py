@@ -0,0 +1,184 @@
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import os
+import time
+import tracemalloc
+import numpy as np
+
+logger = logging.getLogger('thin_film.trace')
+
+# Trace ativo no contexto atual (cada thread/sessão do Streamlit tem o seu)
+_active_trace = contextvars.ContextVar('thin_film_trace', default=None)
+
+
+class RenderTrace:
+    def __init__(self, name, trace_memory=False):
+        '''
+        Registro estruturado de uma renderização: uma entrada (span) por etapa instrumentada
+        trace_memory: mede também os bytes líquidos alocados por etapa (tracemalloc, mais lento)
+        '''
+
+        self.name = name
+        self.trace_memory = trace_memory
+        self.spans = []
+        self.total_seconds = 0.0
+        self._stack = []
+
+
+    # Bytes e formatos dos arrays devolvidos por uma etapa
+    @staticmethod
+    def _describe_output(value):
+        arrays = []
+
+        def collect(item):
+            if isinstance(item, np.ndarray):
+                arrays.append(item)
+            elif isinstance(item, (tuple, list)) and len(item) <= 8:
+                for element in item:
+                    collect(element)
+
+        collect(value)
+        return sum(array.nbytes for array in arrays), [list(array.shape) for array in arrays]
+
+
+    def begin(self, name):
+        span = {
+            'name': name,
+            'depth': len(self._stack),
+            'parent': self._stack[-1]['name'] if self._stack else None,
+        }
+        if self.trace_memory:
+            span['_memory_before'] = tracemalloc.get_traced_memory()[0]
+
+        self._stack.append(span)
+        self.spans.append(span)
+        span['_start'] = time.perf_counter()
+        return span
+
+
+    def end(self, span, result=None):
+        span['seconds'] = time.perf_counter() - span.pop('_start')
+        span['output_bytes'], span['output_shapes'] = self._describe_output(result)
+
+        if self.trace_memory:
+            span['allocated_bytes'] = tracemalloc.get_traced_memory()[0] - span.pop('_memory_before')
+
+        self._stack.pop()
+
+
+    def annotate(self, **values):
+        '''
+        Acrescenta informações à etapa em andamento (ex.: acerto ou falta no cache)
+        '''
+
+        if self._stack:
+            self._stack[-1].update(values)
+
+
+    def summary(self):
+        '''
+        Totais por etapa: chamadas, tempo e bytes de saída
+        '''
+
+        totals = {}
+        for span in self.spans:
+            entry = totals.setdefault(span['name'], {'calls': 0, 'seconds': 0.0, 'output_bytes': 0})
+            entry['calls'] += 1
+            entry['seconds'] += span.get('seconds', 0.0)
+            entry['output_bytes'] += span.get('output_bytes', 0)
+        return totals
+
+
+    def to_dict(self):
+        return {
+            'render': self.name,
+            'total_seconds': self.total_seconds,
+            'spans': self.spans,
+        }
+
+
+    def to_json(self):
+        return json.dumps(self.to_dict())
+
+
+class Tracer:
+    '''
+    Ponto de entrada da instrumentação: sem trace ativo, as etapas decoradas
+    custam apenas uma leitura de ContextVar
+    '''
+
+    # THIN_FILM_TRACE=1 liga o log JSON de todas as renderizações do app
+    LOG_BY_DEFAULT = os.environ.get('THIN_FILM_TRACE', '') not in ('', '0')
+
+    @staticmethod
+    @contextlib.contextmanager
+    def render(name, enabled=True, log=None, trace_memory=False):
+        '''
+        Abre um trace para uma renderização; ao final grava uma linha JSON no logger 'thin_film.trace'
+        Com enabled=False devolve None e nada é registrado
+        '''
+
+        if not enabled:
+            yield None
+            return
+
+        trace = RenderTrace(name, trace_memory)
+        token = _active_trace.set(trace)
+
+        started_tracemalloc = trace_memory and not tracemalloc.is_tracing()
+        if started_tracemalloc:
+            tracemalloc.start()
+
+        start = time.perf_counter()
+        try:
+            yield trace
+        finally:
+            trace.total_seconds = time.perf_counter() - start
+            _active_trace.reset(token)
+            if started_tracemalloc:
+                tracemalloc.stop()
+
+            if log if log is not None else Tracer.LOG_BY_DEFAULT:
+                logger.info(trace.to_json())
+
+
+    @staticmethod
+    def current():
+        return _active_trace.get()
+
+
+    @staticmethod
+    def annotate(**values):
+        trace = _active_trace.get()
+        if trace is not None:
+            trace.annotate(**values)
+
+
+def traced(component):
+    '''
+    Decorador de etapa: registra nome, duração e arrays de saída quando há um trace ativo
+    '''
+
+    def decorator(function):
+        name = f"{component}.{function.__name__}"
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            trace = _active_trace.get()
+            if trace is None:
+                return function(*args, **kwargs)
+
+            span = trace.begin(name)
+            result = None
+            try:
+                result = function(*args, **kwargs)
+                return result
+            finally:
+                trace.end(span, result)
+
+        return wrapper
+
+    return decorator
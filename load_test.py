@@ -0,0 +1,125 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+import urllib.parse
+import numpy as np
+
+class LoadTest:
+    def __init__(self, host, port, path, concurrency=16, duration=10.0, vary=None):
+        '''
+        Gerador de carga para a API HTTP: `concurrency` clientes com conexão keep-alive repetem o pedido
+        durante `duration` segundos. vary: parâmetro sorteado a cada pedido (ex.: d) para fugir do cache
+        '''
+
+        self.host = host
+        self.port = port
+        self.path = path
+        self.concurrency = concurrency
+        self.duration = duration
+        self.vary = vary
+
+
+    def _target(self):
+        if self.vary is None:
+            return self.path
+
+        name, low, high = self.vary
+        url = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        query[name] = f"{random.uniform(low, high):.2f}"
+        return f"{url.path}?{urllib.parse.urlencode(query)}"
+
+
+    @staticmethod
+    async def _read_response(reader):
+        status_line = await reader.readline()
+        status = int(status_line.split()[1])
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        size = 0
+        if headers.get('transfer-encoding') == 'chunked':
+            while True:
+                length = int((await reader.readline()).strip(), 16)
+                await reader.readexactly(length + 2)
+                size += length
+                if length == 0:
+                    break
+        else:
+            size = int(headers.get('content-length', 0))
+            await reader.readexactly(size)
+
+        return status, size
+
+
+    async def _client(self, deadline, latencies, statuses, sizes):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                writer.write(f"GET {self._target()} HTTP/1.1\r\nHost: {self.host}\r\n\r\n".encode('latin-1'))
+                await writer.drain()
+
+                status, size = await self._read_response(reader)
+                latencies.append(time.perf_counter() - start)
+                statuses[status] = statuses.get(status, 0) + 1
+                sizes.append(size)
+        finally:
+            writer.close()
+
+
+    async def run(self):
+        latencies, statuses, sizes = [], {}, []
+        start = time.perf_counter()
+        deadline = start + self.duration
+
+        await asyncio.gather(*(self._client(deadline, latencies, statuses, sizes) for _ in range(self.concurrency)))
+        elapsed = time.perf_counter() - start
+
+        latencies_ms = np.array(latencies) * 1000
+        return {
+            'path': self.path,
+            'concurrency': self.concurrency,
+            'seconds': elapsed,
+            'requests': len(latencies),
+            'requests_per_second': len(latencies) / elapsed,
+            'megabytes_per_second': sum(sizes) / elapsed / 1024**2,
+            'statuses': statuses,
+            'latency_ms': {
+                'p50': float(np.percentile(latencies_ms, 50)) if len(latencies) else 0.0,
+                'p95': float(np.percentile(latencies_ms, 95)) if len(latencies) else 0.0,
+                'p99': float(np.percentile(latencies_ms, 99)) if len(latencies) else 0.0,
+            },
+        }
+
+
+def _vary(value):
+    name, low, high = value.split(':')
+    return name, float(low), float(high)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Teste de carga da API HTTP (pedidos por segundo numa máquina)")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--path', nargs='+', default=['/v1/image2d?resolution=200&format=png'])
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--vary', type=_vary, help="nome:mín:máx sorteado a cada pedido (ex.: d:100:400)")
+    args = parser.parse_args(argv)
+
+    for path in args.path:
+        result = asyncio.run(LoadTest(args.host, args.port, path, args.concurrency, args.duration, args.vary).run())
+        print(json.dumps(result), flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+import numpy as np
+from instrumentation import traced
+
+class Multilayer:
+    # Bytes estimados por par (ângulo, comprimento de onda): 4 elementos da matriz acumulada
+    # + matriz da camada + temporários, todos complex128
+    BYTES_PER_SAMPLE = 16 * 16
+    MAX_THETA_DEGREE = 89.999
+
+    def __init__(self, layers, n_substrate=1.5, n_ambient=1.0):
+        '''
+        Pilha de filmes finos sobre um substrato (método de Abelès / matriz de transferência)
+        layers: lista de (n, d) da camada mais externa para a mais interna, com d em nm
+        '''
+
+        self.layers = [(complex(n), float(d)) for n, d in layers]
+        self.n_substrate = complex(n_substrate)
+        self.n_ambient = float(n_ambient)
+
+
+    # Cosseno do ângulo de refração em cada meio
+    def _cos_theta(self, n, sin_theta_ambient):
+        '''
+        Lei de Snell: n0 * sin(theta_0) = n * sin(theta)
+        Raiz complexa para tratar reflexão total interna e meios absorventes
+        '''
+
+        sin_theta = (self.n_ambient * sin_theta_ambient) / n
+        cos_theta = np.sqrt(1 - sin_theta**2 + 0j)
+
+        # Ramo com parte imaginária positiva (onda evanescente decai)
+        return np.where(cos_theta.imag < 0, -cos_theta, cos_theta)
+
+
+    # Admitância óptica efetiva do meio para cada polarização
+    @staticmethod
+    def _admittance(n, cos_theta, polarization):
+        if polarization == 's':
+            return n * cos_theta
+        return n / cos_theta
+
+
+    def _reflectance_block(self, theta_incident_degree, wavelengths, polarization):
+        '''
+        Refletância de um bloco (N ângulos) x (L comprimentos de onda)
+        Produto das matrizes 2x2 de cada camada feito elemento a elemento sobre todo o bloco
+        '''
+
+        theta_i = np.radians(theta_incident_degree)[:, None] # (N, 1)
+        wavelengths = wavelengths[None, :] # (1, L)
+        sin_theta_ambient = np.sin(theta_i)
+
+        cos_ambient = np.cos(theta_i) + 0j
+        eta_ambient = self._admittance(self.n_ambient, cos_ambient, polarization)
+
+        cos_substrate = self._cos_theta(self.n_substrate, sin_theta_ambient)
+        eta_substrate = self._admittance(self.n_substrate, cos_substrate, polarization)
+
+        # Matriz acumulada M = M_1 @ M_2 @ ... @ M_k, iniciada como identidade
+        shape = (theta_i.shape[0], wavelengths.shape[1])
+        m11 = np.ones(shape, dtype=np.complex128)
+        m12 = np.zeros(shape, dtype=np.complex128)
+        m21 = np.zeros(shape, dtype=np.complex128)
+        m22 = np.ones(shape, dtype=np.complex128)
+
+        for n_layer, d_layer in self.layers:
+            cos_layer = self._cos_theta(n_layer, sin_theta_ambient)
+            eta_layer = self._admittance(n_layer, cos_layer, polarization)
+
+            # Matriz característica: [[cos δ, i sin δ / η], [i η sin δ, cos δ]]
+            delta = (2 * np.pi * n_layer * d_layer * cos_layer) / wavelengths
+            cos_delta = np.cos(delta)
+            sin_delta = np.sin(delta)
+            a12 = 1j * sin_delta / eta_layer
+            a21 = 1j * eta_layer * sin_delta
+
+            m11, m12, m21, m22 = (
+                m11 * cos_delta + m12 * a21,
+                m11 * a12 + m12 * cos_delta,
+                m21 * cos_delta + m22 * a21,
+                m21 * a12 + m22 * cos_delta,
+            )
+
+        # Coeficiente de reflexão da pilha
+        B = m11 + m12 * eta_substrate
+        C = m21 + m22 * eta_substrate
+        r = (eta_ambient * B - C) / (eta_ambient * B + C)
+
+        return np.abs(r)**2
+
+
+    @traced('Multilayer')
+    def reflectance(self, theta_incident_degree, wavelengths, polarization='unpolarized', max_bytes=None):
+        '''
+        Refletância R(theta, lambda) para qualquer array de ângulos de incidência (graus)
+        polarization: 's', 'p' ou 'unpolarized' (média de s e p)
+        max_bytes: limite de memória dos temporários; os ângulos são processados em blocos
+        Retorna array com shape theta.shape + (n_wavelengths,)
+        '''
+
+        if polarization not in ('s', 'p', 'unpolarized'):
+            raise ValueError(f"Polarização inválida: {polarization}")
+
+        theta = np.asarray(theta_incident_degree, dtype=np.float64)
+        wavelengths = np.atleast_1d(np.asarray(wavelengths, dtype=np.float64))
+
+        # Ângulos NaN (fora da lente) são calculados como 0° e devolvidos como NaN
+        theta_flat = theta.ravel()
+        invalid = np.isnan(theta_flat)
+        theta_flat = np.where(invalid, 0.0, theta_flat)
+
+        # Ângulos além de 90° (bordas extremas do grid 2D) são tratados como incidência rasante
+        theta_flat = np.clip(np.abs(theta_flat), 0.0, self.MAX_THETA_DEGREE)
+
+        n_angles = theta_flat.shape[0]
+        if max_bytes is None:
+            chunk = max(n_angles, 1)
+        else:
+            chunk = max(1, int(max_bytes // (self.BYTES_PER_SAMPLE * wavelengths.shape[0])))
+
+        reflectance = np.empty((n_angles, wavelengths.shape[0]), dtype=np.float64)
+
+        for start in range(0, n_angles, chunk):
+            block = theta_flat[start:start + chunk]
+
+            if polarization == 'unpolarized':
+                R_s = self._reflectance_block(block, wavelengths, 's')
+                R_p = self._reflectance_block(block, wavelengths, 'p')
+                reflectance[start:start + chunk] = 0.5 * (R_s + R_p)
+
+            else:
+                reflectance[start:start + chunk] = self._reflectance_block(block, wavelengths, polarization)
+
+        reflectance[invalid] = np.nan
+        return reflectance.reshape(theta.shape + (wavelengths.shape[0],))
@@ -1,13 +1,16 @@
 import numpy as np
+from instrumentation import traced
 
 class Physics:
-    def __init__(self, n_film, d, m):
+    def __init__(self, n_film, d, m, dtype=np.float64):
         self.n_film = n_film
         self.d = d
         self.m = m 
+        self.dtype = np.dtype(dtype) # política de precisão (float32 ou float64)
 
     
     # Cálculo do comprimento de onda
+    @traced('Physics')
     def calculate_wavelength(self, theta_incident_degree):
         """
         Calcula o comprimento de onda (lambda) para interferência construtiva.
@@ -15,7 +18,7 @@ class Physics:
         """
 
         # 1. Converter o ângulo incidente de graus para radianos
-        theta_i = np.radians(theta_incident_degree)
+        theta_i = np.radians(theta_incident_degree).astype(self.dtype, copy=False)
 
         # 2. Aplicação da Lei de Snell para achar o ângulo theta_r dentro do filme 
         # Equação: n1 * sin(theta_i) = n2 * sin(theta_r) -> para n_ar = 1.0
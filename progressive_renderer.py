@@ -0,0 +1,202 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+import numpy as np
+from render_service import RenderService, RenderTimeout
+from simulation_engine import CacheMiss
+
+class ProgressiveRenderer:
+    # Como cada método entrega a prévia: 'image' -> primeiro item do resultado é uma imagem (res, res, 3),
+    # ampliada até a resolução final; 'figure' -> figura 3D, que já ocupa a mesma área em qualquer resolução
+    METHODS = {
+        'simulation_grid_2D': 'image',
+        'simulation_spectral_2D': 'image',
+        'simulation_map_3D': 'image',
+        'simulation_grid_3D': 'figure',
+        'simulation_spectral_3D': 'figure',
+    }
+
+    LATENCY_WINDOW = 1000
+
+    # Instância única do processo (as sessões do Streamlit se cancelam pelo identificador de sessão)
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, service=None, min_resolution=80, factor=2):
+        '''
+        Renderização progressiva do grosso para o fino: todas as etapas da escada de resoluções entram
+        juntas na fila do RenderService (a mais grossa fica pronta quase imediatamente) e cada uma é
+        entregue assim que termina, se for mais fina que a última já entregue
+        Com o resultado final já em cache, ele é a primeira e única etapa
+        Uma nova renderização na mesma sessão cancela o refinamento da anterior
+        '''
+
+        self.service = service or RenderService.shared()
+        self.min_resolution = min_resolution
+        self.factor = factor
+
+        self._lock = threading.Lock()
+        self._sessions = {} # sessão -> etapas pendentes da renderização atual
+
+        self.renders = 0
+        self.cancelled = 0
+        self._first_seconds = deque(maxlen=self.LATENCY_WINDOW)
+        self._final_seconds = deque(maxlen=self.LATENCY_WINDOW)
+
+
+    @classmethod
+    def shared(cls):
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls(RenderService.shared())
+            return cls._shared
+
+
+    def ladder(self, resolution):
+        '''
+        Resoluções das etapas, da mais grossa até a pedida (ex.: 500 -> [125, 250, 500])
+        '''
+
+        resolutions = [int(resolution)]
+        while resolutions[0] // self.factor >= self.min_resolution:
+            resolutions.insert(0, resolutions[0] // self.factor)
+        return resolutions
+
+
+    @staticmethod
+    def upsample(image, resolution):
+        '''
+        Amplia a imagem da etapa grossa até a resolução final (vizinho mais próximo, só indexação)
+        '''
+
+        if image.shape[0] == resolution:
+            return image
+
+        rows = (np.arange(resolution) * image.shape[0]) // resolution
+        cols = (np.arange(resolution) * image.shape[1]) // resolution
+        return image[rows[:, None], cols[None, :]]
+
+
+    def _preview(self, method, result, resolution):
+        if self.METHODS.get(method) != 'image':
+            return result
+
+        if isinstance(result, tuple):
+            return (self.upsample(result[0], resolution),) + result[1:]
+        return self.upsample(result, resolution)
+
+
+    def cancel(self, session):
+        '''
+        Descarta as etapas ainda na fila da renderização em andamento da sessão
+        '''
+
+        with self._lock:
+            pending = self._sessions.pop(session, None)
+        if not pending:
+            return 0
+
+        cancelled = sum(step.cancel() for step in list(pending.values()))
+        with self._lock:
+            self.cancelled += 1
+        return cancelled
+
+
+    def render(self, method, engine_params, *args, session=None, timeout=None, **kwargs):
+        '''
+        Gerador de etapas {resolution, final, result, seconds}: result tem o formato do método do engine,
+        com a imagem das etapas grossas já ampliada até a resolução pedida
+        O tempo até a primeira imagem e até a imagem final entram em stats()
+        session: identifica quem pede (ex.: sessão do Streamlit); um novo pedido cancela o anterior
+        '''
+
+        start = time.perf_counter()
+        resolution = int(engine_params['resolution'])
+        deadline = start + (self.service.default_timeout if timeout is None else timeout)
+
+        if session is not None:
+            self.cancel(session)
+
+        # 1. Resultado final já em cache: entregue como etapa única, sem pôr a escada na fila
+        try:
+            result = self.service.cached(method, engine_params, *args, **kwargs)
+        except CacheMiss:
+            pass
+        else:
+            seconds = time.perf_counter() - start
+            with self._lock:
+                self.renders += 1
+                self._first_seconds.append(seconds)
+                self._final_seconds.append(seconds)
+            yield {'resolution': resolution, 'final': True, 'result': result, 'seconds': seconds}
+            return
+
+        # 2. Todas as etapas na fila de uma vez, da mais grossa para a mais fina
+        pending = {
+            step_resolution: self.service.submit(method, dict(engine_params, resolution=step_resolution), *args, **kwargs)
+            for step_resolution in self.ladder(resolution)
+        }
+        if session is not None:
+            with self._lock:
+                self._sessions[session] = pending
+
+        with self._lock:
+            self.renders += 1
+
+        delivered = 0
+        try:
+            while delivered < resolution:
+                waiting = {step.future: step_resolution for step_resolution, step in pending.items()}
+                done, _ = wait(waiting, timeout=max(0.0, deadline - time.perf_counter()), return_when=FIRST_COMPLETED)
+                if not done:
+                    raise RenderTimeout(f"Renderização progressiva '{method}' não terminou a tempo")
+
+                # Outra renderização da mesma sessão assumiu: este gerador para sem entregar mais nada
+                if session is not None and self._sessions.get(session) is not pending:
+                    return
+
+                # 3. Entrega a etapa mais fina já pronta; as mais grossas que ela deixam de interessar
+                step_resolution = max(waiting[future] for future in done)
+                result = pending.pop(step_resolution).result(timeout=0)
+                for coarser in [value for value in pending if value < step_resolution]:
+                    pending.pop(coarser).cancel()
+
+                seconds = time.perf_counter() - start
+                final = step_resolution == resolution
+                with self._lock:
+                    if delivered == 0:
+                        self._first_seconds.append(seconds)
+                    if final:
+                        self._final_seconds.append(seconds)
+
+                delivered = step_resolution
+                yield {
+                    'resolution': step_resolution,
+                    'final': final,
+                    'result': self._preview(method, result, resolution),
+                    'seconds': seconds,
+                }
+
+        finally:
+            # Gerador fechado antes do fim (parâmetros mudaram, script interrompido): refinamento descartado
+            for step in pending.values():
+                step.cancel()
+            if session is not None:
+                with self._lock:
+                    if self._sessions.get(session) is pending:
+                        del self._sessions[session]
+
+
+    def stats(self):
+        '''
+        Tempo até a primeira imagem e até a imagem final (percentis), renderizações e cancelamentos
+        '''
+
+        with self._lock:
+            return {
+                'renders': self.renders,
+                'cancelled': self.cancelled,
+                'time_to_first': RenderService._percentiles(list(self._first_seconds)),
+                'time_to_final': RenderService._percentiles(list(self._final_seconds)),
+            }
@@ -0,0 +1,286 @@
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import numpy as np
+from cache import ResultCache
+from simulation_engine import SimulationEngine
+
+class RenderTimeout(TimeoutError):
+    '''
+    A renderização não terminou dentro do prazo do pedido
+    '''
+
+
+class PendingRender:
+    def __init__(self, service, key, entry, method, start):
+        '''
+        Pedido submetido ao RenderService: o resultado é lido com result() ou o pedido é desistido com cancel()
+        '''
+
+        self.service = service
+        self.key = key
+        self.entry = entry
+        self.method = method
+        self.start = start
+        self.released = False
+
+    @property
+    def future(self):
+        return self.entry[0]
+
+
+    def done(self):
+        return self.future.done()
+
+
+    def result(self, timeout=None):
+        '''
+        timeout: segundos de espera (padrão default_timeout do serviço); estourado, levanta RenderTimeout
+        '''
+
+        service = self.service
+        timeout = service.default_timeout if timeout is None else timeout
+        try:
+            value = self.future.result(timeout=timeout)
+
+        except FutureTimeoutError:
+            with service._lock:
+                service.timeouts += 1
+            self.cancel()
+            raise RenderTimeout(f"Renderização '{self.method}' não terminou em {timeout:g}s")
+
+        except Exception:
+            with service._lock:
+                service.failures += 1
+            raise
+
+        with service._lock:
+            service._latency_seconds.append(time.perf_counter() - self.start)
+        # Pedidos agrupados recebem o mesmo resultado: figuras (mutáveis) são copiadas para cada um
+        return ResultCache._share(value)
+
+
+    def cancel(self):
+        '''
+        Desiste do pedido: se ninguém mais espera e ele ainda está na fila, sai do agrupamento e é descartado
+        (uma renderização já rodando termina, mas o resultado é ignorado)
+        '''
+
+        service = self.service
+        with service._lock:
+            if self.released:
+                return False
+            self.released = True
+            self.entry[1] -= 1
+
+            # Cancelar com o lock: nenhum pedido novo se junta a um future que está sendo descartado
+            # (o callback _finish roda nesta mesma thread e tira a entrada de _in_flight)
+            if self.entry[1] > 0 or not self.future.cancel():
+                return False
+            if service._in_flight.get(self.key) is self.entry:
+                del service._in_flight[self.key]
+            service.cancelled += 1
+            return True
+
+
+class RenderService:
+    # Instância única do processo, compartilhada pelas threads de sessão do Streamlit
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    LATENCY_WINDOW = 1000 # últimas latências guardadas para os percentis
+
+    def __init__(self, max_workers=None, default_timeout=30.0):
+        '''
+        Serviço de renderização do processo: pedidos idênticos em andamento são agrupados (uma única
+        computação para N esperas) e as renderizações pesadas rodam num pool limitado de threads
+        (o NumPy libera o GIL); os demais pedidos esperam na fila até o prazo de cada um
+        '''
+
+        self.max_workers = max_workers or os.cpu_count()
+        self.default_timeout = default_timeout
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='render')
+
+        self._lock = threading.RLock() # reentrante: future.cancel() chama _finish na mesma thread
+        self._in_flight = {} # chave -> [future, número de pedidos esperando]
+
+        self.queued = 0
+        self.running = 0
+        self.requests = 0
+        self.coalesced = 0
+        self.completed = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.cancelled = 0 # pedidos descartados ainda na fila (desistência ou prazo)
+        self._queue_seconds = deque(maxlen=self.LATENCY_WINDOW)
+        self._render_seconds = deque(maxlen=self.LATENCY_WINDOW)
+        self._latency_seconds = deque(maxlen=self.LATENCY_WINDOW)
+
+
+    @classmethod
+    def shared(cls):
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+
+    # Pedido identificado pelo método, parâmetros do engine e argumentos (mesma normalização do cache)
+    @staticmethod
+    def request_key(method, engine_params, args, kwargs):
+        return (
+            method,
+            tuple(sorted((name, ResultCache.normalize_key((value,))[0]) for name, value in engine_params.items())),
+            ResultCache.normalize_key(args),
+            tuple(sorted((name, ResultCache.normalize_key((value,))[0]) for name, value in kwargs.items())),
+        )
+
+
+    @staticmethod
+    def _render_engine(method, engine_params, args, kwargs):
+        engine = SimulationEngine(**engine_params)
+        return getattr(engine, method)(*args, **kwargs)
+
+
+    def _execute(self, function, args, submitted):
+        started = time.perf_counter()
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+            self._queue_seconds.append(started - submitted)
+
+        try:
+            return function(*args)
+        finally:
+            with self._lock:
+                self.running -= 1
+                self._render_seconds.append(time.perf_counter() - started)
+
+
+    def submit(self, method, engine_params, *args, **kwargs):
+        '''
+        Coloca SimulationEngine(**engine_params).method(*args, **kwargs) na fila do pool sem esperar
+        Se um pedido idêntico já está na fila ou rodando, o novo pedido passa a esperar o mesmo resultado
+        Retorna PendingRender
+        '''
+
+        key = self.request_key(method, engine_params, args, kwargs)
+        start = time.perf_counter()
+
+        with self._lock:
+            self.requests += 1
+            entry = self._in_flight.get(key)
+
+            if entry is not None:
+                entry[1] += 1
+                self.coalesced += 1
+
+            else:
+                # O contexto do chamador (trace ativo) acompanha a computação na thread do pool
+                context = contextvars.copy_context()
+                future = self._executor.submit(context.run, self._execute, self._render_engine,
+                                               (method, engine_params, args, kwargs), start)
+                entry = [future, 1]
+                self._in_flight[key] = entry
+                self.queued += 1
+                future.add_done_callback(lambda _, key=key, entry=entry: self._finish(key, entry))
+
+        return PendingRender(self, key, entry, method, start)
+
+
+    def cached(self, method, engine_params, *args, **kwargs):
+        '''
+        Resultado de SimulationEngine(**engine_params).method(*args, **kwargs) se já está em cache,
+        lido na thread do chamador sem passar pela fila; senão levanta CacheMiss
+        '''
+
+        return SimulationEngine(**engine_params).cached_result(method, *args, **kwargs)
+
+
+    def render(self, method, engine_params, *args, timeout=None, **kwargs):
+        '''
+        Executa SimulationEngine(**engine_params).method(*args, **kwargs) no pool e espera o resultado
+        timeout: segundos de espera (padrão default_timeout); estourado, levanta RenderTimeout
+        '''
+
+        return self.submit(method, engine_params, *args, **kwargs).result(timeout)
+
+
+    def run(self, function, *args, timeout=None):
+        '''
+        Executa uma tarefa pesada qualquer no mesmo pool (ex.: uma faixa de uma imagem ladrilhada),
+        sem agrupamento, mas com a mesma fila, prazo e métricas das renderizações
+        '''
+
+        start = time.perf_counter()
+        with self._lock:
+            self.requests += 1
+            self.queued += 1
+            future = self._executor.submit(contextvars.copy_context().run, self._execute, function, args, start)
+            entry = [future, 1]
+            future.add_done_callback(lambda _, entry=entry: self._finish(None, entry))
+
+        try:
+            value = future.result(timeout=self.default_timeout if timeout is None else timeout)
+        except FutureTimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            future.cancel()
+            raise RenderTimeout(f"Tarefa não terminou em {timeout or self.default_timeout:g}s")
+
+        with self._lock:
+            self._latency_seconds.append(time.perf_counter() - start)
+        return value
+
+
+    def _finish(self, key, entry):
+        with self._lock:
+            if self._in_flight.get(key) is entry:
+                del self._in_flight[key]
+            if entry[0].cancelled():
+                self.queued -= 1
+            else:
+                self.completed += 1
+
+
+    @staticmethod
+    def _percentiles(values):
+        if not values:
+            return {'p50_ms': 0.0, 'p95_ms': 0.0, 'max_ms': 0.0}
+
+        values = np.array(values) * 1000
+        return {
+            'p50_ms': float(np.percentile(values, 50)),
+            'p95_ms': float(np.percentile(values, 95)),
+            'max_ms': float(values.max()),
+        }
+
+
+    def stats(self):
+        '''
+        Profundidade da fila, pedidos em andamento e latências (espera na fila, renderização e total)
+        '''
+
+        with self._lock:
+            return {
+                'workers': self.max_workers,
+                'queue_depth': self.queued,
+                'running': self.running,
+                'in_flight': len(self._in_flight),
+                'requests': self.requests,
+                'coalesced': self.coalesced,
+                'completed': self.completed,
+                'failures': self.failures,
+                'timeouts': self.timeouts,
+                'cancelled': self.cancelled,
+                'queue_latency': self._percentiles(list(self._queue_seconds)),
+                'render_latency': self._percentiles(list(self._render_seconds)),
+                'request_latency': self._percentiles(list(self._latency_seconds)),
+            }
+
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
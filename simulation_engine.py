@@ -1,20 +1,241 @@
+import contextlib
+import os
 import numpy as np
 from physics import Physics
 from geometry import Geometry
 from data import Data
 from visuals import Visuals
+from multilayer import Multilayer
+from colorimetry import Colorimetry
+from illumination import Illumination
+from tolerance import Tolerance
+from camera_renderer import CameraRenderer
+from surface import SphericalSurface
+from fused_kernels import FusedKernels
+from cache import ResultCache
+from disk_cache import DiskCache
+from image_io import ImageIO
+from instrumentation import traced, Tracer
+
+class CacheMiss(LookupError):
+    '''
+    O resultado pedido a cached_result não está em cache (nada foi calculado)
+    '''
+
 
 class SimulationEngine:
-    def __init__(self, n_film, d, m, diopter=0.0, resolution=0.0, rot_x=0.0, rot_y=0.0):
-        self.physics_model = Physics(n_film, d, m)
-        self.geometry_model = Geometry(rot_x, rot_y, diopter, resolution)
+    LENS_LIMIT_MM = 25 # Raio de 25 mm da lente 3D
+    SPECTRAL_WAVELENGTHS = np.arange(380, 781, 5.0) # Eixo espectral da cor CIE (nm)
+
+    # Cache de resultados compartilhado por todas as instâncias do processo
+    result_cache = ResultCache()
+
+    # Cache em disco compartilhado entre processos (ativado por THIN_FILM_CACHE_DIR ou configure_disk_cache)
+    # MODEL_VERSION entra no hash de cada resultado: mudar a física invalida o que estava gravado
+    MODEL_VERSION = '1'
+    DISK_CACHED_STAGES = ('figure_1D', 'grid_2D', 'spectral_2D', 'wavelength_3D', 'figure_3D', 'map_3D', 'spectral_3D')
+    disk_cache = DiskCache(os.environ['THIN_FILM_CACHE_DIR'], model_version=MODEL_VERSION) \
+        if os.environ.get('THIN_FILM_CACHE_DIR') else None
+
+    # Grafo de etapas da simulação 3D: entradas de que cada etapa depende (incluindo as herdadas)
+    _GEOMETRY_3D = ('resolution', 'diopter', 'glass_index', 'surface')
+    _ROTATION_3D = _GEOMETRY_3D + ('rot_x', 'rot_y')
+    _LIGHT_3D = _ROTATION_3D + ('light_distance_mm',)
+    _THETA_3D = _LIGHT_3D + ('backend',)
+    STAGES_3D = {
+        'grid_3D': ('resolution',),
+        'surface_3D': _GEOMETRY_3D,
+        'normals_3D': _GEOMETRY_3D,
+        'rotation_3D': _ROTATION_3D,
+        'light_3D': _LIGHT_3D,
+        'theta_3D': _THETA_3D,
+        'fused_3D': _THETA_3D + ('n_film', 'd', 'm'),
+        'wavelength_3D': _THETA_3D + ('n_film', 'd', 'm'),
+        'figure_3D': _THETA_3D + ('n_film', 'd', 'm', 'payload'),
+        'map_3D': _THETA_3D + ('n_film', 'd', 'm'),
+    }
+
+    PRECISIONS = {'float32': np.float32, 'float64': np.float64}
+
+    # Backend do caminho fundido theta + lambda da lente 3D (None: etapas NumPy separadas de referência)
+    DEFAULT_BACKEND = os.environ.get('THIN_FILM_BACKEND') or None
+
+    # Varreduras (animações): parâmetros que podem variar quadro a quadro e orçamento padrão de cada lote
+    SWEEP_PARAMETERS_3D = ('rot_x', 'rot_y', 'light_distance_mm', 'd')
+    SWEEP_MEMORY_BUDGET = 256 * 1024**2
+
+    def __init__(self, n_film, d, m, diopter=0.0, resolution=0.0, rot_x=0.0, rot_y=0.0, use_cache=True,
+                 precision='float64', memory_budget_bytes=None, surface=None, backend=DEFAULT_BACKEND):
+        '''
+        precision: 'float32' ou 'float64', repassada a Geometry e Physics
+        memory_budget_bytes: se definido, a vetorização 3D roda em blocos de linhas dentro desse orçamento
+        surface: modelo de superfície da lente 3D (ver surface.py); None usa a esfera dada por diopter e glass_index
+        backend: None (referência) ou 'auto' / 'numba' / 'numexpr' / 'numpy' para o caminho fundido (ver FusedKernels)
+        '''
+
+        if precision not in self.PRECISIONS:
+            raise ValueError(f"Precisão inválida: {precision}")
+
+        self.precision = precision
+        self.memory_budget_bytes = memory_budget_bytes
+        dtype = self.PRECISIONS[precision]
+
+        self.physics_model = Physics(n_film, d, m, dtype=dtype)
+        self.geometry_model = Geometry(rot_x, rot_y, diopter, resolution, dtype=dtype)
         self.database = Data(physics=self.physics_model)
         self.visuals_models = Visuals()
+        self.cache = SimulationEngine.result_cache if use_cache else None
+        self.surface = surface
+        self.kernels = FusedKernels(backend) if backend is not None else None
+        self._cache_only = False
+        self._call_memo = None # sem cache compartilhado: etapas já avaliadas na chamada externa em andamento
+
+
+    @classmethod
+    def cache_stats(cls):
+        '''
+        Contadores de acertos, faltas e remoções do cache compartilhado
+        '''
+
+        return cls.result_cache.stats()
+
+
+    @classmethod
+    def configure_disk_cache(cls, directory, max_bytes=2 * 1024**3):
+        '''
+        Ativa (ou, com directory=None, desativa) o cache persistente das saídas em DISK_CACHED_STAGES
+        '''
+
+        cls.disk_cache = DiskCache(directory, max_bytes, cls.MODEL_VERSION) if directory else None
+        return cls.disk_cache
+
+
+    def cached_result(self, method, *args, **kwargs):
+        '''
+        Resultado de self.method(*args, **kwargs) apenas se ele já está no cache (memória ou disco)
+        Sem o resultado em cache levanta CacheMiss, sem calcular nenhuma etapa
+        '''
+
+        if self.cache is None:
+            raise CacheMiss(method)
+
+        self._cache_only = True
+        try:
+            return getattr(self, method)(*args, **kwargs)
+        finally:
+            self._cache_only = False
+
+
+    # Parâmetros físicos que identificam cada etapa no cache
+    def _film_key(self):
+        return (self.physics_model.n_film, self.physics_model.d, self.physics_model.m)
+
+    def _geometry_key(self):
+        return (self.geometry_model.diopter, self.geometry_model.resolution)
+
+    def _rotation_key(self):
+        return (self.geometry_model.rot_x, self.geometry_model.rot_y)
+
+    def _surface_key(self):
+        return (None if self.surface is None else self.surface.key(),)
+
+
+    # Modelo de superfície da lente 3D
+    def surface_model(self, glass_index):
+        '''
+        Superfície configurada no engine ou, por padrão, a calota esférica da dioptria e do índice do vidro
+        '''
+
+        if self.surface is not None:
+            return self.surface
+        return SphericalSurface.from_diopter(self.geometry_model.diopter, glass_index)
 
 
-    def simulation_figure_1D(self):
+    def _uncached(self, stage):
+        '''
+        Marca um caminho que calcula sem passar por _cached: numa consulta de cached_result é uma falta
+        '''
+
+        if self._cache_only:
+            raise CacheMiss(stage)
+
+
+    @contextlib.contextmanager
+    def _memo_scope(self):
+        '''
+        Sem cache compartilhado (use_cache=False): as etapas avaliadas dentro do bloco rodam uma única vez
+        e o memo é descartado na saída do bloco mais externo (nada fica retido entre renderizações)
+        '''
+
+        if self.cache is not None or self._call_memo is not None:
+            yield
+            return
+
+        self._call_memo = {}
+        try:
+            yield
+        finally:
+            self._call_memo = None
+
+
+    def _cached(self, stage, key, compute):
+        '''
+        Memoiza o resultado de uma etapa pela tupla normalizada de parâmetros
+        '''
+
+        key = (stage,) + ResultCache.normalize_key(key) + (self.precision,)
+
+        if self.cache is None:
+            with self._memo_scope():
+                if key not in self._call_memo:
+                    self._call_memo[key] = compute()
+                return self._call_memo[key]
+
+        disk_cache = self.disk_cache if stage in self.DISK_CACHED_STAGES else None
+        source = []
+
+        # Falta no cache em memória: tenta o disco antes de calcular
+        def compute_and_mark():
+            if disk_cache is not None:
+                value = disk_cache.get(key)
+                if value is not DiskCache.MISSING:
+                    source.append('disk')
+                    return value
+
+            if self._cache_only:
+                raise CacheMiss(stage)
+
+            source.append('miss')
+            value = compute()
+            if disk_cache is not None:
+                disk_cache.put(key, value)
+            return value
+
+        value = self.cache.get_or_compute(key, compute_and_mark)
+        cache = source[0] if source else 'hit'
+        Tracer.annotate(cache=cache)
+
+        # Figura 3D vinda do cache (cópia própria do chamador): nada foi construído nesta chamada
+        payload = getattr(getattr(value, 'layout', None), 'meta', None)
+        if cache != 'miss' and isinstance(payload, dict) and 'payload' in payload:
+            value.update_layout(meta={'payload': {**payload['payload'], 'build_seconds': 0.0, 'cache': cache}})
+        return value
+
+
+    @traced('SimulationEngine')
+    def simulation_figure_1D(self, n_angles=100):
+        '''
+        Curva comprimento de onda x ângulo com n_angles amostras; o gráfico recebe uma versão reduzida
+        Retorna (figure, angles, wavelengths) com a curva completa
+        '''
+
+        key = self._film_key() + (n_angles,)
+        return self._cached('figure_1D', key, lambda: self._compute_simulation_figure_1D(n_angles))
+
+
+    def _compute_simulation_figure_1D(self, n_angles=100):
         # Conjunto de Ângulos e Comprimentos de Onda
-        angles, wavelengths = self.database.data_generate()
+        angles, wavelengths = self.database.data_generate(n_angles)
 
         # Exibição do gráfico de Comprimento de Onda em função dos Ângulos de Incidência
         figure = self.visuals_models.wavelength_function_angle_graph(angles, wavelengths)
@@ -22,14 +243,21 @@ class SimulationEngine:
         return figure, angles, wavelengths
 
 
-    def simulation_grid_2D(self, lens_diameter_mm, glass_index):
+    @traced('SimulationEngine')
+    def theta_grid_2D(self, lens_diameter_mm, glass_index):
         '''
-        Constrói o grid de coordenadas e administra as demais dependências para exibir simulação 2D
+        Constrói o grid de coordenadas 2D e o mapa de ângulos de incidência de cada pixel
+        Retorna (theta_grid, mask, theta_max_degree)
         '''
 
+        key = self._geometry_key() + (lens_diameter_mm, glass_index)
+        return self._cached('theta_grid_2D', key, lambda: self._compute_theta_grid_2D(lens_diameter_mm, glass_index))
+
+
+    def _compute_theta_grid_2D(self, lens_diameter_mm, glass_index):
         # 1. Criar um grid de coordenadas (x, y)
-        x = np.linspace(-1, 1, self.geometry_model.resolution)
-        y = np.linspace(-1, 1, self.geometry_model.resolution)
+        x = np.linspace(-1, 1, self.geometry_model.resolution, dtype=self.geometry_model.dtype)
+        y = np.linspace(-1, 1, self.geometry_model.resolution, dtype=self.geometry_model.dtype)
         X, Y = np.meshgrid(x, y)
 
         # 2. Calcular a distância do centro (0 <= raio R <= 1)
@@ -42,7 +270,29 @@ class SimulationEngine:
         # Quanto mais longe do centro, maior o ângulo (devido à curvatura)
         # Multiplica-se por 90 para simular até 90° na borda extrema se a curvatura for 
         theta_max_degree = self.geometry_model.calculate_theta_max_2D(lens_diameter_mm, glass_index)
-        theta_grid = R * theta_max_degree
+        theta_grid = (R * theta_max_degree).astype(self.geometry_model.dtype, copy=False)
+
+        return theta_grid, mask, theta_max_degree
+
+
+    @traced('SimulationEngine')
+    def simulation_grid_2D(self, lens_diameter_mm, glass_index, radial_symmetry=True):
+        '''
+        Constrói o grid de coordenadas e administra as demais dependências para exibir simulação 2D
+        Com radial_symmetry=True a física e a cor são calculadas sobre um perfil radial 1D
+        e depois espalhadas pelo disco com o mapa de índices em cache
+        '''
+
+        key = self._film_key() + self._geometry_key() + (lens_diameter_mm, glass_index, radial_symmetry)
+        return self._cached('grid_2D', key, lambda: self._compute_simulation_grid_2D(lens_diameter_mm, glass_index, radial_symmetry))
+
+
+    def _compute_simulation_grid_2D(self, lens_diameter_mm, glass_index, radial_symmetry=True):
+        if radial_symmetry:
+            return self._simulation_grid_2D_radial(lens_diameter_mm, glass_index)
+
+        # 1-4. Grid, máscara e ângulo de incidência por pixel
+        theta_grid, mask, theta_max_degree = self.theta_grid_2D(lens_diameter_mm, glass_index)
 
         # 5. Calcular comprimento de onda para cada pixel para cada pixel
         # Aplica-se a função matemática em toda a matriz de uma vez (vetorização)
@@ -53,50 +303,668 @@ class SimulationEngine:
         return image_RGB, theta_max_degree
     
 
-    def simulation_grid_3D(self, glass_index, light_distance_mm=None):
+    def _simulation_grid_2D_radial(self, lens_diameter_mm, glass_index):
         '''
-        Constrói o grid de coordenadas e administra as demais dependências para exibir simulação 3D
+        Caminho rápido da simulação 2D: theta_grid = R * theta_max depende apenas do raio
         '''
-        
-        # 1. Configuração do grid
-        limit = 25 # Raio de 25 mm
-        x = np.linspace(-limit, limit, self.geometry_model.resolution)
-        y = np.linspace(-limit, limit, self.geometry_model.resolution)
+
+        # 1. Perfil radial com resolução sub-pixel e mapa raio -> índice (em cache por resolução)
+        radii, index_map = self.geometry_model.radial_index_map()
+
+        # 2. Física e cor apenas ao longo do raio
+        theta_max_degree = self.geometry_model.calculate_theta_max_2D(lens_diameter_mm, glass_index)
+        lambda_profile = self.physics_model.calculate_wavelength(radii * theta_max_degree)
+        profile_RGB = self.visuals_models.wavelength_grid_to_rgb(lambda_profile, radii <= 1.0)
+
+        # 3. Pintar o disco a partir do perfil
+        image_RGB = profile_RGB[index_map]
+        return image_RGB, theta_max_degree
+
+
+    def _stage_3D(self, stage, compute, glass_index, light_distance_mm=None, payload='full'):
+        '''
+        Avalia uma etapa do grafo 3D: a chave no cache contém apenas as entradas declaradas em STAGES_3D,
+        então a etapa só é recalculada quando uma delas muda
+        '''
+
+        inputs = {
+            'resolution': self.geometry_model.resolution,
+            'diopter': self.geometry_model.diopter,
+            'glass_index': glass_index,
+            'surface': self._surface_key()[0],
+            'rot_x': self.geometry_model.rot_x,
+            'rot_y': self.geometry_model.rot_y,
+            'light_distance_mm': light_distance_mm,
+            'backend': None if self.kernels is None else self.kernels.backend,
+            'n_film': self.physics_model.n_film,
+            'd': self.physics_model.d,
+            'm': self.physics_model.m,
+            'payload': payload,
+        }
+
+        key = tuple(inputs[name] for name in self.STAGES_3D[stage])
+        return self._cached(stage, key, compute)
+
+
+    @traced('SimulationEngine')
+    def grid_3D(self):
+        '''
+        Grid de coordenadas (x, y) da lente 3D em mm
+        '''
+
+        return self._stage_3D('grid_3D', self._compute_grid_3D, glass_index=None)
+
+
+    def _compute_grid_3D(self):
+        limit = self.LENS_LIMIT_MM
+        x = np.linspace(-limit, limit, self.geometry_model.resolution, dtype=self.geometry_model.dtype)
+        y = np.linspace(-limit, limit, self.geometry_model.resolution, dtype=self.geometry_model.dtype)
         X, Y = np.meshgrid(x, y)
+        return X, Y
+
+
+    @traced('SimulationEngine')
+    def surface_grid_3D(self, glass_index):
+        '''
+        Constrói o grid de coordenadas 3D e a superfície (sem rotação) da lente
+        Retorna (X, Y, Z, surface)
+        '''
+
+        return self._stage_3D('surface_3D', lambda: self._compute_surface_grid_3D(glass_index), glass_index)
+
+
+    def _compute_surface_grid_3D(self, glass_index):
+        # 1. Configuração do grid
+        X, Y = self.grid_3D()
+
+        # 2. Gerar a superfície da lente pelo modelo (padrão: esfera com R = (n-1)/D * 1000, plano se D = 0)
+        surface = self.surface_model(glass_index)
+        Z = self.geometry_model.surface_sag_3D(X, Y, surface, self.LENS_LIMIT_MM)
+
+        return X, Y, Z, surface
+
+
+    @traced('SimulationEngine')
+    def surface_normals_3D(self, glass_index):
+        '''
+        Normais da superfície sem rotação (reaproveitadas em toda mudança de inclinação)
+        '''
+
+        return self._stage_3D('normals_3D', lambda: self._compute_surface_normals_3D(glass_index), glass_index)
 
-        # 2. Gerar a superfície da lente
-        # Equação pro raio de curvatura: R = (n-1)/D * 1000
-        # Se D = 0, R é infinito (plano)
-        radius_curvature_mm = self.geometry_model.calculate_radius_curvature(glass_index)
 
-        if self.geometry_model.diopter < 0.1:
-            Z = np.zeros_like(X)
-            mask_circle = None
+    def _compute_surface_normals_3D(self, glass_index):
+        X, Y, Z, surface = self.surface_grid_3D(glass_index)
+        return self.geometry_model.surface_normals_3D(X, Y, Z, surface)
 
-        else:
-            # Equação da esfera: Z = sqrt(R^2 - X^2 - Y^2) - R (para centrar no zero)
-            term = np.clip(radius_curvature_mm**2 - X**2 - Y**2, 0, None)
-            Z = np.sqrt(term) - radius_curvature_mm
 
-            # Máscara circular
-            mask_circle = (X**2 + Y**2) > (limit**2)
+    @traced('SimulationEngine')
+    def rotated_surface_3D(self, glass_index):
+        '''
+        Superfície e normais rotacionadas
+        Retorna (X_rot, Y_rot, Z_rot, normals)
+        '''
 
-            # Aplicar invisibilidade fora do círculo
-            Z[mask_circle] = np.nan
+        return self._stage_3D('rotation_3D', lambda: self._compute_rotated_surface_3D(glass_index), glass_index)
+
+
+    def _compute_rotated_surface_3D(self, glass_index):
+        X, Y, Z, _ = self.surface_grid_3D(glass_index)
 
         # 3. Empilhar em formato (N, 3) para rotação
         points_flat = np.vstack([X.ravel(), Y.ravel(), Z.ravel()])
 
-        # 4. Rotacionar o vetor
+        # 4. Rotacionar o vetor e as normais já calculadas
         X_rot, Y_rot, Z_rot = self.geometry_model.grid_rotation_3D(points_flat)
+        normals = self.geometry_model.rotate_vectors(self.surface_normals_3D(glass_index))
+
+        return X_rot, Y_rot, Z_rot, normals
+
+
+    @traced('SimulationEngine')
+    def light_vectors_3D(self, glass_index, light_distance_mm=None):
+        '''
+        Vetores unitários até a fonte de luz em cada ponto rotacionado (None para o Sol)
+        '''
+
+        return self._stage_3D('light_3D', lambda: self._compute_light_vectors_3D(glass_index, light_distance_mm),
+                              glass_index, light_distance_mm)
+
+
+    def _compute_light_vectors_3D(self, glass_index, light_distance_mm):
+        if light_distance_mm is None:
+            return None
+
+        X_rot, Y_rot, Z_rot, _ = self.rotated_surface_3D(glass_index)
+        P_grid = np.dstack((X_rot, Y_rot, Z_rot))
+        return self.geometry_model.light_vectors_3D(P_grid, light_distance_mm)
+
+
+    def _is_radial(self, glass_index, light_distance_mm):
+        return (self.geometry_model.is_rotationally_symmetric(light_distance_mm)
+                and self.surface_model(glass_index).rotationally_symmetric)
+
+
+    # O caminho fundido só substitui o pixel a pixel; com n < 1 a física de referência trata a reflexão total
+    def _is_fused(self, glass_index, light_distance_mm):
+        return (self.kernels is not None and self.physics_model.n_film >= 1
+                and not self._is_radial(glass_index, light_distance_mm))
+
+
+    @traced('SimulationEngine')
+    def fused_grid_3D(self, glass_index, light_distance_mm=None):
+        '''
+        Superfície rotacionada, ângulo de incidência e comprimento de onda numa única passada (FusedKernels)
+        Retorna (X_rot, Y_rot, Z_rot, theta_incident_degree, wavelength_grid)
+        '''
+
+        return self._stage_3D('fused_3D', lambda: self._compute_fused_grid_3D(glass_index, light_distance_mm),
+                              glass_index, light_distance_mm)
+
+
+    def _compute_fused_grid_3D(self, glass_index, light_distance_mm=None):
+        # Superfície e normais sem rotação vêm do cache; o resto é calculado pixel a pixel pelo kernel
+        X, Y, Z, _ = self.surface_grid_3D(glass_index)
+        normals = self.surface_normals_3D(glass_index)
+        rotation = self.geometry_model.Ry @ self.geometry_model.Rx
+
+        return self.kernels.theta_wavelength_3D(X, Y, Z, normals, rotation, light_distance_mm,
+                                                self.physics_model.n_film, self.physics_model.d, self.physics_model.m)
+
+
+    @traced('SimulationEngine')
+    def theta_grid_3D(self, glass_index, light_distance_mm=None):
+        '''
+        Superfície rotacionada e ângulo de incidência de cada pixel da simulação 3D
+        Retorna (X_rot, Y_rot, Z_rot, theta_incident_degree)
+        '''
+
+        return self._stage_3D('theta_3D', lambda: self._compute_theta_grid_3D(glass_index, light_distance_mm),
+                              glass_index, light_distance_mm)
+
+
+    def _compute_theta_grid_3D(self, glass_index, light_distance_mm=None):
+        # Caminho rápido: superfície de revolução sem rotação e com fonte distante, o ângulo depende só do raio
+        if self._is_radial(glass_index, light_distance_mm):
+            X, Y, Z, surface = self.surface_grid_3D(glass_index)
+            radii, index_map = self.geometry_model.radial_index_map()
+            theta_profile = surface.theta_radial(radii * self.LENS_LIMIT_MM)
+            return X, Y, Z, theta_profile[index_map].astype(self.geometry_model.dtype, copy=False)
+
+        if self._is_fused(glass_index, light_distance_mm):
+            return self.fused_grid_3D(glass_index, light_distance_mm)[:4]
+
+        # Modo com orçamento de memória: tudo é feito bloco a bloco direto nas saídas
+        if self.memory_budget_bytes is not None:
+            return self.geometry_model.vectorize_chunked_3D(
+                self.LENS_LIMIT_MM, self.surface_model(glass_index), light_distance_mm, self.memory_budget_bytes
+            )
+
+        # 5. Ângulo entre as normais rotacionadas e a luz
+        X_rot, Y_rot, Z_rot, normals = self.rotated_surface_3D(glass_index)
+        light_vectors = self.light_vectors_3D(glass_index, light_distance_mm)
+        theta_incident_degree = self.geometry_model.calculate_theta_3D(normals, light_vectors)
+
+        return X_rot, Y_rot, Z_rot, theta_incident_degree
+
+
+    @traced('SimulationEngine')
+    def wavelength_grid_3D(self, glass_index, light_distance_mm=None):
+        '''
+        Comprimento de onda construtivo em cada ponto da lente 3D
+        '''
+
+        return self._stage_3D('wavelength_3D', lambda: self._compute_wavelength_grid_3D(glass_index, light_distance_mm),
+                              glass_index, light_distance_mm)
+
+
+    def _compute_wavelength_grid_3D(self, glass_index, light_distance_mm=None):
+        # Caminho rápido: física calculada só sobre o perfil radial
+        if self._is_radial(glass_index, light_distance_mm):
+            _, _, _, surface = self.surface_grid_3D(glass_index)
+            radii, index_map = self.geometry_model.radial_index_map()
+            theta_profile = surface.theta_radial(radii * self.LENS_LIMIT_MM)
+            wavelength_profile = self.physics_model.calculate_wavelength(theta_profile)
+            return np.broadcast_to(wavelength_profile, radii.shape)[index_map]
+
+        if self._is_fused(glass_index, light_distance_mm):
+            return self.fused_grid_3D(glass_index, light_distance_mm)[4]
+
+        _, _, _, theta_incident_degree = self.theta_grid_3D(glass_index, light_distance_mm)
+        return self.physics_model.calculate_wavelength(theta_incident_degree)
+
+
+    @traced('SimulationEngine')
+    def simulation_grid_3D(self, glass_index, light_distance_mm=None, payload='full'):
+        '''
+        Constrói o grid de coordenadas e administra as demais dependências para exibir simulação 3D
+        Cada etapa (grid -> superfície -> normais -> rotação -> luz -> theta -> lambda -> figura)
+        só é recalculada quando suas próprias entradas mudam
+        payload: formato dos dados enviados ao navegador (ver Visuals.FIGURE_PAYLOADS)
+        '''
+
+        return self._stage_3D('figure_3D', lambda: self._compute_simulation_grid_3D(glass_index, light_distance_mm, payload),
+                              glass_index, light_distance_mm, payload)
+
+
+    def _compute_simulation_grid_3D(self, glass_index, light_distance_mm=None, payload='full'):
+        X_rot, Y_rot, Z_rot, _ = self.theta_grid_3D(glass_index, light_distance_mm)
 
-        # 5. Vetorização
-        normals, theta_incident_degree = self.geometry_model.vectorize_3D(
-            X_rot, Y_rot, Z_rot, 
-            radius_curvature_mm, light_distance_mm
-        )
-        
         # 6. Construção da figura
-        wavelength_grid = self.physics_model.calculate_wavelength(theta_incident_degree)
-        figure_3D = self.visuals_models.figure_grid_construction_3D(wavelength_grid, X_rot, Y_rot, Z_rot)
-        return figure_3D
\ No newline at end of file
+        wavelength_grid = self.wavelength_grid_3D(glass_index, light_distance_mm)
+        figure_3D = self.visuals_models.figure_grid_construction_3D(wavelength_grid, X_rot, Y_rot, Z_rot, payload)
+        return figure_3D
+
+
+    @traced('SimulationEngine')
+    def simulation_map_3D(self, glass_index, light_distance_mm=None):
+        '''
+        Mapa de cor da lente 3D no grid (x, y) do objeto, sem figura do Plotly (uso headless)
+        Retorna (img_RGB, wavelength_grid); pontos fora da lente recebem a cor de fundo
+        '''
+
+        return self._stage_3D('map_3D', lambda: self._compute_simulation_map_3D(glass_index, light_distance_mm),
+                              glass_index, light_distance_mm)
+
+
+    def _compute_simulation_map_3D(self, glass_index, light_distance_mm=None):
+        _, _, Z_rot, _ = self.theta_grid_3D(glass_index, light_distance_mm)
+        wavelength_grid = self.wavelength_grid_3D(glass_index, light_distance_mm)
+
+        img_RGB = self.visuals_models.wavelength_grid_to_rgb(wavelength_grid, ~np.isnan(Z_rot))
+        return img_RGB, wavelength_grid
+
+
+    @traced('SimulationEngine')
+    def simulation_reflectance_2D(self, multilayer, wavelengths, lens_diameter_mm, glass_index,
+                                  polarization='unpolarized', max_bytes=None):
+        '''
+        Espectro de refletância de uma pilha multicamada em cada pixel da lente 2D
+        Retorna array (res, res, n_wavelengths), NaN fora do círculo
+        '''
+
+        theta_grid, mask, _ = self.theta_grid_2D(lens_diameter_mm, glass_index)
+        theta_grid = np.where(mask, theta_grid, np.nan)
+
+        return multilayer.reflectance(theta_grid, wavelengths, polarization, max_bytes)
+
+
+    @traced('SimulationEngine')
+    def simulation_reflectance_3D(self, multilayer, wavelengths, glass_index, light_distance_mm=None,
+                                  polarization='unpolarized', max_bytes=None):
+        '''
+        Espectro de refletância de uma pilha multicamada em cada ponto da lente 3D
+        Retorna array (res, res, n_wavelengths), NaN fora da lente
+        '''
+
+        X_rot, Y_rot, Z_rot, theta_incident_degree = self.theta_grid_3D(glass_index, light_distance_mm)
+        theta_incident_degree = np.where(np.isnan(Z_rot), np.nan, theta_incident_degree)
+
+        return multilayer.reflectance(theta_incident_degree, wavelengths, polarization, max_bytes)
+
+
+    def film_stack(self, glass_index):
+        '''
+        Filme único (n_film, d) do modelo físico sobre o vidro da lente
+        '''
+
+        return Multilayer([(self.physics_model.n_film, self.physics_model.d)], n_substrate=glass_index)
+
+
+    @traced('SimulationEngine')
+    def simulation_spectral_2D(self, lens_diameter_mm, glass_index, multilayer=None, illuminant='D65', exposure=None):
+        '''
+        Simulação 2D com cor fisicamente correta: espectro de refletância integrado contra
+        o iluminante e as CMFs CIE 1931, convertido para sRGB
+        O problema é radialmente simétrico, então os espectros são calculados só sobre o perfil radial
+        '''
+
+        # Só o filme do próprio modelo físico tem chave estável no cache
+        if multilayer is None:
+            key = self._film_key() + self._geometry_key() + (lens_diameter_mm, glass_index, illuminant, exposure)
+            return self._cached('spectral_2D', key, lambda: self._compute_simulation_spectral_2D(
+                lens_diameter_mm, glass_index, self.film_stack(glass_index), illuminant, exposure))
+
+        self._uncached('spectral_2D')
+        return self._compute_simulation_spectral_2D(lens_diameter_mm, glass_index, multilayer, illuminant, exposure)
+
+
+    def _compute_simulation_spectral_2D(self, lens_diameter_mm, glass_index, multilayer, illuminant, exposure):
+        # 1. Perfil radial de ângulos de incidência
+        radii, index_map = self.geometry_model.radial_index_map()
+        theta_max_degree = self.geometry_model.calculate_theta_max_2D(lens_diameter_mm, glass_index)
+        inside = radii <= 1.0
+        theta_profile = np.where(inside, radii * theta_max_degree, np.nan)
+
+        # 2. Espectros de refletância e cor do perfil
+        spectra = multilayer.reflectance(theta_profile, self.SPECTRAL_WAVELENGTHS)
+        profile_RGB = Colorimetry(illuminant).spectra_to_rgb(spectra, self.SPECTRAL_WAVELENGTHS, exposure)
+
+        # 3. Pintar o disco a partir do perfil
+        image_RGB = profile_RGB[index_map]
+        return image_RGB, theta_max_degree
+
+
+    @traced('SimulationEngine')
+    def simulation_spectral_3D(self, glass_index, light_distance_mm=None, multilayer=None, illuminant='D65',
+                               exposure=None, max_bytes=None):
+        '''
+        Simulação 3D com cor espectral CIE 1931 -> sRGB em cada ponto da lente
+        '''
+
+        if multilayer is None:
+            key = self._film_key() + self._geometry_key() + self._surface_key() + self._rotation_key() + (glass_index, light_distance_mm, illuminant, exposure)
+            return self._cached('spectral_3D', key, lambda: self._compute_simulation_spectral_3D(
+                glass_index, light_distance_mm, self.film_stack(glass_index), illuminant, exposure, max_bytes))
+
+        self._uncached('spectral_3D')
+        return self._compute_simulation_spectral_3D(glass_index, light_distance_mm, multilayer, illuminant, exposure, max_bytes)
+
+
+    def _compute_simulation_spectral_3D(self, glass_index, light_distance_mm, multilayer, illuminant, exposure, max_bytes):
+        X_rot, Y_rot, Z_rot, theta_incident_degree = self.theta_grid_3D(glass_index, light_distance_mm)
+        theta_incident_degree = np.where(np.isnan(Z_rot), np.nan, theta_incident_degree)
+
+        spectra = multilayer.reflectance(theta_incident_degree, self.SPECTRAL_WAVELENGTHS, max_bytes=max_bytes)
+        img_RGB = Colorimetry(illuminant).spectra_to_rgb(spectra, self.SPECTRAL_WAVELENGTHS, exposure)
+
+        figure_3D = self.visuals_models.figure_rgb_construction_3D(img_RGB, X_rot, Y_rot, Z_rot)
+        return figure_3D
+
+
+    @traced('SimulationEngine')
+    def illuminated_map_3D(self, glass_index, illumination, memory_budget_bytes=None):
+        '''
+        Mapa de cor da lente 3D sob várias fontes (Illumination): média das cores de cada fonte
+        ponderada pela irradiância no pixel
+        Retorna (img_RGB, comprimento de onda médio, irradiância total), no grid (x, y) do objeto
+        '''
+
+        key = self._film_key() + self._geometry_key() + self._surface_key() + self._rotation_key() + (glass_index, illumination.key())
+        return self._cached('illuminated_3D', key, lambda: self._compute_illuminated_map_3D(
+            glass_index, illumination, memory_budget_bytes))
+
+
+    def _compute_illuminated_map_3D(self, glass_index, illumination, memory_budget_bytes):
+        X_rot, Y_rot, Z_rot, normals = self.rotated_surface_3D(glass_index)
+        inside = ~np.isnan(Z_rot)
+
+        # Só os pontos da lente entram no broadcast pixels x fontes
+        points = np.stack((X_rot[inside], Y_rot[inside], Z_rot[inside]), axis=1)
+        budget = memory_budget_bytes or self.memory_budget_bytes or Illumination.DEFAULT_MEMORY_BUDGET
+        rgb, wavelength, irradiance = illumination.blend(
+            points, normals[inside], self.physics_model, self.visuals_models, budget)
+
+        img_RGB = np.empty(Z_rot.shape + (3,), dtype=np.uint8)
+        img_RGB[...] = Visuals.BACKGROUND_RGB
+        img_RGB[inside] = np.clip(np.rint(rgb), 0, 255).astype(np.uint8)
+
+        wavelength_grid = np.full(Z_rot.shape, np.nan, dtype=self.geometry_model.dtype)
+        wavelength_grid[inside] = wavelength
+
+        irradiance_grid = np.zeros(Z_rot.shape, dtype=self.geometry_model.dtype)
+        irradiance_grid[inside] = irradiance
+
+        return img_RGB, wavelength_grid, irradiance_grid
+
+
+    @traced('SimulationEngine')
+    def simulation_illuminated_3D(self, glass_index, illumination, memory_budget_bytes=None):
+        '''
+        Figura 3D da lente sob várias fontes de luz (cor RGB por vértice)
+        '''
+
+        X_rot, Y_rot, Z_rot, _ = self.rotated_surface_3D(glass_index)
+        img_RGB, _, _ = self.illuminated_map_3D(glass_index, illumination, memory_budget_bytes)
+        return self.visuals_models.figure_rgb_construction_3D(img_RGB, X_rot, Y_rot, Z_rot)
+
+
+    # -- Imagem vista por uma câmera (ray casting) --
+
+    @traced('SimulationEngine')
+    def camera_view_3D(self, glass_index, poses, camera=None, light_distance_mm=None):
+        '''
+        Lente 3D como o sensor de uma câmera pinhole a vê, para uma ou várias poses (CameraRenderer.pose / orbit)
+        Usa a superfície, a rotação, a física e a LUT de cor do engine; sem cache (a saída cresce com as poses)
+        Retorna o dicionário de CameraRenderer.render, com arrays (poses, altura, largura[, 3])
+        '''
+
+        camera = camera or CameraRenderer()
+        return camera.render(self.surface_model(glass_index), self.geometry_model, self.physics_model,
+                             self.visuals_models, self.LENS_LIMIT_MM, poses, light_distance_mm)
+
+
+    # -- Análise de tolerância do revestimento (Monte Carlo em n e d) --
+
+    @traced('SimulationEngine')
+    def tolerance_2D(self, lens_diameter_mm, glass_index, tolerance, memory_budget_bytes=None):
+        '''
+        Espalhamento da cor da lente 2D sob a variação de deposição descrita por tolerance (Tolerance)
+        Retorna o dicionário de _tolerance_maps
+        '''
+
+        key = self._film_key() + self._geometry_key() + (lens_diameter_mm, glass_index, tolerance.key())
+        return self._cached('tolerance_2D', key, lambda: self._compute_tolerance_2D(
+            lens_diameter_mm, glass_index, tolerance, memory_budget_bytes))
+
+
+    def _compute_tolerance_2D(self, lens_diameter_mm, glass_index, tolerance, memory_budget_bytes):
+        # 1. O ângulo depende só do raio: cada amostra do perfil radial usada por algum pixel vira um ponto
+        radii, index_map = self.geometry_model.radial_index_map()
+        inside = radii[index_map] <= 1.0
+        used, lookup = np.unique(index_map[inside], return_inverse=True)
+
+        theta_max_degree = self.geometry_model.calculate_theta_max_2D(lens_diameter_mm, glass_index)
+        theta_points = (radii[used] * theta_max_degree).astype(self.geometry_model.dtype)
+
+        # 2. Monte Carlo sobre os pontos e mapas de volta no disco
+        budget = memory_budget_bytes or self.memory_budget_bytes or Tolerance.DEFAULT_MEMORY_BUDGET
+        statistics, summary = tolerance.run(theta_points, self.physics_model, budget)
+        return self._tolerance_maps(statistics, summary, inside, lookup)
+
+
+    @traced('SimulationEngine')
+    def tolerance_3D(self, glass_index, tolerance, light_distance_mm=None, memory_budget_bytes=None):
+        '''
+        Espalhamento da cor da lente 3D (grid (x, y) do objeto) sob a variação de deposição de tolerance
+        Retorna o dicionário de _tolerance_maps
+        '''
+
+        key = (self._film_key() + self._geometry_key() + self._surface_key() + self._rotation_key()
+               + (glass_index, light_distance_mm, tolerance.key()))
+        return self._cached('tolerance_3D', key, lambda: self._compute_tolerance_3D(
+            glass_index, tolerance, light_distance_mm, memory_budget_bytes))
+
+
+    def _compute_tolerance_3D(self, glass_index, tolerance, light_distance_mm, memory_budget_bytes):
+        # 1. Ângulo de incidência de cada pixel da lente; pixels com o mesmo ângulo
+        # (lente de revolução sem inclinação) são avaliados uma única vez
+        _, _, Z_rot, theta_incident_degree = self.theta_grid_3D(glass_index, light_distance_mm)
+        inside = ~np.isnan(Z_rot)
+        theta_points, lookup = np.unique(theta_incident_degree[inside], return_inverse=True)
+
+        # 2. Monte Carlo sobre os ângulos distintos e mapas de volta no grid
+        budget = memory_budget_bytes or self.memory_budget_bytes or Tolerance.DEFAULT_MEMORY_BUDGET
+        statistics, summary = tolerance.run(theta_points, self.physics_model, budget)
+        return self._tolerance_maps(statistics, summary, inside, lookup)
+
+
+    def _tolerance_maps(self, statistics, summary, inside, lookup):
+        '''
+        Espalha as estatísticas por ponto no grid: pixel fora da lente recebe NaN, contagem zero ou a cor de fundo
+        Mapas: mean/std/min/max_wavelength, out_of_spec, histogram (res, res, faixas), mean_RGB (uint8)
+        Resumo: samples, lens_yield, area_out_of_spec (média de out_of_spec na lente), histogram_edges/colors
+        '''
+
+        maps = dict(summary)
+        for name, values in statistics.items():
+            if name == 'mean_RGB':
+                grid = np.empty(inside.shape + (3,), dtype=np.uint8)
+                grid[...] = Visuals.BACKGROUND_RGB
+                grid[inside] = np.clip(np.rint(values[lookup]), 0, 255).astype(np.uint8)
+            elif name == 'histogram':
+                grid = np.zeros(inside.shape + values.shape[1:], dtype=values.dtype)
+                grid[inside] = values[lookup]
+            else:
+                grid = np.full(inside.shape, np.nan, dtype=self.geometry_model.dtype)
+                grid[inside] = values[lookup]
+            maps[name] = grid
+
+        maps['area_out_of_spec'] = float(np.mean(maps['out_of_spec'][inside])) if inside.any() else 0.0
+        return maps
+
+
+    # -- Varreduras: vários quadros calculados em lote --
+
+    def _sweep_frames(self, fixed, **values):
+        '''
+        Expande os parâmetros da varredura em uma lista de quadros
+        Cada valor é escalar (fixo em todos os quadros) ou sequência; as sequências precisam ter o mesmo tamanho
+        '''
+
+        lengths = {len(value) for value in values.values() if isinstance(value, (list, tuple, np.ndarray))}
+        if len(lengths) > 1:
+            raise ValueError(f"Sequências da varredura com tamanhos diferentes: {sorted(lengths)}")
+        n_frames = lengths.pop() if lengths else 1
+
+        frames = []
+        for index in range(n_frames):
+            frame = dict(fixed)
+            for name, value in values.items():
+                if isinstance(value, (list, tuple, np.ndarray)):
+                    value = value[index]
+                frame[name] = None if value is None else float(value)
+            frames.append(frame)
+
+        return frames
+
+
+    def _frames_per_batch(self, bytes_per_frame, memory_budget_bytes):
+        budget = memory_budget_bytes or self.memory_budget_bytes or self.SWEEP_MEMORY_BUDGET
+        return max(1, int(budget // bytes_per_frame))
+
+
+    @traced('SimulationEngine')
+    def sweep_3D(self, glass_index, light_distance_mm=None, rot_x=None, rot_y=None, d=None, memory_budget_bytes=None):
+        '''
+        Gera os quadros de uma animação 3D (inclinação, distância da luz e/ou espessura do filme)
+        Cada parâmetro é escalar ou sequência; None em rot_x/rot_y/d usa o valor do engine
+        O grid, a superfície e as normais sem rotação vêm do cache e são reaproveitados por todos os quadros;
+        os quadros são calculados em lotes (F, res, res) que cabem no orçamento de memória
+        Gerador de dicionários {params, X_rot, Y_rot, Z_rot, wavelength, img_RGB}
+        '''
+
+        frames = self._sweep_frames(
+            {},
+            rot_x=self.geometry_model.rot_x if rot_x is None else rot_x,
+            rot_y=self.geometry_model.rot_y if rot_y is None else rot_y,
+            light_distance_mm=light_distance_mm,
+            d=self.physics_model.d if d is None else d,
+        )
+
+        # 1. Base comum a todos os quadros
+        with self._memo_scope():
+            X, Y, Z, _ = self.surface_grid_3D(glass_index)
+            normals = self.surface_normals_3D(glass_index)
+
+        resolution = self.geometry_model.resolution
+        bytes_per_frame = Geometry.VALUES_PER_PIXEL_CHUNKED * self.geometry_model.dtype.itemsize * resolution**2
+        batch = self._frames_per_batch(bytes_per_frame, memory_budget_bytes)
+
+        for start in range(0, len(frames), batch):
+            batch_frames = frames[start:start + batch]
+
+            # 2. Geometria calculada só uma vez por combinação distinta de (rotação, luz) no lote
+            # (ex.: numa varredura de espessura todos os quadros compartilham o mesmo ângulo de incidência)
+            geometries = {}
+            geometry_index = np.array([
+                geometries.setdefault((frame['rot_x'], frame['rot_y'], frame['light_distance_mm']), len(geometries))
+                for frame in batch_frames
+            ])
+            unique = list(geometries)
+
+            rotations = self.geometry_model.rotation_matrices([g[0] for g in unique], [g[1] for g in unique])
+            lights = [np.nan if g[2] is None else g[2] for g in unique]
+            X_rot, Y_rot, Z_rot, theta = self.geometry_model.vectorize_frames_3D(X, Y, Z, normals, rotations, lights)
+
+            # 3. Física e cor de todos os quadros do lote de uma vez
+            thickness = np.array([frame['d'] for frame in batch_frames], dtype=self.geometry_model.dtype)[:, None, None]
+            physics_model = Physics(self.physics_model.n_film, thickness, self.physics_model.m, dtype=self.physics_model.dtype)
+            wavelength = physics_model.calculate_wavelength(theta[geometry_index])
+            img_RGB = self.visuals_models.wavelength_grid_to_rgb(wavelength, ~np.isnan(Z_rot[geometry_index]))
+
+            for index, frame in enumerate(batch_frames):
+                g = geometry_index[index]
+                yield {
+                    'params': frame,
+                    'X_rot': X_rot[g], 'Y_rot': Y_rot[g], 'Z_rot': Z_rot[g],
+                    'wavelength': wavelength[index],
+                    'img_RGB': img_RGB[index],
+                }
+
+
+    @traced('SimulationEngine')
+    def sweep_2D(self, lens_diameter_mm, glass_index, d, memory_budget_bytes=None):
+        '''
+        Quadros da simulação 2D para uma sequência de espessuras do filme (ex.: revestimento engrossando)
+        A física roda sobre o perfil radial de todos os quadros de uma vez (F, amostras)
+        Gerador de dicionários {params, img_RGB}
+        '''
+
+        frames = self._sweep_frames({}, d=d)
+
+        radii, index_map = self.geometry_model.radial_index_map()
+        theta_max_degree = self.geometry_model.calculate_theta_max_2D(lens_diameter_mm, glass_index)
+        theta_profile = (radii * theta_max_degree).astype(self.geometry_model.dtype)
+        inside = radii <= 1.0
+
+        batch = self._frames_per_batch(3 * index_map.size, memory_budget_bytes)
+
+        for start in range(0, len(frames), batch):
+            batch_frames = frames[start:start + batch]
+
+            thickness = np.array([frame['d'] for frame in batch_frames], dtype=self.geometry_model.dtype)[:, None]
+            physics_model = Physics(self.physics_model.n_film, thickness, self.physics_model.m, dtype=self.physics_model.dtype)
+            lambda_profile = physics_model.calculate_wavelength(theta_profile)
+
+            mask = np.broadcast_to(inside, lambda_profile.shape)
+            profile_RGB = self.visuals_models.wavelength_grid_to_rgb(lambda_profile, mask)
+            img_RGB = profile_RGB[:, index_map]
+
+            for index, frame in enumerate(batch_frames):
+                yield {'params': {**frame, 'theta_max_degree': theta_max_degree}, 'img_RGB': img_RGB[index]}
+
+
+    @staticmethod
+    def _frame_label(index, params):
+        # O Plotly identifica os quadros pelo nome: o índice evita nomes repetidos (ex.: varredura que volta ao início)
+        labels = {'rot_x': 'rot x', 'rot_y': 'rot y', 'light_distance_mm': 'luz', 'd': 'd'}
+        return f"{index}: " + ' | '.join(f"{labels[name]}={value:g}" for name, value in params.items()
+                                         if name in labels and value is not None)
+
+
+    @traced('SimulationEngine')
+    def sweep_figure_3D(self, glass_index, light_distance_mm=None, rot_x=None, rot_y=None, d=None,
+                        payload='compact', frame_duration_ms=100, memory_budget_bytes=None):
+        '''
+        Figura do Plotly com um quadro (frames) por passo da varredura 3D, com botão de play e slider
+        '''
+
+        figures, labels = [], []
+        frames = self.sweep_3D(glass_index, light_distance_mm, rot_x, rot_y, d, memory_budget_bytes)
+        for index, frame in enumerate(frames):
+            figures.append(self.visuals_models.figure_grid_construction_3D(
+                frame['wavelength'], frame['X_rot'], frame['Y_rot'], frame['Z_rot'], payload))
+            labels.append(self._frame_label(index, frame['params']))
+
+        return self.visuals_models.animation_construction(figures, labels, frame_duration_ms)
+
+
+    @traced('SimulationEngine')
+    def write_sweep(self, directory, frames, prefix='frame'):
+        '''
+        Grava os quadros de sweep_3D/sweep_2D como sequência de PNGs à medida que são gerados
+        (só o lote atual fica na memória). Retorna a lista de arquivos gravados
+        '''
+
+        return ImageIO.write_sequence(directory, (frame['img_RGB'] for frame in frames), prefix)
@@ -0,0 +1,504 @@
+import abc
+import hashlib
+import os
+import numpy as np
+
+class Surface(abc.ABC):
+    '''
+    Modelo da superfície da lente: sag Z(x, y) e gradiente analítico, vetorizados sobre qualquer grid
+    Convenção do simulador: vértice em z = 0 e a lente se curvando para baixo (Z = -sag óptico),
+    com a normal apontando para +z
+    '''
+
+    # Superfícies de revolução permitem o caminho rápido pelo perfil radial
+    rotationally_symmetric = False
+
+    @abc.abstractmethod
+    def key(self):
+        '''
+        Tupla estável dos parâmetros (chave de cache)
+        '''
+
+
+    @abc.abstractmethod
+    def sag(self, X, Y):
+        '''
+        Altura Z(x, y) da superfície; NaN fora do domínio da superfície
+        '''
+
+
+    @abc.abstractmethod
+    def gradient(self, X, Y):
+        '''
+        Derivadas (dZ/dx, dZ/dy); NaN fora do domínio da superfície
+        '''
+
+
+    def normals(self, X, Y, Z=None):
+        '''
+        Normais unitárias (..., 3): (-dZ/dx, -dZ/dy, 1) / |...|
+        '''
+
+        gx, gy = self.gradient(X, Y)
+        norm = np.sqrt(gx**2 + gy**2 + 1)
+        return np.stack((-gx / norm, -gy / norm, 1 / norm), axis=-1)
+
+
+    def sag_and_gradient(self, X, Y):
+        '''
+        (Z, dZ/dx, dZ/dy) de uma vez; modelos que calculam os dois numa única passada sobrescrevem
+        '''
+
+        return (self.sag(X, Y),) + tuple(self.gradient(X, Y))
+
+
+    # Interseção raio-superfície (renderização pela câmera)
+    INTERSECT_ITERATIONS = 12
+    INTERSECT_TOLERANCE_MM = 1e-6
+
+    def intersect(self, origins, directions, limit):
+        '''
+        Distância t de cada raio (origem + t * direção, direções unitárias (..., 3)) até a superfície,
+        dentro do círculo de raio limit; NaN quando o raio não acerta a lente
+        Genérico: Newton em f(t) = z(t) - Z(x(t), y(t)) partindo do plano z = 0
+        '''
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = -origins[..., 2] / directions[..., 2]
+        return self._newton(origins, directions, limit, t)
+
+
+    def _newton(self, origins, directions, limit, t):
+        ox, oy, oz = origins[..., 0], origins[..., 1], origins[..., 2]
+        dx, dy, dz = directions[..., 0], directions[..., 1], directions[..., 2]
+
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            for _ in range(self.INTERSECT_ITERATIONS):
+                Z, gx, gy = self.sag_and_gradient(ox + t * dx, oy + t * dy)
+                residual = oz + t * dz - Z
+                t = t - residual / (dz - gx * dx - gy * dy)
+
+            x, y = ox + t * dx, oy + t * dy
+            residual = oz + t * dz - self.sag(x, y)
+            hit = (np.abs(residual) <= self.INTERSECT_TOLERANCE_MM) & (x**2 + y**2 <= limit**2) & (t > 0)
+
+        return np.where(hit, t, np.nan)
+
+
+    def theta_radial(self, radii_mm):
+        '''
+        Perfil radial do ângulo entre a normal e o eixo z (superfícies de revolução)
+        Equação: cos(theta) = 1 / sqrt(1 + (dZ/dr)²)
+        '''
+
+        gx, _ = self.gradient(radii_mm, np.zeros_like(radii_mm))
+        cos_theta = np.clip(1 / np.sqrt(1 + np.nan_to_num(gx)**2), -1.0, 1.0)
+        return np.degrees(np.arccos(cos_theta))
+
+
+    def __eq__(self, other):
+        return isinstance(other, Surface) and self.key() == other.key()
+
+
+    def __hash__(self):
+        return hash(self.key())
+
+
+def _intersect_conic(origins, directions, radius_mm, conic, limit):
+    '''
+    Interseção analítica com a cônica de revolução r² + 2 R Z + (1 + k) Z² = 0 (Z = -sag; k = 0 é a esfera)
+    Das duas raízes vale a menor t > 0 que cai no ramo do sag (1 + (1 + k) Z / R >= 0) e dentro de limit
+    radius_mm None: plano z = 0
+    '''
+
+    ox, oy, oz = origins[..., 0], origins[..., 1], origins[..., 2]
+    dx, dy, dz = directions[..., 0], directions[..., 1], directions[..., 2]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if radius_mm is None:
+            roots = (-oz / dz,)
+
+        else:
+            # a t² + 2 b t + c = 0, raízes pela forma estável q / a e c / q
+            e = 1 + conic
+            a = dx * dx + dy * dy + e * dz * dz
+            b = ox * dx + oy * dy + e * oz * dz + radius_mm * dz
+            c = ox * ox + oy * oy + e * oz * oz + 2 * radius_mm * oz
+            q = -(b + np.copysign(np.sqrt(b * b - a * c), b))
+            roots = (q / a, c / q)
+
+        t = np.full(np.broadcast_shapes(ox.shape, dx.shape), np.nan, dtype=np.result_type(origins, directions))
+        for root in roots:
+            z = oz + root * dz
+            valid = (root > 0) & ((ox + root * dx)**2 + (oy + root * dy)**2 <= limit**2)
+            if radius_mm is not None:
+                valid &= 1 + e * z / radius_mm >= 0
+            t = np.where(valid & ~(t <= root), root, t) # NaN ou raiz mais distante -> esta raiz
+
+    return t
+
+
+class SphericalSurface(Surface):
+    rotationally_symmetric = True
+
+    def __init__(self, radius_mm=None):
+        '''
+        Calota esférica de raio radius_mm; None (ou infinito) é o plano
+        Mesmas equações usadas pelo simulador antes dos modelos de superfície
+        '''
+
+        self.radius_mm = None if radius_mm is None or np.isinf(radius_mm) else float(radius_mm)
+
+
+    @classmethod
+    def from_diopter(cls, diopter, glass_index):
+        '''
+        Equação: r = (n - 1) / D, em mm; abaixo de 0.1 D a lente é plana
+        '''
+
+        if diopter < 0.1:
+            return cls(None)
+        return cls(((glass_index - 1) * 1000) / diopter)
+
+
+    def key(self):
+        return ('sphere', self.radius_mm)
+
+
+    def sag(self, X, Y):
+        '''
+        Equação da esfera: Z = sqrt(R^2 - X^2 - Y^2) - R (para centrar no zero)
+        '''
+
+        if self.radius_mm is None:
+            return np.zeros_like(X)
+
+        term = np.clip(self.radius_mm**2 - X**2 - Y**2, 0, None)
+        return np.sqrt(term) - self.radius_mm
+
+
+    def gradient(self, X, Y):
+        if self.radius_mm is None:
+            return np.zeros_like(X), np.zeros_like(Y)
+
+        root = np.sqrt(self.radius_mm**2 - X**2 - Y**2)
+        return -X / root, -Y / root
+
+
+    def normals(self, X, Y, Z=None):
+        '''
+        Esfera: (P - centro) / |P - centro|, com centro em [0, 0, -R] | Plano: [0, 0, 1]
+        '''
+
+        if self.radius_mm is None:
+            normals = np.zeros(X.shape + (3,), dtype=X.dtype)
+            normals[..., 2] = 1.0 # plano z
+            return normals
+
+        if Z is None:
+            Z = self.sag(X, Y)
+
+        vectors = np.stack((X, Y, Z + self.radius_mm), axis=-1)
+        magnitudes = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        magnitudes[magnitudes == 0] = 1
+        return vectors / magnitudes
+
+
+    def theta_radial(self, radii_mm):
+        '''
+        Equação: cos(theta) = sqrt(R² - r²) / sqrt(r² + (R² - r²))
+        '''
+
+        if self.radius_mm is None:
+            return np.zeros_like(radii_mm, dtype=np.float64) # plano: normal sempre em z
+
+        term = np.clip(self.radius_mm**2 - radii_mm**2, 0, None)
+        cos_theta = np.sqrt(term) / np.sqrt(radii_mm**2 + term)
+        cos_theta = np.clip(cos_theta, -1.0, 1.0)
+
+        return np.degrees(np.arccos(cos_theta))
+
+
+    def intersect(self, origins, directions, limit):
+        # O sag acima descreve a calota convexa (R > 0); outro raio usa o caminho genérico
+        if self.radius_mm is not None and self.radius_mm < 0:
+            return super().intersect(origins, directions, limit)
+        return _intersect_conic(origins, directions, self.radius_mm, 0.0, limit)
+
+
+class AsphericSurface(Surface):
+    rotationally_symmetric = True
+
+    def __init__(self, radius_mm, conic=0.0, coefficients=()):
+        '''
+        Cônica com termos pares (asfera par, ISO 10110):
+        sag(r) = c r² / (1 + sqrt(1 - (1 + k) c² r²)) + A4 r⁴ + A6 r⁶ + ...
+        conic: k (0 esfera, -1 parábola, < -1 hipérbole) | coefficients: (A4, A6, ...) em mm^(1 - 2i)
+        '''
+
+        self.radius_mm = float(radius_mm)
+        self.conic = float(conic)
+        self.coefficients = tuple(float(value) for value in coefficients)
+
+
+    def key(self):
+        return ('asphere', self.radius_mm, self.conic, self.coefficients)
+
+
+    def _radial_terms(self, r2):
+        '''
+        sag(r²) e (d sag / dr) / r, ambos como função de r² (sem divisão por r no centro)
+        '''
+
+        c = 1.0 / self.radius_mm
+        root = np.sqrt(1 - (1 + self.conic) * c**2 * r2) # NaN além do domínio da cônica
+
+        sag = c * r2 / (1 + root)
+        slope = c / root
+
+        power = r2
+        for index, coefficient in enumerate(self.coefficients, start=2):
+            sag = sag + coefficient * power * r2 # A_2i r^(2i)
+            slope = slope + 2 * index * coefficient * power # 2i A_2i r^(2i-2)
+            power = power * r2
+
+        return sag, slope
+
+
+    def sag(self, X, Y):
+        with np.errstate(invalid='ignore'):
+            sag, _ = self._radial_terms(X**2 + Y**2)
+        return -sag
+
+
+    def gradient(self, X, Y):
+        with np.errstate(invalid='ignore'):
+            _, slope = self._radial_terms(X**2 + Y**2)
+        return -slope * X, -slope * Y
+
+
+    def intersect(self, origins, directions, limit):
+        '''
+        Cônica pura: solução analítica | com termos A4, A6...: Newton partindo da cônica (ou do plano, se ela não for atingida)
+        '''
+
+        t = _intersect_conic(origins, directions, self.radius_mm, self.conic, limit)
+        if not self.coefficients:
+            return t
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = np.where(np.isnan(t), -origins[..., 2] / directions[..., 2], t)
+        return self._newton(origins, directions, limit, t)
+
+
+class ToricSurface(Surface):
+    def __init__(self, radius_x_mm, radius_y_mm, conic_x=0.0, conic_y=0.0, axis_degree=0.0):
+        '''
+        Superfície tórica (bicônica) com raios diferentes nos dois meridianos principais:
+        sag = (cx u² + cy v²) / (1 + sqrt(1 - (1 + kx) cx² u² - (1 + ky) cy² v²))
+        (u, v) é o grid girado de axis_degree (eixo do cilindro); raio None/infinito é plano naquele meridiano
+        '''
+
+        self.radius_x_mm = None if radius_x_mm is None or np.isinf(radius_x_mm) else float(radius_x_mm)
+        self.radius_y_mm = None if radius_y_mm is None or np.isinf(radius_y_mm) else float(radius_y_mm)
+        self.conic_x = float(conic_x)
+        self.conic_y = float(conic_y)
+        self.axis_degree = float(axis_degree)
+        self.rotationally_symmetric = self.radius_x_mm == self.radius_y_mm and self.conic_x == self.conic_y
+
+
+    @classmethod
+    def from_prescription(cls, sphere_diopter, cylinder_diopter, axis_degree, glass_index):
+        '''
+        Receita esfero-cilíndrica: meridiano do eixo com a potência esférica e o perpendicular com esférica + cilindro
+        '''
+
+        def radius(diopter):
+            return None if abs(diopter) < 0.1 else ((glass_index - 1) * 1000) / diopter
+
+        return cls(radius(sphere_diopter), radius(sphere_diopter + cylinder_diopter), axis_degree=axis_degree)
+
+
+    def key(self):
+        return ('toric', self.radius_x_mm, self.radius_y_mm, self.conic_x, self.conic_y, self.axis_degree)
+
+
+    def _local(self, X, Y):
+        angle = np.radians(self.axis_degree)
+        cos, sin = np.cos(angle), np.sin(angle)
+        return cos * X + sin * Y, -sin * X + cos * Y, cos, sin
+
+
+    def _terms(self, U, V):
+        cx = 0.0 if self.radius_x_mm is None else 1.0 / self.radius_x_mm
+        cy = 0.0 if self.radius_y_mm is None else 1.0 / self.radius_y_mm
+
+        numerator = cx * U**2 + cy * V**2
+        root = np.sqrt(1 - (1 + self.conic_x) * cx**2 * U**2 - (1 + self.conic_y) * cy**2 * V**2)
+        denominator = 1 + root
+
+        sag = numerator / denominator
+
+        # Derivadas: (N' (1 + S) - N S') / (1 + S)², com S' = -(1 + k) c² u / S
+        d_root_u = -(1 + self.conic_x) * cx**2 * U / root
+        d_root_v = -(1 + self.conic_y) * cy**2 * V / root
+        d_sag_u = (2 * cx * U * denominator - numerator * d_root_u) / denominator**2
+        d_sag_v = (2 * cy * V * denominator - numerator * d_root_v) / denominator**2
+
+        return sag, d_sag_u, d_sag_v
+
+
+    def sag(self, X, Y):
+        U, V, _, _ = self._local(X, Y)
+        with np.errstate(invalid='ignore'):
+            sag, _, _ = self._terms(U, V)
+        return -sag
+
+
+    def gradient(self, X, Y):
+        U, V, cos, sin = self._local(X, Y)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            _, d_sag_u, d_sag_v = self._terms(U, V)
+
+        # Regra da cadeia de volta ao grid (x, y): u = cos x + sin y, v = -sin x + cos y
+        return -(d_sag_u * cos - d_sag_v * sin), -(d_sag_u * sin + d_sag_v * cos)
+
+
+class HeightMapSurface(Surface):
+    # Valores lidos por ponto consultado: vizinhança 4x4 do estêncil + pesos e temporários
+    VALUES_PER_POINT = 32
+    DEFAULT_MEMORY_BUDGET = 64 * 1024**2
+
+    def __init__(self, heights, pixel_size_mm, origin_mm=None, scale=1.0, memory_budget_bytes=DEFAULT_MEMORY_BUDGET):
+        '''
+        Mapa de alturas medido (perfilômetro) num grid regular, em qualquer dtype
+        heights: array 2D, np.memmap ou caminho (.npy, aberto com mmap_mode='r') -> nunca é copiado inteiro para a RAM
+        pixel_size_mm: passo do grid (escalar ou (dx, dy)) | origin_mm: (x, y) da amostra [0, 0]; padrão centraliza o mapa
+        scale: fator das alturas para mm (ex.: 1e-3 para µm), já na convenção Z = -sag
+        '''
+
+        if isinstance(heights, (str, os.PathLike)):
+            self.path = os.path.abspath(heights)
+            heights = np.load(heights, mmap_mode='r')
+        else:
+            self.path = None
+
+        if heights.ndim != 2 or min(heights.shape) < 2:
+            raise ValueError(f"Mapa de alturas precisa ser 2D com pelo menos 2x2 amostras: {heights.shape}")
+
+        self.heights = heights
+        self.pixel_size_mm = tuple(float(value) for value in np.broadcast_to(pixel_size_mm, (2,)))
+        rows, cols = heights.shape
+        if origin_mm is None:
+            origin_mm = (-(cols - 1) * self.pixel_size_mm[0] / 2, -(rows - 1) * self.pixel_size_mm[1] / 2)
+        self.origin_mm = tuple(float(value) for value in origin_mm)
+        self.scale = float(scale)
+        self.memory_budget_bytes = memory_budget_bytes
+
+
+    @classmethod
+    def from_raw(cls, path, shape, dtype='<f4', offset=0, **params):
+        '''
+        Binário sem cabeçalho (exportação comum de perfilômetros), mapeado em memória
+        '''
+
+        heights = np.memmap(path, dtype=dtype, mode='r', shape=tuple(shape), offset=offset)
+        surface = cls(heights, **params)
+        surface.path = os.path.abspath(path)
+        return surface
+
+
+    def _content_key(self):
+        # Arquivo: identificado por caminho, tamanho e data; array em memória: hash do conteúdo
+        if self.path is not None:
+            info = os.stat(self.path)
+            return (self.path, info.st_size, info.st_mtime_ns)
+
+        if not hasattr(self, '_digest'):
+            self._digest = hashlib.sha1(np.ascontiguousarray(self.heights).tobytes()).hexdigest()
+        return (self._digest,)
+
+
+    def key(self):
+        return ('height_map',) + self._content_key() + (self.heights.shape, str(self.heights.dtype),
+                                                        self.pixel_size_mm, self.origin_mm, self.scale)
+
+
+    def _points_per_chunk(self, itemsize):
+        return max(1, int(self.memory_budget_bytes // (self.VALUES_PER_POINT * itemsize)))
+
+
+    def _sample(self, X, Y, with_gradient):
+        '''
+        Interpolação bilinear da altura e, com with_gradient, do gradiente por diferenças centrais
+        Por ponto é lida só a vizinhança 4x4 do mapa (gather vetorizado); as diferenças dos 4 nós
+        vizinhos saem de uma única passada de fatiamento sobre esse estêncil
+        Pontos fora do mapa recebem NaN
+        '''
+
+        dtype = np.result_type(X.dtype, np.float32)
+        rows, cols = self.heights.shape
+        dx, dy = self.pixel_size_mm
+
+        x_flat, y_flat = X.ravel(), Y.ravel()
+        Z = np.full(x_flat.shape, np.nan, dtype=dtype)
+        gx = np.full(x_flat.shape, np.nan, dtype=dtype) if with_gradient else None
+        gy = np.full(x_flat.shape, np.nan, dtype=dtype) if with_gradient else None
+
+        chunk = self._points_per_chunk(np.dtype(dtype).itemsize)
+        offsets = np.arange(-1, 3)
+
+        for start in range(0, len(x_flat), chunk):
+            block = slice(start, start + chunk)
+
+            # 1. Posição fracionária no mapa e célula (i0, j0) que contém o ponto
+            fx = (x_flat[block] - self.origin_mm[0]) / dx
+            fy = (y_flat[block] - self.origin_mm[1]) / dy
+            inside = np.flatnonzero((fx >= 0) & (fx <= cols - 1) & (fy >= 0) & (fy <= rows - 1))
+            if len(inside) == 0:
+                continue
+            fx, fy = fx[inside], fy[inside]
+
+            j0 = np.minimum(np.floor(fx).astype(np.intp), cols - 2)
+            i0 = np.minimum(np.floor(fy).astype(np.intp), rows - 2)
+            tx, ty = (fx - j0)[:, None], (fy - i0)[:, None]
+
+            # 2. Vizinhança 4x4 (linhas i0-1..i0+2, colunas j0-1..j0+2), presa às bordas do mapa
+            row_index = np.clip(i0[:, None] + offsets, 0, rows - 1)
+            col_index = np.clip(j0[:, None] + offsets, 0, cols - 1)
+            patch = np.asarray(self.heights[row_index[:, :, None], col_index[:, None, :]], dtype=dtype) * self.scale
+
+            def bilinear(nodes): # nodes: (n, 2, 2) nos cantos da célula
+                top = nodes[:, 0, 0][:, None] * (1 - tx) + nodes[:, 0, 1][:, None] * tx
+                bottom = nodes[:, 1, 0][:, None] * (1 - tx) + nodes[:, 1, 1][:, None] * tx
+                return (top * (1 - ty) + bottom * ty)[:, 0]
+
+            target = inside + start
+            Z[target] = bilinear(patch[:, 1:3, 1:3])
+
+            if with_gradient:
+                # 3. Diferenças centrais nos 4 nós da célula (unilaterais nas bordas, pelo passo real)
+                spacing_x = (col_index[:, 2:4] - col_index[:, 0:2]) * dx # (n, 2)
+                spacing_y = (row_index[:, 2:4] - row_index[:, 0:2]) * dy
+                nodes_gx = (patch[:, 1:3, 2:4] - patch[:, 1:3, 0:2]) / spacing_x[:, None, :]
+                nodes_gy = (patch[:, 2:4, 1:3] - patch[:, 0:2, 1:3]) / spacing_y[:, :, None]
+
+                gx[target] = bilinear(nodes_gx)
+                gy[target] = bilinear(nodes_gy)
+
+        if with_gradient:
+            return Z.reshape(X.shape), gx.reshape(X.shape), gy.reshape(X.shape)
+        return Z.reshape(X.shape)
+
+
+    def sag(self, X, Y):
+        return self._sample(X, Y, with_gradient=False)
+
+
+    def gradient(self, X, Y):
+        _, gx, gy = self._sample(X, Y, with_gradient=True)
+        return gx, gy
+
+
+    def sag_and_gradient(self, X, Y):
+        return self._sample(X, Y, with_gradient=True)
@@ -0,0 +1,310 @@
+import json
+import os
+import numpy as np
+from physics import Physics
+from visuals import Visuals
+from instrumentation import traced
+
+class ThicknessLookup:
+    FORMAT_VERSION = 1
+    CELL_BITS = 5 # bits por canal do índice espacial (32^3 células de 8 níveis de RGB)
+    CANDIDATES_PER_CELL = 8
+
+    def __init__(self, path=None):
+        '''
+        Índice inverso cor -> espessura do filme, construído a partir do modelo direto (Physics + Visuals)
+        Os arrays são lidos do disco somente na primeira consulta (carregamento preguiçoso)
+        '''
+
+        self.path = path
+        self._arrays = None
+        self._radius = None
+
+
+    # Parâmetros padrão do índice (faixas de espessura, ângulo e ordem)
+    @staticmethod
+    def default_params(n_film=1.413):
+        return {
+            'n_film': float(n_film),
+            'thickness_min_nm': 50.0,
+            'thickness_max_nm': 1500.0,
+            'thickness_step_nm': 0.5,
+            'angle_max_degree': 80.0,
+            'angle_step_degree': 1.0,
+            'orders': [1, 2, 3],
+        }
+
+
+    @classmethod
+    @traced('ThicknessLookup')
+    def build(cls, path=None, **params):
+        '''
+        Percorre a grade densa espessura x ângulo x ordem, calcula a cor de cada ponto e agrupa por cor:
+        thickness[cor, ângulo, ordem] = espessura média dos pontos da grade com aquela cor
+        Se path for dado, o índice é gravado em disco (.npz)
+        '''
+
+        params = {**cls.default_params(), **params}
+        params['orders'] = [int(order) for order in params['orders']]
+
+        # 1. Grade do modelo direto
+        thickness = np.arange(params['thickness_min_nm'], params['thickness_max_nm'] + params['thickness_step_nm'] / 2,
+                              params['thickness_step_nm'])
+        angles = np.arange(0.0, params['angle_max_degree'] + params['angle_step_degree'] / 2, params['angle_step_degree'])
+        orders = np.array(params['orders'], dtype=np.float64)
+
+        D, A, M = np.meshgrid(thickness, angles, orders, indexing='ij')
+        wavelength = Physics(params['n_film'], D, M).calculate_wavelength(A)
+
+        # 2. Cor de cada ponto pela mesma LUT da simulação (fora da banda visível não entra no índice)
+        visible = (wavelength >= Visuals.LUT_MIN_WAVELENGTH) & (wavelength <= Visuals.LUT_MAX_WAVELENGTH)
+        colors = Visuals().wavelength_grid_to_rgb(wavelength[visible])
+
+        # 3. Paleta de cores distintas e espessura média por (cor, ângulo, ordem)
+        packed = cls._pack(colors)
+        palette_packed, color_index = np.unique(packed, return_inverse=True)
+        palette = cls._unpack(palette_packed)
+
+        angle_index = np.broadcast_to(np.arange(len(angles))[None, :, None], D.shape)[visible]
+        order_index = np.broadcast_to(np.arange(len(orders))[None, None, :], D.shape)[visible]
+        shape = (len(palette), len(angles), len(orders))
+        flat = np.ravel_multi_index((color_index, angle_index, order_index), shape)
+
+        size = int(np.prod(shape))
+        counts = np.bincount(flat, minlength=size)
+        sums = np.bincount(flat, weights=D[visible], minlength=size)
+        with np.errstate(invalid='ignore'):
+            table = (sums / counts).reshape(shape)
+
+        # 4. Uma cor da paleta pode não cair exatamente em nenhum ponto da grade de um dado (ângulo, ordem)
+        # Com ângulo e ordem fixos a espessura cresce com o comprimento de onda: as lacunas são
+        # interpoladas ao longo do espectro, usando o comprimento de onda médio de cada cor
+        color_wavelength = np.bincount(color_index, weights=wavelength[visible]) / np.bincount(color_index)
+        spectral_order = np.argsort(color_wavelength)
+        sorted_wavelength = color_wavelength[spectral_order]
+
+        for a in range(shape[1]):
+            for o in range(shape[2]):
+                column = table[spectral_order, a, o]
+                known = ~np.isnan(column)
+                if known.sum() >= 2:
+                    table[spectral_order, a, o] = np.interp(
+                        sorted_wavelength, sorted_wavelength[known], column[known], left=np.nan, right=np.nan)
+
+        table = table.astype(np.float32)
+
+        # 5. Índice espacial da paleta no cubo RGB
+        arrays = {
+            'params': np.array(json.dumps(params)),
+            'version': np.array(cls.FORMAT_VERSION),
+            'palette': palette,
+            'wavelength': color_wavelength.astype(np.float32),
+            'thickness': table,
+            'cell_candidates': cls._cell_candidates(palette),
+        }
+
+        if path is not None:
+            cls._save(path, arrays)
+
+        lookup = cls(path)
+        lookup._arrays = arrays
+        return lookup
+
+
+    @classmethod
+    def open(cls, path, **params):
+        '''
+        Índice em disco, carregado sob demanda; é (re)construído se o arquivo não existir
+        ou tiver sido gerado com outros parâmetros/versão
+        '''
+
+        if os.path.exists(path):
+            lookup = cls(path)
+            if not params or lookup.params == {**cls.default_params(), **params}:
+                return lookup
+
+        return cls.build(path, **params)
+
+
+    # Gravação atômica: um processo lendo o índice nunca vê um arquivo pela metade
+    @staticmethod
+    def _save(path, arrays):
+        temporary = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(temporary, **arrays)
+        os.replace(temporary, path)
+
+
+    def _load(self):
+        if self._arrays is None:
+            with np.load(self.path) as stored:
+                arrays = {name: stored[name] for name in stored.files}
+
+            if int(arrays['version']) != self.FORMAT_VERSION:
+                raise ValueError(f"Índice de espessura em formato antigo: {self.path}")
+            self._arrays = arrays
+
+        return self._arrays
+
+
+    @property
+    def params(self):
+        return json.loads(str(self._load()['params']))
+
+
+    @property
+    def palette(self):
+        return self._load()['palette']
+
+
+    # RGB uint8 <-> inteiro de 24 bits
+    @staticmethod
+    def _pack(colors):
+        colors = np.asarray(colors, dtype=np.uint32)
+        return (colors[..., 0] << 16) | (colors[..., 1] << 8) | colors[..., 2]
+
+
+    @staticmethod
+    def _unpack(packed):
+        return np.stack([(packed >> 16) & 255, (packed >> 8) & 255, packed & 255], axis=-1).astype(np.uint8)
+
+
+    # Centro de cada célula do cubo RGB quantizado, na ordem do índice de célula (r, g, b)
+    @classmethod
+    def _cell_centers(cls):
+        cells_per_axis = 2**cls.CELL_BITS
+        cell_size = 256 // cells_per_axis
+        centers_axis = np.arange(cells_per_axis, dtype=np.float32) * cell_size + (cell_size - 1) / 2
+        return np.stack(np.meshgrid(centers_axis, centers_axis, centers_axis, indexing='ij'), axis=-1).reshape(-1, 3)
+
+
+    @classmethod
+    def _cell_candidates(cls, palette, chunk=4096):
+        '''
+        Para cada célula do cubo RGB quantizado, as CANDIDATES_PER_CELL cores da paleta mais próximas do centro
+        A consulta de um pixel compara apenas com esses candidatos (em vez de com a paleta inteira)
+        '''
+
+        k = min(cls.CANDIDATES_PER_CELL, len(palette))
+        centers = cls._cell_centers()
+
+        palette_f = palette.astype(np.float32)
+        palette_norm = (palette_f**2).sum(axis=1)
+        candidates = np.empty((len(centers), k), dtype=np.int32)
+
+        # Distâncias em blocos de células para limitar a matriz células x paleta
+        for start in range(0, len(centers), chunk):
+            block = centers[start:start + chunk]
+            distance = palette_norm[None, :] - 2 * block @ palette_f.T
+            nearest = np.argpartition(distance, k - 1, axis=1)[:, :k] if k < len(palette) else \
+                np.broadcast_to(np.arange(k), (len(block), k))
+            candidates[start:start + chunk] = nearest
+
+        return candidates
+
+
+    def _cell_radius(self):
+        '''
+        Distância do centro de cada célula ao seu candidato mais distante: nenhuma cor fora dos
+        candidatos está mais perto do centro que isso (infinita se a paleta inteira é candidata)
+        '''
+
+        if self._radius is None:
+            arrays = self._load()
+            palette, candidates = arrays['palette'], arrays['cell_candidates']
+            if candidates.shape[1] >= len(palette):
+                self._radius = np.full(len(candidates), np.inf, dtype=np.float32)
+            else:
+                offset = palette[candidates].astype(np.float32) - self._cell_centers()[:, None, :]
+                self._radius = np.sqrt((offset**2).sum(axis=-1).max(axis=1))
+        return self._radius
+
+
+    @traced('ThicknessLookup')
+    def nearest_color(self, pixels, max_distance=None, chunk=1024):
+        '''
+        Cor mais próxima da paleta para cada pixel RGB (..., 3)
+        Compara primeiro só com os candidatos da célula do pixel; quando a distância encontrada não é
+        garantidamente a menor (pixel longe do centro da célula), refaz a busca na paleta inteira
+        max_distance: pixels comprovadamente mais longe que isso de toda a paleta (ex.: fundo) dispensam
+        a busca exata; para eles o resultado é só um candidato próximo, com distância > max_distance
+        Retorna (índice na paleta, distância euclidiana em níveis de RGB)
+        '''
+
+        arrays = self._load()
+        palette = arrays['palette']
+        pixels = np.asarray(pixels, dtype=np.uint8)
+        shape = pixels.shape[:-1]
+        flat = pixels.reshape(-1, 3)
+
+        # Pixels repetidos (comuns em imagens de câmera) são resolvidos uma única vez
+        packed_pixels, inverse = np.unique(self._pack(flat), return_inverse=True)
+        unique_pixels = self._unpack(packed_pixels)
+
+        shift = 8 - self.CELL_BITS
+        cell = ((unique_pixels[:, 0] >> shift).astype(np.intp) << (2 * self.CELL_BITS)) \
+            | ((unique_pixels[:, 1] >> shift).astype(np.intp) << self.CELL_BITS) \
+            | (unique_pixels[:, 2] >> shift).astype(np.intp)
+        candidates = arrays['cell_candidates'][cell] # (U, k)
+
+        difference = palette[candidates].astype(np.int32) - unique_pixels[:, None, :].astype(np.int32)
+        squared = (difference**2).sum(axis=-1)
+        best = np.argmin(squared, axis=1)
+        rows = np.arange(len(candidates))
+        best_index = candidates[rows, best]
+        best_distance = np.sqrt(squared[rows, best])
+
+        # Qualquer cor fora dos candidatos está a pelo menos raio - |pixel - centro| do pixel
+        offset = np.sqrt(((unique_pixels - self._cell_centers()[cell])**2).sum(axis=-1))
+        bound = self._cell_radius()[cell] - offset
+        uncertain = best_distance > bound
+        if max_distance is not None:
+            uncertain &= bound <= max_distance
+        uncertain = np.flatnonzero(uncertain)
+
+        # Busca exata na paleta inteira, em blocos de pixels, só para os pixels sem garantia
+        palette_int = palette.astype(np.int32)
+        for start in range(0, len(uncertain), chunk):
+            block = uncertain[start:start + chunk]
+            difference = palette_int[None, :, :] - unique_pixels[block, None, :].astype(np.int32)
+            squared = (difference**2).sum(axis=-1)
+            best = np.argmin(squared, axis=1)
+            best_index[block] = best
+            best_distance[block] = np.sqrt(squared[np.arange(len(block)), best])
+
+        return best_index[inverse].reshape(shape), best_distance[inverse].reshape(shape)
+
+
+    @traced('ThicknessLookup')
+    def thickness_map(self, img_RGB, angle_degree=0.0, m=None, max_color_distance=32.0):
+        '''
+        Converte uma imagem RGB capturada (altura, largura, 3) em mapa de espessura (nm, float32)
+        angle_degree: ângulo de incidência, escalar ou um valor por pixel (ex.: theta_grid_3D)
+        m: ordem de interferência; None escolhe a menor espessura compatível entre as ordens do índice
+        max_color_distance: pixels cuja cor está mais longe que isso da paleta (ex.: preto, fundo) viram NaN
+        '''
+
+        arrays = self._load()
+        params = self.params
+        table = arrays['thickness']
+
+        color_index, distance = self.nearest_color(img_RGB, max_color_distance)
+
+        # Ângulo mais próximo da grade do índice (NaN e ângulos fora da faixa ficam sem espessura)
+        angle = np.broadcast_to(np.asarray(angle_degree, dtype=np.float64), color_index.shape)
+        position = np.rint(np.abs(angle) / params['angle_step_degree'])
+        valid = position < table.shape[1] # NaN -> False
+        angle_index = np.where(valid, position, 0).astype(np.intp)
+
+        if m is None:
+            with np.errstate(all='ignore'):
+                thickness = np.fmin.reduce(table[color_index, angle_index], axis=-1)
+        else:
+            if m not in params['orders']:
+                raise ValueError(f"Ordem {m} fora do índice (ordens disponíveis: {params['orders']})")
+            thickness = table[color_index, angle_index, params['orders'].index(m)]
+
+        thickness = np.where(valid, thickness, np.nan).astype(np.float32)
+        if max_color_distance is not None:
+            thickness[distance > max_color_distance] = np.nan
+
+        return thickness
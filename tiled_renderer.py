@@ -0,0 +1,199 @@
+import os
+import numpy as np
+from numpy.lib.format import open_memmap
+from physics import Physics
+
+class TiledRenderer:
+    def __init__(self, engine, tile_size=1024, pyramid_levels=4):
+        '''
+        Renderiza os mapas de cor da lente (2D e 3D) ladrilho por ladrilho, direto em arquivos .npy
+        mapeados em memória. O pico de memória depende só do tamanho do ladrilho, não da resolução.
+        engine: SimulationEngine com os parâmetros físicos/geométricos (a resolução vem dele)
+        pyramid_levels: número de níveis de pré-visualização reduzidos por 2, 4, 8...
+        '''
+
+        # Ladrilhos múltiplos de 2^níveis fazem cada bloco da pirâmide cair inteiro num ladrilho
+        factor = 2 ** pyramid_levels
+        if tile_size % factor != 0:
+            raise ValueError(f"tile_size deve ser múltiplo de {factor} para {pyramid_levels} níveis de pirâmide")
+
+        self.engine = engine
+        self.tile_size = tile_size
+        self.pyramid_levels = pyramid_levels
+
+
+    # Abre o mapa de espessura medido sem carregá-lo na RAM
+    @staticmethod
+    def open_thickness_map(thickness_map):
+        '''
+        Aceita caminho para .npy (aberto com mmap_mode='r'), np.memmap ou array
+        Valores em nm, mesma unidade de Physics.d
+        '''
+
+        if thickness_map is None:
+            return None
+        if isinstance(thickness_map, (str, os.PathLike)):
+            return np.load(thickness_map, mmap_mode='r')
+        return thickness_map
+
+
+    # Lê do mapa de espessura somente os pixels de um ladrilho
+    def _thickness_tile(self, thickness_map, rows, cols):
+        '''
+        Amostragem por vizinho mais próximo: o mapa medido pode ter resolução diferente da renderização
+        '''
+
+        resolution = self.engine.geometry_model.resolution
+        map_rows = (np.arange(rows.start, rows.stop) * thickness_map.shape[0]) // resolution
+        map_cols = (np.arange(cols.start, cols.stop) * thickness_map.shape[1]) // resolution
+        return np.asarray(thickness_map[np.ix_(map_rows, map_cols)], dtype=self.engine.geometry_model.dtype)
+
+
+    def _tile_physics(self, thickness_map, rows, cols):
+        physics_model = self.engine.physics_model
+        if thickness_map is None:
+            return physics_model
+
+        d_tile = self._thickness_tile(thickness_map, rows, cols)
+        return Physics(physics_model.n_film, d_tile, physics_model.m, dtype=physics_model.dtype)
+
+
+    def _tiles(self):
+        resolution = self.engine.geometry_model.resolution
+        for row in range(0, resolution, self.tile_size):
+            for col in range(0, resolution, self.tile_size):
+                yield (slice(row, min(row + self.tile_size, resolution)),
+                       slice(col, min(col + self.tile_size, resolution)))
+
+
+    # Arquivos de saída: imagem completa e um arquivo por nível da pirâmide
+    def _open_outputs(self, path):
+        resolution = self.engine.geometry_model.resolution
+        stem = path[:-4] if path.endswith('.npy') else path
+
+        image = open_memmap(stem + '.npy', mode='w+', dtype=np.uint8, shape=(resolution, resolution, 3))
+
+        pyramid = []
+        for level in range(1, self.pyramid_levels + 1):
+            size = -(-resolution // 2**level) # divisão com arredondamento para cima
+            pyramid.append(open_memmap(f"{stem}_L{level}.npy", mode='w+', dtype=np.uint8, shape=(size, size, 3)))
+
+        return image, pyramid
+
+
+    # Redução do ladrilho para cada nível da pirâmide (média em blocos 2^k x 2^k)
+    def _write_pyramid(self, pyramid, tile_RGB, rows, cols):
+        for level, preview in enumerate(pyramid, start=1):
+            factor = 2**level
+
+            # Borda da imagem: completa o bloco repetindo a última linha/coluna
+            pad_rows = -tile_RGB.shape[0] % factor
+            pad_cols = -tile_RGB.shape[1] % factor
+            padded = np.pad(tile_RGB, ((0, pad_rows), (0, pad_cols), (0, 0)), mode='edge')
+
+            blocks = padded.reshape(padded.shape[0] // factor, factor, padded.shape[1] // factor, factor, 3)
+            reduced = np.rint(blocks.mean(axis=(1, 3), dtype=np.float32)).astype(np.uint8)
+
+            preview[rows.start // factor: rows.start // factor + reduced.shape[0],
+                    cols.start // factor: cols.start // factor + reduced.shape[1]] = reduced
+
+
+    # Cor de um ladrilho da simulação 2D
+    def _tile_2D(self, rows, cols, theta_max_degree, thickness_map):
+        geometry_model = self.engine.geometry_model
+        axis = np.linspace(-1, 1, geometry_model.resolution, dtype=geometry_model.dtype)
+
+        # Grid, raio e ângulo só do ladrilho
+        X, Y = np.meshgrid(axis[cols], axis[rows])
+        R = np.sqrt(X**2 + Y**2)
+        theta_grid = R * geometry_model.dtype.type(theta_max_degree)
+
+        physics_model = self._tile_physics(thickness_map, rows, cols)
+        lambda_grid = physics_model.calculate_wavelength(theta_grid)
+
+        return self.engine.visuals_models.wavelength_grid_to_rgb(lambda_grid, R <= 1.0)
+
+
+    # Cor de um ladrilho da lente 3D (rotação e fonte de luz do engine)
+    def _tile_3D(self, rows, cols, glass_index, light_distance_mm, thickness_map):
+        geometry_model = self.engine.geometry_model
+        limit = self.engine.LENS_LIMIT_MM
+        surface = self.engine.surface_model(glass_index)
+        axis = np.linspace(-limit, limit, geometry_model.resolution, dtype=geometry_model.dtype)
+
+        X, Y = np.meshgrid(axis[cols], axis[rows])
+        _, _, Z_rot, theta = geometry_model.vectorize_block_3D(
+            X, Y, surface, limit, light_distance_mm
+        )
+
+        physics_model = self._tile_physics(thickness_map, rows, cols)
+        wavelength_grid = physics_model.calculate_wavelength(theta)
+
+        return self.engine.visuals_models.wavelength_grid_to_rgb(wavelength_grid, ~np.isnan(Z_rot))
+
+
+    def _tile_function(self, mode, lens_diameter_mm=50.0, glass_index=1.5, light_distance_mm=None, thickness_map=None):
+        thickness_map = self.open_thickness_map(thickness_map)
+
+        if mode == '2D':
+            theta_max_degree = self.engine.geometry_model.calculate_theta_max_2D(lens_diameter_mm, glass_index)
+            return lambda rows, cols: self._tile_2D(rows, cols, theta_max_degree, thickness_map)
+        if mode == '3D':
+            return lambda rows, cols: self._tile_3D(rows, cols, glass_index, light_distance_mm, thickness_map)
+
+        raise ValueError(f"Modo inválido: {mode}")
+
+
+    def _render(self, path, render_tile):
+        image, pyramid = self._open_outputs(path)
+
+        for rows, cols in self._tiles():
+            tile_RGB = render_tile(rows, cols)
+            image[rows, cols] = tile_RGB
+            self._write_pyramid(pyramid, tile_RGB, rows, cols)
+
+        image.flush()
+        for preview in pyramid:
+            preview.flush()
+
+        return image, pyramid
+
+
+    def render_2D(self, path, lens_diameter_mm, glass_index, thickness_map=None):
+        '''
+        Mapa de cor da simulação 2D gravado em path (.npy) com pirâmide em path_L1.npy, path_L2.npy...
+        Retorna (imagem, níveis da pirâmide) como memmaps
+        '''
+
+        return self._render(path, self._tile_function('2D', lens_diameter_mm, glass_index, thickness_map=thickness_map))
+
+
+    def render_3D(self, path, glass_index, light_distance_mm=None, thickness_map=None):
+        '''
+        Mapa de cor da lente 3D no grid (x, y) do objeto, com rotação e fonte de luz do engine
+        Pontos fora da lente recebem a cor de fundo
+        '''
+
+        return self._render(path, self._tile_function('3D', glass_index=glass_index, light_distance_mm=light_distance_mm,
+                                                      thickness_map=thickness_map))
+
+
+    def iter_bands(self, mode, lens_diameter_mm=50.0, glass_index=1.5, light_distance_mm=None, thickness_map=None):
+        '''
+        Gera a imagem em faixas horizontais de tile_size linhas (cada faixa montada ladrilho a ladrilho),
+        na ordem das linhas: serve para transmitir a imagem sem gravá-la nem mantê-la inteira na memória
+        Gerador de (slice das linhas, faixa RGB uint8)
+        '''
+
+        render_tile = self._tile_function(mode, lens_diameter_mm, glass_index, light_distance_mm, thickness_map)
+        resolution = self.engine.geometry_model.resolution
+
+        for row in range(0, resolution, self.tile_size):
+            rows = slice(row, min(row + self.tile_size, resolution))
+            band = np.empty((rows.stop - rows.start, resolution, 3), dtype=np.uint8)
+
+            for col in range(0, resolution, self.tile_size):
+                cols = slice(col, min(col + self.tile_size, resolution))
+                band[:, cols] = render_tile(rows, cols)
+
+            yield rows, band
@@ -0,0 +1,443 @@
+import argparse
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from data import Data
+from visuals import Visuals
+from instrumentation import traced
+
+
+# -- Redutores em fluxo: cada um recebe lotes (amostras, pontos) e guarda só estatísticas por ponto --
+
+class WavelengthMoments:
+    def __init__(self, n_points):
+        '''
+        Média, variância (Welford/Chan), mínimo e máximo do comprimento de onda de cada ponto
+        NaN (reflexão total interna) não entra nas estatísticas
+        '''
+
+        self.count = np.zeros(n_points, dtype=np.int64)
+        self.mean = np.zeros(n_points, dtype=np.float64)
+        self.m2 = np.zeros(n_points, dtype=np.float64)
+        self.minimum = np.full(n_points, np.inf)
+        self.maximum = np.full(n_points, -np.inf)
+
+
+    def _combine(self, count, mean, m2):
+        # Combinação de dois conjuntos de momentos (Chan et al.): independe da ordem dos lotes
+        total = self.count + count
+        ratio = np.divide(count, total, out=np.zeros(len(total)), where=total > 0)
+        delta = mean - self.mean
+
+        self.mean += delta * ratio
+        self.m2 += m2 + delta**2 * self.count * ratio
+        self.count = total
+
+
+    def update(self, wavelength):
+        valid = ~np.isnan(wavelength)
+        count = valid.sum(axis=0)
+
+        filled = np.where(valid, wavelength, 0.0)
+        mean = filled.sum(axis=0, dtype=np.float64) / np.maximum(count, 1)
+        m2 = np.square(np.where(valid, wavelength - mean, 0.0)).sum(axis=0, dtype=np.float64)
+        self._combine(count, mean, m2)
+
+        np.fmin(self.minimum, np.nanmin(np.where(valid, wavelength, np.inf), axis=0), out=self.minimum)
+        np.fmax(self.maximum, np.nanmax(np.where(valid, wavelength, -np.inf), axis=0), out=self.maximum)
+
+
+    def merge(self, other):
+        self._combine(other.count, other.mean, other.m2)
+        np.fmin(self.minimum, other.minimum, out=self.minimum)
+        np.fmax(self.maximum, other.maximum, out=self.maximum)
+
+
+    def result(self):
+        counted = self.count > 0
+        variance = np.divide(self.m2, self.count, out=np.full(len(self.count), np.nan), where=counted)
+        return {
+            'mean_wavelength': np.where(counted, self.mean, np.nan),
+            'std_wavelength': np.sqrt(variance),
+            'min_wavelength': np.where(counted, self.minimum, np.nan),
+            'max_wavelength': np.where(counted, self.maximum, np.nan),
+        }
+
+
+class OutOfSpec:
+    def __init__(self, nominal_wavelength, max_deviation_nm):
+        '''
+        Fração das amostras em que cada ponto sai da especificação: |lambda - lambda nominal| > max_deviation_nm
+        (NaN conta como fora). Conta também as lentes inteiras dentro da especificação (rendimento)
+        '''
+
+        self.nominal = nominal_wavelength
+        self.max_deviation_nm = max_deviation_nm
+        self.out = np.zeros(len(nominal_wavelength), dtype=np.int64)
+        self.samples = 0
+        self.lenses_in_spec = 0
+
+
+    def update(self, wavelength):
+        with np.errstate(invalid='ignore'):
+            inside = np.abs(wavelength - self.nominal) <= self.max_deviation_nm # NaN -> False
+
+        self.out += len(wavelength) - inside.sum(axis=0)
+        self.samples += len(wavelength)
+        self.lenses_in_spec += int(np.all(inside, axis=1).sum())
+
+
+    def merge(self, other):
+        self.out += other.out
+        self.samples += other.samples
+        self.lenses_in_spec += other.lenses_in_spec
+
+
+    def result(self):
+        samples = max(self.samples, 1)
+        return {'out_of_spec': self.out / samples}
+
+
+class ColorHistogram:
+    def __init__(self, n_points, edges):
+        '''
+        Histograma por ponto das cores percebidas: faixas de comprimento de onda (edges, nm) da LUT espectral
+        Amostras fora das faixas (fora do visível ou NaN) não entram em nenhuma
+        '''
+
+        self.edges = edges
+        self.counts = np.zeros((n_points, len(edges) - 1), dtype=np.int32)
+
+
+    def update(self, wavelength):
+        n_points, bins = self.counts.shape
+        step = self.edges[1] - self.edges[0]
+
+        with np.errstate(invalid='ignore'):
+            valid = (wavelength >= self.edges[0]) & (wavelength < self.edges[-1])
+        position = ((wavelength[valid] - self.edges[0]) / step).astype(np.intp)
+        np.minimum(position, bins - 1, out=position)
+
+        # Índice linear (ponto, faixa) de cada amostra válida -> contagem com um único bincount
+        points = np.broadcast_to(np.arange(n_points), wavelength.shape)[valid]
+        self.counts += np.bincount(points * bins + position, minlength=n_points * bins).reshape(n_points, bins)
+
+
+    def merge(self, other):
+        self.counts += other.counts
+
+
+    def result(self):
+        return {'histogram': self.counts}
+
+
+class MeanColor:
+    def __init__(self, n_points, visuals_model):
+        '''
+        Cor média percebida em cada ponto: média das cores RGB (LUT) de todas as amostras
+        '''
+
+        self.visuals_model = visuals_model
+        self.rgb_sum = np.zeros((n_points, 3), dtype=np.float64)
+        self.samples = 0
+
+
+    def update(self, wavelength):
+        self.rgb_sum += self.visuals_model.wavelength_grid_to_rgb(wavelength).sum(axis=0, dtype=np.float64)
+        self.samples += len(wavelength)
+
+
+    def merge(self, other):
+        self.rgb_sum += other.rgb_sum
+        self.samples += other.samples
+
+
+    def result(self):
+        return {'mean_RGB': self.rgb_sum / max(self.samples, 1)}
+
+
+class Tolerance:
+    DISTRIBUTIONS = ('normal', 'uniform', 'fixed')
+
+    # Estimativa de temporários por par (amostra, ponto): comprimento de onda, máscaras, índices, RGB...
+    VALUES_PER_PAIR = 12
+    DEFAULT_MEMORY_BUDGET = 64 * 1024**2
+
+    # Amostras por tarefa: unidade de trabalho dos processos e de semente aleatória
+    # (o resultado é o mesmo com qualquer número de processos)
+    TASK_SAMPLES = 2048
+
+    def __init__(self, n_film=None, d=None, samples=1000, max_deviation_nm=10.0, histogram_step_nm=10.0,
+                 seed=0, workers=1):
+        '''
+        Análise de tolerância do revestimento por Monte Carlo: sorteia `samples` pares (n, d) das distribuições
+        e avalia cada lote de amostras sobre todos os pontos do mapa de ângulos de uma vez (broadcast)
+        Os resultados são reduzidos em fluxo (WavelengthMoments, OutOfSpec, ColorHistogram, MeanColor):
+        a memória não cresce com o número de amostras
+        n_film, d: distribuições criadas por Tolerance.normal / uniform / fixed; None mantém o valor nominal
+        max_deviation_nm: especificação, desvio máximo do comprimento de onda em relação ao nominal
+        workers: processos em paralelo (1 roda no próprio processo)
+        '''
+
+        for distribution in (n_film, d):
+            if distribution is not None and distribution['type'] not in self.DISTRIBUTIONS:
+                raise ValueError(f"Distribuição inválida: {distribution['type']}")
+
+        self.n_film = n_film or self.fixed()
+        self.d = d or self.fixed()
+        self.samples = int(samples)
+        self.max_deviation_nm = float(max_deviation_nm)
+        self.histogram_step_nm = float(histogram_step_nm)
+        self.seed = int(seed)
+        self.workers = workers or os.cpu_count() or 1
+
+
+    # -- Construtores das distribuições (mean/center None = valor nominal do engine) --
+
+    @staticmethod
+    def normal(std, mean=None, truncate_sigma=None):
+        '''
+        Normal; truncate_sigma descarta e sorteia de novo as amostras além de mean ± truncate_sigma * std
+        '''
+
+        return {'type': 'normal', 'std': float(std), 'mean': None if mean is None else float(mean),
+                'truncate_sigma': None if truncate_sigma is None else float(truncate_sigma)}
+
+
+    @staticmethod
+    def uniform(half_width, center=None):
+        return {'type': 'uniform', 'half_width': float(half_width), 'center': None if center is None else float(center)}
+
+
+    @staticmethod
+    def fixed(value=None):
+        return {'type': 'fixed', 'value': None if value is None else float(value)}
+
+
+    def key(self):
+        '''
+        Tupla estável da análise (chave de cache); workers não muda o resultado e fica de fora
+        '''
+
+        return (tuple(sorted(self.n_film.items())), tuple(sorted(self.d.items())), self.samples,
+                self.max_deviation_nm, self.histogram_step_nm, self.seed)
+
+
+    @staticmethod
+    def draw(distribution, nominal, n, rng):
+        '''
+        n amostras da distribuição
+        '''
+
+        if distribution['type'] == 'fixed':
+            value = nominal if distribution['value'] is None else distribution['value']
+            return np.full(n, value, dtype=np.float64)
+
+        if distribution['type'] == 'uniform':
+            center = nominal if distribution['center'] is None else distribution['center']
+            return rng.uniform(center - distribution['half_width'], center + distribution['half_width'], n)
+
+        mean = nominal if distribution['mean'] is None else distribution['mean']
+        values = rng.normal(mean, distribution['std'], n)
+        if distribution['truncate_sigma'] is not None:
+            limit = distribution['truncate_sigma'] * distribution['std']
+            rejected = np.abs(values - mean) > limit
+            while np.any(rejected):
+                values[rejected] = rng.normal(mean, distribution['std'], int(rejected.sum()))
+                rejected = np.abs(values - mean) > limit
+        return values
+
+
+    def histogram_edges(self):
+        return np.arange(Visuals.LUT_MIN_WAVELENGTH, Visuals.LUT_MAX_WAVELENGTH + self.histogram_step_nm / 2,
+                         self.histogram_step_nm)
+
+
+    def reducers(self, nominal_wavelength):
+        n_points = len(nominal_wavelength)
+        return {
+            'moments': WavelengthMoments(n_points),
+            'out_of_spec': OutOfSpec(nominal_wavelength, self.max_deviation_nm),
+            'histogram': ColorHistogram(n_points, self.histogram_edges()),
+            'color': MeanColor(n_points, Visuals()),
+        }
+
+
+    def _batch_samples(self, n_points, itemsize, memory_budget_bytes):
+        return max(1, int(memory_budget_bytes // (n_points * self.VALUES_PER_PAIR * max(itemsize, 8))))
+
+
+    @traced('Tolerance')
+    def run(self, theta_incident_degree, physics_model, memory_budget_bytes=None):
+        '''
+        Executa a análise sobre os pontos de um mapa de ângulos de incidência (array 1D, graus)
+        physics_model: valores nominais de n, d e m e a política de precisão
+        Retorna (estatísticas por ponto, resumo) -> ver result()
+        '''
+
+        theta = np.asarray(theta_incident_degree, dtype=physics_model.dtype)
+        nominal = Data.wavelength(theta, physics_model.d, physics_model.n_film, physics_model.m)
+
+        budget = memory_budget_bytes or self.DEFAULT_MEMORY_BUDGET
+        state = {
+            'tolerance': self,
+            'theta': theta,
+            'nominal': nominal,
+            'nominal_n_film': physics_model.n_film,
+            'nominal_d': physics_model.d,
+            'm': physics_model.m,
+            'batch': self._batch_samples(len(theta), theta.dtype.itemsize, budget),
+        }
+
+        # 1. Tarefas de até TASK_SAMPLES amostras, cada uma com a sua semente derivada da semente da análise
+        sizes = [min(self.TASK_SAMPLES, self.samples - start) for start in range(0, self.samples, self.TASK_SAMPLES)]
+        tasks = list(zip(sizes, np.random.SeedSequence(self.seed).spawn(len(sizes))))
+
+        # 2. Redução: os resultados das tarefas são combinados na ordem das tarefas
+        reducers = self.reducers(nominal)
+        if self.workers == 1 or len(tasks) == 1:
+            for size, seed in tasks:
+                self._merge(reducers, _evaluate(state, size, seed))
+        else:
+            for partial in self._run_parallel(state, tasks):
+                self._merge(reducers, partial)
+
+        return self.result(reducers)
+
+
+    def _run_parallel(self, state, tasks):
+        '''
+        Distribui as tarefas pelo pool de processos; no máximo 2 tarefas por processo ficam em voo,
+        então os resultados parciais na memória também não crescem com o número de amostras
+        '''
+
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=(state,)) as executor:
+            pending = deque()
+            for size, seed in tasks:
+                pending.append(executor.submit(_evaluate_in_worker, size, seed))
+                if len(pending) >= 2 * self.workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+
+    @staticmethod
+    def _merge(reducers, partial):
+        for name, reducer in reducers.items():
+            reducer.merge(partial[name])
+
+
+    def result(self, reducers):
+        '''
+        Estatísticas por ponto: mean/std/min/max_wavelength, out_of_spec (fração), histogram (contagens por faixa),
+        mean_RGB; resumo: amostras, rendimento (lentes com todos os pontos na especificação), faixas e cores do histograma
+        '''
+
+        statistics = {}
+        for reducer in reducers.values():
+            statistics.update(reducer.result())
+
+        edges = reducers['histogram'].edges
+        out_of_spec = reducers['out_of_spec']
+        summary = {
+            'samples': out_of_spec.samples,
+            'lens_yield': out_of_spec.lenses_in_spec / max(out_of_spec.samples, 1),
+            'histogram_edges': edges,
+            'histogram_colors': Visuals().wavelength_grid_to_rgb((edges[:-1] + edges[1:]) / 2),
+        }
+        return statistics, summary
+
+
+# -- Funções executadas nos processos do pool (precisam estar no nível do módulo) --
+
+_worker_state = None
+
+
+def _init_worker(state):
+    '''
+    Recebe uma única vez por processo o mapa de ângulos e os valores nominais, em vez de enviá-los a cada tarefa
+    '''
+
+    global _worker_state
+    _worker_state = state
+    Visuals.spectral_lut()
+
+
+def _evaluate_in_worker(size, seed):
+    return _evaluate(_worker_state, size, seed)
+
+
+def _evaluate(state, size, seed):
+    '''
+    Uma tarefa: sorteia `size` pares (n, d) e avalia em lotes (amostras, pontos) dentro do orçamento de memória
+    Retorna os redutores da tarefa
+    '''
+
+    tolerance = state['tolerance']
+    theta = state['theta']
+    rng = np.random.default_rng(seed)
+
+    n_film = tolerance.draw(tolerance.n_film, state['nominal_n_film'], size, rng).astype(theta.dtype)
+    d = tolerance.draw(tolerance.d, state['nominal_d'], size, rng).astype(theta.dtype)
+
+    reducers = tolerance.reducers(state['nominal'])
+    for start in range(0, size, state['batch']):
+        batch = slice(start, start + state['batch'])
+        wavelength = Data.wavelength(theta[None, :], d[batch, None], n_film[batch, None], state['m'])
+        for reducer in reducers.values():
+            reducer.update(wavelength)
+
+    return reducers
+
+
+def main(argv=None):
+    from simulation_engine import SimulationEngine
+
+    parser = argparse.ArgumentParser(description="Análise de tolerância do revestimento (Monte Carlo em n e d)")
+    parser.add_argument('--mode', choices=['2D', '3D'], default='2D')
+    parser.add_argument('--n-film', type=float, default=1.413)
+    parser.add_argument('--n-std', type=float, default=0.0, help="Desvio padrão do índice do filme")
+    parser.add_argument('--d', type=float, default=200.0)
+    parser.add_argument('--d-std', type=float, default=5.0, help="Desvio padrão da espessura (nm)")
+    parser.add_argument('--truncate-sigma', type=float, default=3.0)
+    parser.add_argument('--m', type=int, default=1)
+    parser.add_argument('--diopter', type=float, default=5.0)
+    parser.add_argument('--resolution', type=int, default=200)
+    parser.add_argument('--glass-index', type=float, default=1.5)
+    parser.add_argument('--lens-diameter-mm', type=float, default=50.0)
+    parser.add_argument('--light-distance-mm', type=float, default=None)
+    parser.add_argument('--samples', type=int, default=10000)
+    parser.add_argument('--max-deviation-nm', type=float, default=10.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=1, help="Processos (0: núcleos da CPU)")
+    parser.add_argument('--output', default=None, help="Arquivo .npz com os mapas")
+    args = parser.parse_args(argv)
+
+    engine = SimulationEngine(n_film=args.n_film, d=args.d, m=args.m, diopter=args.diopter,
+                              resolution=args.resolution, use_cache=False)
+    tolerance = Tolerance(
+        n_film=Tolerance.normal(args.n_std, truncate_sigma=args.truncate_sigma) if args.n_std > 0 else None,
+        d=Tolerance.normal(args.d_std, truncate_sigma=args.truncate_sigma) if args.d_std > 0 else None,
+        samples=args.samples, max_deviation_nm=args.max_deviation_nm, seed=args.seed, workers=args.workers or None,
+    )
+
+    start = time.perf_counter()
+    if args.mode == '2D':
+        maps = engine.tolerance_2D(args.lens_diameter_mm, args.glass_index, tolerance)
+    else:
+        maps = engine.tolerance_3D(args.glass_index, tolerance, args.light_distance_mm)
+    seconds = time.perf_counter() - start
+
+    print(f"{maps['samples']} amostras em {seconds:.2f}s ({maps['samples'] / max(seconds, 1e-9):,.0f} amostras/s)")
+    print(f"Rendimento (lente inteira na especificação): {maps['lens_yield']:.1%}")
+    print(f"Área fora da especificação (média): {maps['area_out_of_spec']:.1%}")
+
+    if args.output:
+        np.savez_compressed(args.output, **maps)
+        print(f"Mapas gravados em {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,93 @@
+import importlib
+import time
 import numpy as np
-import plotly.graph_objects as go
+from instrumentation import traced
+
+class _LazyModule:
+    '''
+    Módulo importado só no primeiro acesso a um atributo
+    O núcleo numérico (LUT, cores) funciona sem carregar o Plotly; ele entra na primeira figura pedida
+    '''
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attribute)
+
+
+go = _LazyModule('plotly.graph_objects')
+pio = _LazyModule('plotly.io')
+
 
 class Visuals:
+    # Tabela densa comprimento de onda -> RGB (compartilhada por todas as instâncias)
+    LUT_MIN_WAVELENGTH = 380.0
+    LUT_MAX_WAVELENGTH = 750.0
+    LUT_STEP = 0.1
+    BACKGROUND_RGB = (20, 20, 20)
+
+    _spectral_lut = None
+    _colorscale_cache = None
+    _layout_template_3D = None
+
+    # Modos de saída da figura 3D: 'full' (float64 completo), 'compact' (float32 + dizimação adaptativa)
+    # e 'mesh' (Mesh3d float32 sem os vértices fora da lente)
+    FIGURE_PAYLOADS = ('full', 'compact', 'mesh')
+
     def __init__(self):
         pass
 
     
-    def wavelength_function_angle_graph(self, angles, wavelengths):
+    # Redução de uma curva longa para o gráfico
+    @staticmethod
+    def downsample_curve(x, y, max_points=2000):
+        '''
+        Divide a curva em max_points / 2 faixas consecutivas e guarda o mínimo e o máximo de y de cada uma,
+        na ordem em que aparecem: picos e vales sobrevivem e o gráfico não cresce com a varredura
+        '''
+
+        x, y = np.asarray(x), np.asarray(y, dtype=np.float64)
+        if len(x) <= max_points:
+            return x, y
+
+        buckets = max(1, max_points // 2)
+        edges = np.linspace(0, len(x), buckets + 1).astype(np.intp)
+        starts = edges[:-1]
+
+        # Índices do mínimo e do máximo em cada faixa (faixas inteiras de NaN ficam com o primeiro ponto)
+        filled = np.nan_to_num(y, nan=np.inf)
+        minimum = np.minimum.reduceat(filled, starts)
+        filled = np.nan_to_num(y, nan=-np.inf)
+        maximum = np.maximum.reduceat(filled, starts)
+
+        bucket = np.repeat(np.arange(buckets), np.diff(edges))
+        position = np.arange(len(x))
+        first_min = np.full(buckets, len(x))
+        first_max = np.full(buckets, len(x))
+        np.minimum.at(first_min, bucket[y == minimum[bucket]], position[y == minimum[bucket]])
+        np.minimum.at(first_max, bucket[y == maximum[bucket]], position[y == maximum[bucket]])
+        first_min = np.where(first_min == len(x), starts, first_min)
+        first_max = np.where(first_max == len(x), starts, first_max)
+
+        keep = np.unique(np.concatenate((first_min, first_max, [0, len(x) - 1])))
+        return x[keep], y[keep]
+
+
+    @traced('Visuals')
+    def wavelength_function_angle_graph(self, angles, wavelengths, max_points=2000):
         '''
         Constrói o gráfico que relaciona os comprimentos de onda aos
         ângulos de incidência em filmes finos
+        Varreduras longas entram no gráfico reduzidas a até ~max_points pontos (downsample_curve)
         '''
         fig = go.Figure()
 
+        angles, wavelengths = self.downsample_curve(angles, wavelengths, max_points)
+
         #Adicionar a curva calculada
         fig.add_trace(go.Scatter(
             x=angles,
@@ -102,75 +177,323 @@ class Visuals:
         return (int(R * 255), int (G * 255), int (B * 255))
     
 
-    def image_grid_construction_2D(self, mask, lambda_grid, resolution):
+    @classmethod
+    @traced('Visuals')
+    def spectral_lut(cls):
         '''
-        Converter comprimento de onda em RGB
-        Cria-se uma imagem vazia (altura, largura, 3 canais de cor)
+        Tabela de consulta (LUT) do espectro visível, construída uma única vez
+        Linhas: [0, n) -> 380..750 nm em passos de LUT_STEP | n -> preto (fora da banda/NaN) | n+1 -> fundo
         '''
 
-        img_RGB = np.zeros((resolution, resolution, 3), dtype=np.uint8)
+        if cls._spectral_lut is None:
+            n_entries = int(round((cls.LUT_MAX_WAVELENGTH - cls.LUT_MIN_WAVELENGTH) / cls.LUT_STEP)) + 1
+            wavelengths = np.linspace(cls.LUT_MIN_WAVELENGTH, cls.LUT_MAX_WAVELENGTH, n_entries)
+
+            # A própria curva de Bruton (com gamma) define cada entrada da tabela
+            converter = cls()
+            table = [converter.wavelength_to_rgb(wavelength) for wavelength in wavelengths]
+            table.append((0, 0, 0))
+            table.append(cls.BACKGROUND_RGB)
+
+            cls._spectral_lut = np.array(table, dtype=np.uint8)
 
-        # Loop pixel a pixel
-        for i in range(resolution):
-            for j in range(resolution):
+        return cls._spectral_lut
 
-                if mask[i, j]: # se estiver dentro do círculo
-                    wavelength = lambda_grid[i, j]
-                    RGB = self.wavelength_to_rgb(wavelength)
-                    img_RGB[i, j] = RGB
 
-                else:
-                    img_RGB[i, j] = [20, 20, 20] # fundo cinza escuro
+    @traced('Visuals')
+    def wavelength_grid_to_rgb(self, lambda_grid, mask=None):
+        '''
+        Converte um array inteiro de comprimentos de onda (nm) em RGB por indexação na LUT
+        NaN e valores fora de 380-750 nm viram preto; pixels fora da máscara recebem a cor de fundo
+        '''
+
+        lut = self.spectral_lut()
+        out_of_band_index = len(lut) - 2
+        background_index = len(lut) - 1
 
-        return img_RGB
+        lambda_grid = np.asarray(lambda_grid, dtype=np.float64)
+        if mask is not None:
+            lambda_grid = np.broadcast_to(lambda_grid, np.shape(mask))
+
+        # Índice da entrada mais próxima na tabela
+        position = (lambda_grid - self.LUT_MIN_WAVELENGTH) / self.LUT_STEP
+        valid = (lambda_grid >= self.LUT_MIN_WAVELENGTH) & (lambda_grid <= self.LUT_MAX_WAVELENGTH) # NaN -> False
+
+        index = np.full(lambda_grid.shape, out_of_band_index, dtype=np.intp)
+        index[valid] = np.rint(position[valid])
+
+        if mask is not None:
+            index[~mask] = background_index
+
+        return lut[index]
+
+
+    @traced('Visuals')
+    def image_grid_construction_2D(self, mask, lambda_grid, resolution):
+        '''
+        Converter comprimento de onda em RGB
+        Cria-se a imagem (altura, largura, 3 canais de cor) em uma única passada pela LUT
+        '''
+
+        img_RGB = self.wavelength_grid_to_rgb(lambda_grid, mask)
+        return img_RGB.reshape(resolution, resolution, 3)
     
 
+    @traced('Visuals')
     def generate_custom_colorscale(self):
         '''
         Gera uma escala de cores para o Plotly que corresponde ao espectro visível
         '''
 
-        colorscale = []
-        min_wavelength, max_wavelength = 350, 750
-        steps = 100
-        
-        for i in range(steps + 1):
-            val_norm = i / steps #valor normalizado
-            wavelength = min_wavelength + val_norm * (max_wavelength - min_wavelength) #comprimento de onda
-            
-            # Converter para RGB usando sua função existente
-            R, G, B = self.wavelength_to_rgb(wavelength)
-            
+        if Visuals._colorscale_cache is None:
+            min_wavelength, max_wavelength = 350, 750
+            steps = 100
+
+            val_norm = np.linspace(0, 1, steps + 1) #valores normalizados
+            wavelengths = min_wavelength + val_norm * (max_wavelength - min_wavelength) #comprimentos de onda
+
+            # Converter para RGB pela mesma LUT usada na imagem 2D
+            colors = self.wavelength_grid_to_rgb(wavelengths)
+
             # Formatar para string CSS que o Plotly entende na definição da escala
-            color_css = f"rgb({R},{G},{B})"
-            colorscale.append([val_norm, color_css])
-            
-        return colorscale
+            Visuals._colorscale_cache = [
+                [float(val), f"rgb({R},{G},{B})"] for val, (R, G, B) in zip(val_norm, colors)
+            ]
+
+        return [list(entry) for entry in Visuals._colorscale_cache]
     
-    def figure_grid_construction_3D(self, wavelength_grid, X_rot, Y_rot, Z_rot):
+    @traced('Visuals')
+    def figure_grid_construction_3D(self, wavelength_grid, X_rot, Y_rot, Z_rot, payload='full',
+                                    color_tolerance_nm=2.0, max_stride=4):
         '''
         Constrói uma representação visual em 3D da lente 
+        payload: 'full' | 'compact' | 'mesh' (ver FIGURE_PAYLOADS)
+        O tamanho do JSON dos dados enviados ao navegador (o trace, serializado uma vez na construção)
+        e o tempo de construção ficam em fig.layout.meta['payload']
         '''
+
+        if payload not in self.FIGURE_PAYLOADS:
+            raise ValueError(f"Modo de payload inválido: {payload}")
+
+        start = time.perf_counter()
         custom_scale = self.generate_custom_colorscale()
-        fig_3D = go.Figure(data=[go.Surface(
+
+        if payload == 'full':
+            trace = go.Surface(
                 x=X_rot, y=Y_rot, z=Z_rot,
                 surfacecolor=wavelength_grid,
                 colorscale=custom_scale,     
                 cmin=350, cmax=750,          
                 showscale=False,
                 lighting=dict(ambient=1.0, diffuse=0.0, specular=0.0, roughness=1.0)
-            )])
-
-        fig_3D.update_layout(
-            scene=dict(
-                xaxis=dict(visible=False, range=[-30, 30], backgroundcolor='rgb(20,20,20)'),
-                yaxis=dict(visible=False, range=[-30, 30], backgroundcolor='rgb(20,20,20)'),
-                zaxis=dict(visible=False, range=[-30, 30], backgroundcolor='rgb(20,20,20)'),
-                aspectmode='manual',
-                aspectratio=dict(x=1, y=1, z=0.6)
-            ),
-            margin=dict(l=0, r=0, b=0, t=0),
-            height=600,
-            paper_bgcolor='rgba(0,0,0,0)'
+            )
+            n_vertices = wavelength_grid.size
+
+        else:
+            # Dizimação adaptativa: linhas e colunas só são mantidas onde a cor varia
+            rows = self.adaptive_line_indices(wavelength_grid, 0, color_tolerance_nm, max_stride)
+            cols = self.adaptive_line_indices(wavelength_grid, 1, color_tolerance_nm, max_stride)
+            grid = np.ix_(rows, cols)
+
+            X_dec, Y_dec, Z_dec = (np.asarray(axis[grid], dtype=np.float32) for axis in (X_rot, Y_rot, Z_rot))
+            color_dec = np.asarray(wavelength_grid[grid], dtype=np.float32)
+
+            if payload == 'compact':
+                trace = go.Surface(
+                    x=X_dec, y=Y_dec, z=Z_dec,
+                    surfacecolor=color_dec,
+                    colorscale=custom_scale,
+                    cmin=350, cmax=750,
+                    showscale=False,
+                    lighting=dict(ambient=1.0, diffuse=0.0, specular=0.0, roughness=1.0)
+                )
+                n_vertices = color_dec.size
+
+            else:
+                # Triangulação que descarta por completo os vértices fora da lente
+                valid = ~(np.isnan(X_dec) | np.isnan(Y_dec) | np.isnan(Z_dec))
+                vertices, i, j, k = self.compact_mesh(valid)
+                x, y, z, intensity = (array.ravel()[vertices] for array in (X_dec, Y_dec, Z_dec, color_dec))
+
+                trace = go.Mesh3d(
+                    x=x, y=y, z=z,
+                    i=i, j=j, k=k,
+                    intensity=intensity,
+                    intensitymode='vertex',
+                    colorscale=custom_scale,
+                    cmin=350, cmax=750,
+                    showscale=False,
+                    flatshading=True,
+                    lighting=dict(ambient=1.0, diffuse=0.0, specular=0.0, roughness=1.0)
+                )
+                n_vertices = vertices.size
+
+        fig_3D = go.Figure(data=[trace], layout=self.layout_template_3D())
+        build_seconds = time.perf_counter() - start
+
+        # Só os dados carregam os arrays (codificados como na figura enviada); o layout é o mesmo em todos os modos
+        payload_bytes = len(pio.to_json({'data': fig_3D.to_plotly_json()['data']}, validate=False))
+
+        fig_3D.update_layout(meta={'payload': {
+            'mode': payload,
+            'vertices': int(n_vertices),
+            'bytes': payload_bytes,
+            'build_seconds': build_seconds,
+        }})
+        return fig_3D
+
+
+    @classmethod
+    def layout_template_3D(cls):
+        '''
+        Layout da cena 3D construído uma única vez; cada atualização só troca os dados
+        '''
+
+        if cls._layout_template_3D is None:
+            cls._layout_template_3D = go.Layout(
+                scene=dict(
+                    xaxis=dict(visible=False, range=[-30, 30], backgroundcolor='rgb(20,20,20)'),
+                    yaxis=dict(visible=False, range=[-30, 30], backgroundcolor='rgb(20,20,20)'),
+                    zaxis=dict(visible=False, range=[-30, 30], backgroundcolor='rgb(20,20,20)'),
+                    aspectmode='manual',
+                    aspectratio=dict(x=1, y=1, z=0.6)
+                ),
+                margin=dict(l=0, r=0, b=0, t=0),
+                height=600,
+                paper_bgcolor='rgba(0,0,0,0)'
+            )
+
+        return cls._layout_template_3D
+
+
+    def layout_construction_3D(self, fig_3D):
+        '''
+        Cena escura comum a todas as figuras 3D da lente
+        '''
+        fig_3D.update_layout(self.layout_template_3D())
+        return fig_3D
+
+
+    @staticmethod
+    def adaptive_line_indices(values, axis, tolerance, max_stride):
+        '''
+        Escolhe as linhas (axis=0) ou colunas (axis=1) mantidas na dizimação
+        Uma linha é mantida quando a variação acumulada desde a última mantida passa da tolerância
+        ou quando o espaçamento chega a max_stride; a primeira e a última sempre ficam
+        '''
+
+        n_lines = values.shape[axis]
+        if n_lines <= 2 or max_stride <= 1:
+            return np.arange(n_lines)
+
+        # Maior variação entre linhas vizinhas (NaN fora da lente não conta)
+        step_change = np.abs(np.diff(values, axis=axis))
+        step_change = np.nan_to_num(step_change, nan=0.0).max(axis=1 - axis)
+
+        kept = [0]
+        accumulated = 0.0
+        for line in range(1, n_lines - 1):
+            accumulated += step_change[line - 1]
+            if accumulated >= tolerance or line - kept[-1] >= max_stride:
+                kept.append(line)
+                accumulated = 0.0
+        kept.append(n_lines - 1)
+
+        return np.array(kept)
+
+
+    @staticmethod
+    def grid_triangulation(valid):
+        '''
+        Triangula um grid (res, res) em dois triângulos por célula
+        Células com algum vértice inválido (NaN / fora da lente) são descartadas
+        Retorna os índices (i, j, k) dos vértices no grid achatado
+        '''
+
+        rows, cols = valid.shape
+        index = np.arange(rows * cols).reshape(rows, cols)
+
+        # Cantos de cada célula
+        top_left, top_right = index[:-1, :-1], index[:-1, 1:]
+        bottom_left, bottom_right = index[1:, :-1], index[1:, 1:]
+
+        cell_valid = valid[:-1, :-1] & valid[:-1, 1:] & valid[1:, :-1] & valid[1:, 1:]
+        top_left, top_right = top_left[cell_valid], top_right[cell_valid]
+        bottom_left, bottom_right = bottom_left[cell_valid], bottom_right[cell_valid]
+
+        i = np.concatenate((top_left, top_right))
+        j = np.concatenate((bottom_left, bottom_left))
+        k = np.concatenate((top_right, bottom_right))
+        return i, j, k
+
+
+    @classmethod
+    def compact_mesh(cls, valid):
+        '''
+        Triangulação que mantém só os vértices válidos
+        Retorna (vertices, i, j, k): índices dos vértices mantidos no grid achatado
+        e os triângulos já renumerados para a lista compacta
+        '''
+
+        i, j, k = cls.grid_triangulation(valid)
+
+        valid_flat = valid.ravel()
+        vertices = np.flatnonzero(valid_flat)
+        new_index = np.cumsum(valid_flat, dtype=np.int32) - 1
+
+        return vertices, new_index[i], new_index[j], new_index[k]
+
+
+    @traced('Visuals')
+    def figure_rgb_construction_3D(self, img_RGB, X_rot, Y_rot, Z_rot):
+        '''
+        Constrói a lente 3D colorida diretamente por uma imagem RGB (ex.: cor espectral CIE)
+        Usa Mesh3d com cor por vértice, já que Surface só aceita escala de cores
+        '''
+        valid = ~(np.isnan(X_rot) | np.isnan(Y_rot) | np.isnan(Z_rot))
+        vertices, i, j, k = self.compact_mesh(valid)
+
+        vertex_RGB = img_RGB.reshape(-1, 3)[vertices]
+        vertex_color = [f"rgb({R},{G},{B})" for R, G, B in vertex_RGB.tolist()]
+
+        fig_3D = go.Figure(data=[go.Mesh3d(
+                x=np.asarray(X_rot, dtype=np.float32).ravel()[vertices],
+                y=np.asarray(Y_rot, dtype=np.float32).ravel()[vertices],
+                z=np.asarray(Z_rot, dtype=np.float32).ravel()[vertices],
+                i=i, j=j, k=k,
+                vertexcolor=vertex_color,
+                flatshading=True,
+                lighting=dict(ambient=1.0, diffuse=0.0, specular=0.0, roughness=1.0)
+            )], layout=self.layout_template_3D())
+
+        return fig_3D
+
+
+    @traced('Visuals')
+    def animation_construction(self, figures, labels, frame_duration_ms=100):
+        '''
+        Junta figuras de mesmo tipo em uma animação do Plotly: a primeira é o estado inicial
+        e cada uma vira um frame, com botões de play/pausa e slider
+        '''
+
+        frames = [go.Frame(data=figure.data, name=label) for figure, label in zip(figures, labels)]
+        animation = go.Figure(data=figures[0].data, layout=figures[0].layout, frames=frames)
+
+        frame_args = dict(frame=dict(duration=frame_duration_ms, redraw=True), mode='immediate',
+                          transition=dict(duration=0))
+
+        animation.update_layout(
+            meta=None,
+            updatemenus=[dict(
+                type='buttons', showactive=False, x=0.0, y=0.0, xanchor='left', yanchor='top',
+                buttons=[
+                    dict(label='▶', method='animate', args=[None, dict(frame_args, fromcurrent=True)]),
+                    dict(label='⏸', method='animate', args=[[None], dict(frame_args, mode='immediate')]),
+                ],
+            )],
+            sliders=[dict(
+                x=0.1, len=0.9, y=0.0, yanchor='top',
+                steps=[dict(label=label, method='animate', args=[[label], frame_args]) for label in labels],
+            )],
         )
-        return fig_3D
\ No newline at end of file
+        return animation